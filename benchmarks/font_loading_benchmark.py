@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+字體載入基準測試
+比較 ReportLab 原本的 TTFont（整個字體檔讀入記憶體並解析）、mmap 首次載入
+（解析並建立度量快取）與 mmap 載入快取，三種方式在全新行程中的字體初始化
+時間與常駐記憶體（RSS）增量。每次量測都在獨立的子行程中進行，模擬 worker 啟動。
+
+用法（於專案根目錄執行）：
+    python benchmarks/font_loading_benchmark.py [--font ./edukai-5.0.ttf] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FONTS = ["./edukai-5.0.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
+MODES = ("ttfont", "mmap-cold", "mmap-cached")
+
+# 子行程：先載入 ReportLab 再量測，只計算字體本身的初始化成本
+CHILD_SCRIPT = r"""
+import json, os, resource, sys, time
+sys.path.insert(0, os.getcwd())
+from loguru import logger
+logger.remove()
+from reportlab.pdfbase.ttfonts import TTFont
+from src.request_payment.services.font_loader import load_ttf_font
+
+def rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+mode, font_path, cache_dir = sys.argv[1:4]
+before = rss_kb()
+started = time.perf_counter()
+if mode == "ttfont":
+    font = TTFont("Benchmark-Font", font_path)
+else:
+    font = load_ttf_font("Benchmark-Font", font_path, cache_dir)
+font.stringWidth("請款單 Payment", 12)
+elapsed = time.perf_counter() - started
+print(json.dumps({"init_ms": elapsed * 1000, "rss_kb": rss_kb() - before}))
+"""
+
+
+def run_child(mode: str, font_path: str, cache_dir: str) -> Dict[str, float]:
+    """在全新的子行程中載入字體一次"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, mode, font_path, cache_dir],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(mode: str, font_path: str, runs: int) -> Dict[str, float]:
+    """重複量測並回傳初始化時間與 RSS 增量的中位數"""
+    samples: List[Dict[str, float]] = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if mode == "mmap-cached":
+            run_child(mode, font_path, cache_dir)  # 先建立快取
+        for _ in range(runs):
+            if mode == "mmap-cold":
+                for name in os.listdir(cache_dir):
+                    os.unlink(os.path.join(cache_dir, name))
+            samples.append(run_child(mode, font_path, cache_dir))
+    return {
+        "init_ms": statistics.median(sample["init_ms"] for sample in samples),
+        "rss_kb": statistics.median(sample["rss_kb"] for sample in samples),
+    }
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="比較字體載入方式的初始化時間與記憶體")
+    parser.add_argument("--font", default=None, help="字體檔路徑（預設使用標楷體，找不到時使用 DejaVu Sans）")
+    parser.add_argument("--runs", type=int, default=5, help="每種方式的量測次數")
+    args = parser.parse_args()
+
+    font_path = args.font or next((path for path in DEFAULT_FONTS if os.path.exists(os.path.join(PROJECT_ROOT, path))), None)
+    if not font_path:
+        print("找不到可用的字體檔，請以 --font 指定")
+        return 1
+    font_path = os.path.abspath(os.path.join(PROJECT_ROOT, font_path))
+
+    print(f"{font_path} ({os.path.getsize(font_path) / 1024:.0f} KB)")
+    print(f"{'mode':<12} {'init ms':>9} {'rss KB':>9}")
+    for mode in MODES:
+        result = measure(mode, font_path, args.runs)
+        print(f"{mode:<12} {result['init_ms']:>9.2f} {result['rss_kb']:>9.0f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+大型請款單記憶體基準測試
+以不同的明細筆數渲染請款單至暫存檔（與下載端點相同的路徑），以 tracemalloc
+量測渲染期間的記憶體峰值，確認峰值不隨明細筆數等比例成長。每種筆數都在
+獨立的子行程中量測，避免前一次渲染留下的快取影響結果。
+
+用法（於專案根目錄執行）：
+    python benchmarks/large_form_memory_benchmark.py [--rows 500,2000,5000]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict
+
+from render_engines_benchmark import PROJECT_ROOT
+
+# 子行程：暖機後只量測渲染本身，表單資料在開始追蹤前建立
+CHILD_SCRIPT = r"""
+import json, os, sys, time, tracemalloc
+sys.path.insert(0, os.path.join(os.getcwd(), "benchmarks"))
+from loguru import logger
+logger.remove()
+from render_engines_benchmark import build_form
+from src.request_payment.services.pdf_service import PDFService
+
+service = PDFService()
+service.generate_payment_request_pdf(build_form(3))
+form = build_form(int(sys.argv[1]))
+
+tracemalloc.start()
+started = time.perf_counter()
+with service.generate_payment_request_file(form) as output:
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    size = output.seek(0, os.SEEK_END)
+    spooled = output._rolled
+print(json.dumps({"seconds": elapsed, "peak": peak, "bytes": size, "spooled": spooled}))
+"""
+
+
+def run_child(rows: int) -> Dict[str, float]:
+    """在全新的子行程中渲染一次"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, str(rows)],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="量測大型請款單渲染的記憶體峰值")
+    parser.add_argument("--rows", default="500,2000,5000", help="以逗號分隔的明細筆數")
+    args = parser.parse_args()
+
+    print(f"{'rows':>6} {'seconds':>9} {'peak MB':>9} {'KB/row':>8} {'bytes':>10}  暫存")
+    for rows in (int(value) for value in args.rows.split(",")):
+        result = run_child(rows)
+        print(
+            f"{rows:>6} {result['seconds']:>9.2f} {result['peak'] / 1e6:>9.1f} "
+            f"{result['peak'] / 1024 / rows:>8.2f} {result['bytes']:>10}  "
+            f"{'磁碟' if result['spooled'] else '記憶體'}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+HTTP 負載測試工具
+以 asyncio + httpx 重播上傳、建立、查詢與下載 PDF 的混合流量，
+回報各路由的 p50 / p95 / p99 延遲、錯誤率與吞吐量，用於部署前量測容量變化。
+
+用法（伺服器需先啟動，例如 python -m src.request_payment.main）：
+    # 固定併發數（封閉模型）
+    python benchmarks/load_test.py --concurrency 16 --duration 30
+    # 固定到達速率（開放模型），每秒 50 個請求
+    python benchmarks/load_test.py --rate 50 --duration 30 --mix upload=1,create=2,get=4,pdf=3
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+API_PREFIX = "/api/v1/request-forms"
+OPERATIONS = ("upload", "create", "get", "pdf")
+DEFAULT_MIX = "upload=1,create=2,get=4,pdf=3"
+
+PROJECT_TYPES = [
+    "A.會議(理監事會議、審查會議、幹事會議等)",
+    "B.活動(含年會、各項座談會、年度志工激勵活動、各區學生輔導活動等)",
+    "C.志工培訓(含志工會議)",
+    "D.學校訪談",
+    "E.專案補助",
+    "F.其他",
+]
+EXPENSE_TYPES = [
+    "1.交通費", "2.場地租借", "3.餐費", "4.文宣", "5.電話費",
+    "6.補助", "7.志工津貼", "8.設備器材(含軟硬體)", "9.雜支",
+]
+CONTENT_SAMPLES = ["高鐵來回車票", "場地租借費用 Meeting room", "志工便當 30 份", "海報印刷", "Zoom 月租費用"]
+
+
+@dataclass
+class RouteStats:
+    """單一路由的統計資料"""
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    status_counts: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def percentile(self, pct: float) -> float:
+        """以最近排名法計算百分位數（秒）"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[rank]
+
+
+@dataclass
+class LoadTestConfig:
+    """負載測試設定"""
+    base_url: str
+    duration: float
+    mix: Dict[str, float]
+    concurrency: int
+    rate: Optional[float]
+    detail_rows: int
+    image_bytes: bytes
+    seed_forms: int
+    timeout: float
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """解析流量組成，例如 upload=1,create=2,get=4,pdf=3"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"未知的操作: {name}（可用: {', '.join(OPERATIONS)}）")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("流量組成的權重總和必須大於 0")
+    return mix
+
+
+def build_sample_image(width: int, height: int) -> bytes:
+    """產生測試用的存摺影本 PNG"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def build_form(detail_rows: int, bank_book_image: Optional[str]) -> dict:
+    """產生一份隨機請款單"""
+    details = [
+        {
+            "project_type": random.choice(PROJECT_TYPES),
+            "expense_type": random.choice(EXPENSE_TYPES),
+            "execution_time": f"{random.randint(1, 12):02d}/{random.randint(1, 28):02d}",
+            "execution_content": random.choice(CONTENT_SAMPLES) * random.randint(1, 3),
+            "amount": str(random.randint(100, 50000)),
+        }
+        for _ in range(detail_rows)
+    ]
+    form = {
+        "application_date": "113.01.15",
+        "payee": "負載測試",
+        "payment_method": "匯款" if bank_book_image else "現金",
+        "requesting_unit": "輔導活動執委會",
+        "payment_details": details,
+    }
+    if bank_book_image:
+        form["bank_book_image"] = bank_book_image
+    return form
+
+
+class LoadTester:
+    """混合流量負載產生器"""
+
+    def __init__(self, config: LoadTestConfig):
+        self.config = config
+        self.stats: Dict[str, RouteStats] = defaultdict(RouteStats)
+        self.request_ids: List[str] = []
+        self.bank_book_base64: Optional[str] = None
+        operations, weights = zip(*config.mix.items())
+        self._operations = operations
+        self._weights = weights
+
+    async def _timed(self, route: str, coro) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        stats = self.stats[route]
+        try:
+            response = await coro
+        except httpx.HTTPError as e:
+            stats.latencies.append(time.perf_counter() - started)
+            stats.errors += 1
+            stats.status_counts[type(e).__name__] += 1
+            return None
+
+        stats.latencies.append(time.perf_counter() - started)
+        stats.status_counts[str(response.status_code)] += 1
+        if response.status_code >= 400:
+            stats.errors += 1
+        return response
+
+    async def upload(self, client: httpx.AsyncClient) -> None:
+        files = {"file": ("bankbook.png", self.config.image_bytes, "image/png")}
+        response = await self._timed("POST /upload-image", client.post(f"{API_PREFIX}/upload-image", files=files))
+        if response is not None and response.status_code == 200 and self.bank_book_base64 is None:
+            self.bank_book_base64 = response.json()["file_id"]
+
+    async def create(self, client: httpx.AsyncClient) -> None:
+        form = build_form(self.config.detail_rows, self.bank_book_base64 if random.random() < 0.5 else None)
+        response = await self._timed("POST /", client.post(f"{API_PREFIX}/", json=form))
+        if response is not None and response.status_code == 200:
+            self.request_ids.append(response.json()["id"])
+
+    async def get(self, client: httpx.AsyncClient) -> None:
+        if not self.request_ids:
+            return await self.create(client)
+        request_id = random.choice(self.request_ids)
+        await self._timed("GET /{id}", client.get(f"{API_PREFIX}/{request_id}"))
+
+    async def pdf(self, client: httpx.AsyncClient) -> None:
+        if not self.request_ids:
+            return await self.create(client)
+        request_id = random.choice(self.request_ids)
+        await self._timed("GET /{id}/pdf", client.get(f"{API_PREFIX}/{request_id}/pdf"))
+
+    async def run_one(self, client: httpx.AsyncClient) -> None:
+        operation = random.choices(self._operations, weights=self._weights)[0]
+        await getattr(self, operation)(client)
+
+    async def seed(self, client: httpx.AsyncClient) -> None:
+        """預先上傳一張圖片並建立幾份請款單，讓查詢與下載有資料可用"""
+        await self.upload(client)
+        for _ in range(self.config.seed_forms):
+            await self.create(client)
+        self.stats.clear()
+
+    async def run(self) -> float:
+        limits = httpx.Limits(max_connections=max(self.config.concurrency, 1) * 2)
+        async with httpx.AsyncClient(base_url=self.config.base_url, timeout=self.config.timeout, limits=limits) as client:
+            await self.seed(client)
+            started = time.perf_counter()
+            deadline = started + self.config.duration
+            if self.config.rate:
+                await self._run_open_loop(client, deadline)
+            else:
+                await self._run_closed_loop(client, deadline)
+            return time.perf_counter() - started
+
+    async def _run_closed_loop(self, client: httpx.AsyncClient, deadline: float) -> None:
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.run_one(client)
+
+        await asyncio.gather(*(worker() for _ in range(self.config.concurrency)))
+
+    async def _run_open_loop(self, client: httpx.AsyncClient, deadline: float) -> None:
+        # 以固定速率送出請求，併發上限避免伺服器過載時任務無限累積
+        semaphore = asyncio.Semaphore(self.config.concurrency)
+        interval = 1 / self.config.rate
+        tasks = set()
+
+        async def fire():
+            async with semaphore:
+                await self.run_one(client)
+
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            task = asyncio.create_task(fire())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+def format_report(stats: Dict[str, RouteStats], elapsed: float) -> str:
+    """格式化各路由的統計結果"""
+    header = f"{'route':<20} {'count':>7} {'errors':>7} {'err%':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    lines = [header, "-" * len(header)]
+    total = RouteStats()
+    for route, route_stats in sorted(stats.items()):
+        total.latencies.extend(route_stats.latencies)
+        total.errors += route_stats.errors
+        lines.append(_format_row(route, route_stats, elapsed))
+    lines.append("-" * len(header))
+    lines.append(_format_row("total", total, elapsed))
+    return "\n".join(lines)
+
+
+def _format_row(route: str, stats: RouteStats, elapsed: float) -> str:
+    count = len(stats.latencies)
+    error_rate = stats.errors / count * 100 if count else 0.0
+    return (
+        f"{route:<20} {count:>7} {stats.errors:>7} {error_rate:>5.1f}% {count / elapsed:>8.1f} "
+        f"{stats.percentile(50) * 1000:>9.1f} {stats.percentile(95) * 1000:>9.1f} "
+        f"{stats.percentile(99) * 1000:>9.1f} {max(stats.latencies, default=0) * 1000:>9.1f}"
+    )
+
+
+def report_as_json(stats: Dict[str, RouteStats], elapsed: float) -> dict:
+    """以 JSON 格式輸出，方便比較不同版本的容量"""
+    return {
+        "elapsed_seconds": elapsed,
+        "routes": {
+            route: {
+                "count": len(route_stats.latencies),
+                "errors": route_stats.errors,
+                "throughput_rps": len(route_stats.latencies) / elapsed,
+                "p50_ms": route_stats.percentile(50) * 1000,
+                "p95_ms": route_stats.percentile(95) * 1000,
+                "p99_ms": route_stats.percentile(99) * 1000,
+                "status_counts": dict(route_stats.status_counts),
+            }
+            for route, route_stats in sorted(stats.items())
+        },
+    }
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="RequestPayment HTTP 負載測試")
+    parser.add_argument("--base-url", default="http://localhost:7860", help="伺服器位址")
+    parser.add_argument("--duration", type=float, default=30, help="測試秒數")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"流量組成（預設 {DEFAULT_MIX}）")
+    parser.add_argument("--concurrency", type=int, default=8, help="併發數（固定速率模式下為併發上限）")
+    parser.add_argument("--rate", type=float, default=None, help="固定到達速率（每秒請求數），未指定則使用固定併發")
+    parser.add_argument("--rows", type=int, default=5, help="每份請款單的明細筆數")
+    parser.add_argument("--image-size", default="800x600", help="測試存摺影本尺寸，例如 800x600")
+    parser.add_argument("--seed-forms", type=int, default=10, help="測試前預先建立的請款單數量")
+    parser.add_argument("--timeout", type=float, default=60, help="單一請求逾時秒數")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式輸出結果")
+    args = parser.parse_args()
+
+    width, height = (int(part) for part in args.image_size.lower().split("x"))
+    config = LoadTestConfig(
+        base_url=args.base_url,
+        duration=args.duration,
+        mix=args.mix,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        detail_rows=args.rows,
+        image_bytes=build_sample_image(width, height),
+        seed_forms=args.seed_forms,
+        timeout=args.timeout,
+    )
+
+    tester = LoadTester(config)
+    elapsed = asyncio.run(tester.run())
+
+    if args.json:
+        print(json.dumps(report_as_json(tester.stats, elapsed), ensure_ascii=False, indent=2))
+    else:
+        mode = f"rate={args.rate}/s" if args.rate else f"concurrency={args.concurrency}"
+        print(f"{args.base_url}  {mode}  duration={elapsed:.1f}s  mix={args.mix}")
+        print(format_report(tester.stats, elapsed))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
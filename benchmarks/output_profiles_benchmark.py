@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+PDF 輸出設定檔基準測試
+以一張手機拍攝尺寸的存摺影本（JPEG）渲染請款單，比較各輸出設定檔的
+渲染時間、檔案大小與相對於 standard 的大小，作為選擇設定檔時的參考。
+
+用法（於專案根目錄執行）：
+    python benchmarks/output_profiles_benchmark.py [--rows 5] [--iterations 20] [--image-size 3000x2250]
+"""
+
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from render_engines_benchmark import PROJECT_ROOT, build_form
+
+
+def build_photo(width: int, height: int) -> str:
+    """產生近似照片的 JPEG（漸層加雜訊），回傳 base64"""
+    from PIL import Image, ImageFilter
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(1))
+    photo = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=92)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def measure(service, form: dict, profile: str, iterations: int) -> Dict[str, float]:
+    """重複渲染並回傳平均、p95（毫秒）與輸出大小"""
+    service.generate_payment_request_pdf(form, profile=profile)  # 暖機
+    timings: List[float] = []
+    size = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        size = service.generate_payment_request_pdf(form, profile=profile).getbuffer().nbytes
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "bytes": size,
+    }
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="比較 PDF 輸出設定檔的檔案大小與渲染時間")
+    parser.add_argument("--rows", type=int, default=5, help="明細筆數")
+    parser.add_argument("--iterations", type=int, default=20, help="每個設定檔的渲染次數")
+    parser.add_argument("--image-size", default="3000x2250", help="存摺影本尺寸，例如 3000x2250；0x0 表示不附圖片")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+
+    from loguru import logger
+
+    logger.remove()
+    from src.request_payment.services.pdf_output import OUTPUT_PROFILES, _find_qpdf
+    from src.request_payment.services.pdf_service import PDFService
+
+    service = PDFService()
+    width, height = (int(part) for part in args.image_size.lower().split("x"))
+    form = build_form(args.rows, build_photo(width, height) if width and height else None)
+    linearization = "qpdf" if _find_qpdf() else "不可用（未安裝 qpdf）"
+
+    print(f"rows={args.rows}  image={args.image_size}  linearize={linearization}")
+    print(f"{'profile':<10} {'mean ms':>9} {'p95 ms':>9} {'bytes':>10} {'size':>7}  說明")
+    baseline = None
+    for name, profile in OUTPUT_PROFILES.items():
+        result = measure(service, form, name, args.iterations)
+        baseline = baseline or result["bytes"]
+        print(
+            f"{name:<10} {result['mean_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['bytes']:>10} "
+            f"{result['bytes'] / baseline:>6.0%}  {profile.description}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
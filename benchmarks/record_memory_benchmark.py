@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+請款單紀錄記憶體基準測試
+以相同的請款單內容分別建立先前的 dict 紀錄（Pydantic 明細模型、base64 字串與
+解碼後的圖片）與 FormRecord，以 tracemalloc 量測每張請款單常駐的位元組數。
+每張表單的文字欄位都是獨立產生的字串，與實際請求相同，不會因共用而低估。
+
+用法（於專案根目錄執行）：
+    python benchmarks/record_memory_benchmark.py [--forms 20000] [--rows 1,3,10] [--image-kb 0,200]
+"""
+
+import argparse
+import base64
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+import render_engines_benchmark  # noqa: F401  將專案根目錄加入 sys.path
+from loguru import logger
+
+logger.remove()
+
+from src.request_payment.models.schemas import RequestFormCreate  # noqa: E402
+from src.request_payment.services.bank_book import BankBookImage  # noqa: E402
+from src.request_payment.services.form_record import FormRecord  # noqa: E402
+
+
+def build_payload(index: int, rows: int, image_bytes: int) -> Dict[str, Any]:
+    """產生一張請款單的請求內容（base64 圖片內容每張不同）"""
+    payload = {
+        "application_date": f"113.{index % 12 + 1:02d}.15",
+        "payee": f"受款人{index}",
+        "payment_method": "匯款" if image_bytes else "現金",
+        "requesting_unit": "輔導活動執委會",
+        "payment_details": [
+            {
+                "project_type": "B.活動(含年會、各項座談會、年度志工激勵活動、各區學生輔導活動等)",
+                "expense_type": "1.交通費",
+                "execution_time": f"{row % 12 + 1:02d}/15",
+                "execution_content": f"台北到高雄的高鐵來回票 {index}-{row}",
+                "amount": f"{1200 + row}.50",
+                "receipt_note": f"發票 AB{index:08d}",
+            }
+            for row in range(rows)
+        ],
+    }
+    if image_bytes:
+        payload["bank_book_image"] = base64.b64encode(os.urandom(image_bytes)).decode()
+    return payload
+
+
+def _bank_book(request: RequestFormCreate):
+    # 不需要真的是圖片：只量測紀錄保存的位元組
+    if not request.bank_book_image:
+        return None
+    return BankBookImage(base64.b64decode(request.bank_book_image), 800, 600, "PNG")
+
+
+def build_dict(request_id: str, request: RequestFormCreate) -> Dict[str, Any]:
+    """先前的紀錄格式"""
+    return {
+        "id": request_id,
+        "application_date": request.application_date,
+        "payee": request.payee,
+        "payment_method": request.payment_method,
+        "payment_method_other": request.payment_method_other,
+        "requesting_unit": request.requesting_unit,
+        "requesting_unit_other": request.requesting_unit_other,
+        "total_amount": sum(item.amount for item in request.payment_details),
+        "payment_details": request.payment_details,
+        "bank_book_image": request.bank_book_image,
+        "bank_book": _bank_book(request),
+        "created_at": datetime.now(),
+        "updated_at": None,
+        "version": 1,
+        "pdf_url": f"/api/v1/request-forms/{request_id}/pdf",
+    }
+
+
+def build_record(request_id: str, request: RequestFormCreate) -> FormRecord:
+    return FormRecord(request_id, request, bank_book=_bank_book(request), created_at=datetime.now())
+
+
+def measure(build: Callable[[str, RequestFormCreate], Any], forms: int, rows: int, image_bytes: int) -> float:
+    """建立 forms 張紀錄，回傳每張常駐的位元組數（不含請款單編號，兩種格式相同）"""
+    ids = [f"{index:036d}" for index in range(forms)]
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    storage = {}
+    for index, request_id in enumerate(ids):
+        request = RequestFormCreate(**build_payload(index, rows, image_bytes))
+        storage[request_id] = build(request_id, request)
+        del request
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    storage.clear()
+    return (current - baseline) / forms
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="比較請款單紀錄格式的記憶體用量")
+    parser.add_argument("--forms", type=int, default=20000, help="每種組合建立的請款單張數")
+    parser.add_argument("--rows", default="1,3,10", help="以逗號分隔的每張明細筆數")
+    parser.add_argument("--image-kb", default="0,200", help="以逗號分隔的存摺影本大小（KB，0 為不附圖片）")
+    args = parser.parse_args()
+
+    print(f"{'rows':>5} {'image KB':>9} {'forms':>7} {'dict B/form':>12} {'record B/form':>14} {'saved':>7}")
+    for image_kb in (int(value) for value in args.image_kb.split(",")):
+        # 附圖片時每張請款單佔用數百 KB，減少張數以免耗盡記憶體
+        forms = args.forms if not image_kb else max(1, min(args.forms, 200_000 // image_kb))
+        for rows in (int(value) for value in args.rows.split(",")):
+            before = measure(build_dict, forms, rows, image_kb * 1024)
+            after = measure(build_record, forms, rows, image_kb * 1024)
+            print(f"{rows:>5} {image_kb:>9} {forms:>7} {before:>12.0f} {after:>14.0f} {1 - after / before:>7.1%}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
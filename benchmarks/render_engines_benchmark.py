@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+PDF 渲染引擎基準測試
+比較 Platypus（SimpleDocTemplate / Table）與直接繪製於 canvas 的快速渲染引擎，
+在不同明細筆數下每份請款單的渲染時間與輸出大小。
+
+用法（於專案根目錄執行）：
+    python benchmarks/render_engines_benchmark.py [--rows 1,3,5,9] [--iterations 50] [--bank-book]
+"""
+
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+ENGINES = ("platypus", "canvas")
+
+
+def build_form(rows: int, bank_book_image: str = None) -> dict:
+    """產生測試用請款單資料"""
+    from decimal import Decimal
+
+    details = [
+        {
+            "project_type": "A.會議(理監事會議、審查會議、幹事會議等)",
+            "expense_type": "1.交通費",
+            "execution_time": f"01/{index + 1:02d}",
+            "execution_content": "台北到高雄的高鐵來回票" * (index % 3 + 1),
+            "amount": Decimal("1200"),
+        }
+        for index in range(rows)
+    ]
+    return {
+        "id": "benchmark",
+        "application_date": "113.01.15",
+        "payee": "基準測試",
+        "payment_method": "匯款" if bank_book_image else "現金",
+        "requesting_unit": "輔導活動執委會",
+        "total_amount": sum(item["amount"] for item in details),
+        "payment_details": details,
+        "bank_book_image": bank_book_image,
+    }
+
+
+def build_bank_book_image() -> str:
+    """產生測試用的存摺影本（base64 PNG）"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((800, 600), 64).convert("RGB").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def measure(service, form: dict, engine: str, iterations: int) -> Dict[str, float]:
+    """重複渲染並回傳平均、p95（毫秒）與輸出大小"""
+    service.generate_payment_request_pdf(form, engine=engine)  # 暖機
+    timings: List[float] = []
+    size = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        size = service.generate_payment_request_pdf(form, engine=engine).getbuffer().nbytes
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "bytes": size,
+    }
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="比較 Platypus 與 canvas 快速渲染引擎")
+    parser.add_argument("--rows", default="1,3,5,9", help="要測試的明細筆數，以逗號分隔")
+    parser.add_argument("--iterations", type=int, default=50, help="每種組合的渲染次數")
+    parser.add_argument("--bank-book", action="store_true", help="包含存摺影本頁面")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+
+    from loguru import logger
+
+    logger.remove()
+    from src.request_payment.services.pdf_service import PDFService
+
+    service = PDFService()
+    bank_book_image = build_bank_book_image() if args.bank_book else None
+
+    print(f"{'rows':>5} {'engine':<10} {'mean ms':>9} {'p95 ms':>9} {'bytes':>9} {'speedup':>8}")
+    for rows in (int(value) for value in args.rows.split(",")):
+        form = build_form(rows, bank_book_image)
+        results = {engine: measure(service, form, engine, args.iterations) for engine in ENGINES}
+        baseline = results["platypus"]["mean_ms"]
+        for engine in ENGINES:
+            result = results[engine]
+            speedup = baseline / result["mean_ms"] if result["mean_ms"] else 0.0
+            print(f"{rows:>5} {engine:<10} {result['mean_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['bytes']:>9} {speedup:>7.2f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
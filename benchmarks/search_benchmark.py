@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+全文檢索基準測試
+以隨機產生的請款單（預設 25 萬張、每張 4 筆明細，共 100 萬筆明細）建立
+反向索引，回報建立速度、記憶體用量，以及各類查詢（受款人全名、常見詞、
+罕見詞、單一中文字、多詞組合）的延遲分佈，以及背景持續執行多詞查詢時
+加入新請款單的延遲（查詢只在複製 posting 時持有索引鎖）。
+
+用法（於專案根目錄執行）：
+    python benchmarks/search_benchmark.py [--forms 250000] [--rows 4] [--queries 200]
+"""
+
+import argparse
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from render_engines_benchmark import PROJECT_ROOT  # noqa: F401  (設定 sys.path)
+
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周"
+GIVEN_NAMES = "志明美玲家豪淑芬建宏怡君俊傑雅婷宗翰佩珊冠宇欣怡承恩詩涵"
+PLACES = ["台北", "新竹", "台中", "台南", "高雄", "花蓮", "宜蘭", "嘉義", "屏東", "基隆"]
+ACTIVITIES = ["理監事會議", "志工培訓", "學校訪談", "年會場地", "座談會", "輔導活動", "文宣印刷", "設備採購"]
+EXPENSES = ["高鐵來回票", "便當", "場地租借", "海報輸出", "電話費", "志工津貼", "筆記型電腦", "雜支"]
+
+
+def build_records(forms: int, rows: int, seed: int = 42):
+    """產生測試用請款單（只含索引需要的欄位）"""
+    rng = random.Random(seed)
+    for number in range(forms):
+        payee = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES)
+        details = [
+            {
+                "execution_content": f"{rng.choice(PLACES)}{rng.choice(ACTIVITIES)}{rng.choice(EXPENSES)} 第{rng.randint(1, 500)}場",
+                "receipt_note": rng.choice(["", "發票", "收據", f"INV{rng.randint(10000, 99999)}"]),
+            }
+            for _ in range(rows)
+        ]
+        yield f"form-{number}", {"payee": payee, "payment_details": details}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="量測請款單全文檢索的建立與查詢效能")
+    parser.add_argument("--forms", type=int, default=250_000, help="請款單張數")
+    parser.add_argument("--rows", type=int, default=4, help="每張請款單的明細筆數")
+    parser.add_argument("--queries", type=int, default=200, help="每類查詢的次數")
+    args = parser.parse_args()
+
+    from src.request_payment.services.search_index import SearchIndex
+
+    index = SearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for key, record in build_records(args.forms, args.rows):
+        index.add(key, record)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"索引 {args.forms} 張請款單（{args.forms * args.rows} 筆明細）："
+        f"{elapsed:.1f} 秒，{args.forms / elapsed:,.0f} 張/秒，RSS 增加約 {(rss_after - rss_before) / 1024:.0f} MB"
+    )
+
+    rng = random.Random(7)
+    query_sets: Dict[str, List[str]] = {
+        "受款人全名": [rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES) for _ in range(args.queries)],
+        "常見詞": [rng.choice(PLACES) for _ in range(args.queries)],
+        "單一中文字": [rng.choice(SURNAMES) for _ in range(args.queries)],
+        "多詞組合": [f"{rng.choice(PLACES)} {rng.choice(EXPENSES)}" for _ in range(args.queries)],
+        "罕見詞": [f"INV{rng.randint(10000, 99999)}" for _ in range(args.queries)],
+    }
+
+    print(f"{'查詢':<10} {'hits(中位數)':>12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, queries in query_sets.items():
+        latencies, hits = [], []
+        for query in queries:
+            started = time.perf_counter()
+            total, _ = index.search(query, limit=20)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits.append(total)
+        print(
+            f"{name:<10} {statistics.median(hits):>12,.0f} {percentile(latencies, 0.5):>8.2f} "
+            f"{percentile(latencies, 0.95):>8.2f} {max(latencies):>8.2f}"
+        )
+
+    # 背景執行緒不斷查詢時，量測加入請款單要等多久
+    stop = threading.Event()
+
+    def keep_searching() -> None:
+        queries = query_sets["多詞組合"]
+        while not stop.is_set():
+            for query in queries:
+                if stop.is_set():
+                    break
+                index.search(query, limit=20)
+
+    searcher = threading.Thread(target=keep_searching, daemon=True)
+    searcher.start()
+    latencies = []
+    for key, record in build_records(args.queries, args.rows, seed=99):
+        started = time.perf_counter()
+        index.add(f"new-{key}", record)
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+    stop.set()
+    searcher.join()
+    print(
+        f"{'查詢中新增':<10} {'':>12} {percentile(latencies, 0.5):>8.2f} "
+        f"{percentile(latencies, 0.95):>8.2f} {max(latencies):>8.2f}"
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
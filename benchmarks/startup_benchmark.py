@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+啟動效能基準測試
+量測模組匯入時間分佈，以及從啟動 uvicorn 到第一個回應（健康檢查與第一次 PDF 下載）所需的時間。
+
+用法（於專案根目錄執行）：
+    python benchmarks/startup_benchmark.py [--runs 3] [--port 7861] [--top 15]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULE = "src.request_payment.main"
+
+SAMPLE_FORM = {
+    "application_date": "113.01.01",
+    "payee": "基準測試",
+    "payment_method": "現金",
+    "requesting_unit": "輔導活動執委會",
+    "payment_details": [
+        {
+            "project_type": "A.會議(理監事會議、審查會議、幹事會議等)",
+            "expense_type": "1.交通費",
+            "execution_time": "01/01",
+            "execution_content": "冷啟動量測",
+            "amount": "100",
+        }
+    ],
+}
+
+
+def measure_import_time(top: int) -> Tuple[float, List[Tuple[str, float]]]:
+    """使用 -X importtime 量測匯入主程式的時間，回傳總時間與各頂層套件的匯入時間（毫秒）"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {APP_MODULE}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    packages: Dict[str, float] = defaultdict(float)
+    total_us = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, timings = line.split(":", 1)
+        self_us, cumulative, name = (part.strip() for part in timings.split("|"))
+        # 以各模組自身（self）時間依頂層套件加總，避免巢狀匯入重複計算
+        packages[name.split(".")[0]] += float(self_us)
+        if name == APP_MODULE:
+            total_us = float(cumulative)
+
+    breakdown = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total_us / 1000, [(name, us / 1000) for name, us in breakdown]
+
+
+def measure_first_response(port: int) -> Dict[str, float]:
+    """啟動 uvicorn 並量測到第一個健康檢查回應與第一次 PDF 下載的時間（秒）"""
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{APP_MODULE}:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    timings = {}
+    try:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("uvicorn 提前結束")
+                try:
+                    if client.get("/health").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            timings["health"] = time.perf_counter() - started
+
+            response = client.post("/api/v1/request-forms/", json=SAMPLE_FORM)
+            response.raise_for_status()
+            request_id = response.json()["id"]
+
+            pdf_started = time.perf_counter()
+            client.get(f"/api/v1/request-forms/{request_id}/pdf").raise_for_status()
+            timings["first_pdf"] = time.perf_counter() - pdf_started
+            timings["total"] = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return timings
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="RequestPayment 啟動效能基準測試")
+    parser.add_argument("--runs", type=int, default=3, help="重複次數")
+    parser.add_argument("--port", type=int, default=7861, help="測試用埠號")
+    parser.add_argument("--top", type=int, default=15, help="顯示匯入時間前幾名的套件")
+    args = parser.parse_args()
+
+    total_ms, breakdown = measure_import_time(args.top)
+    print(f"匯入 {APP_MODULE}: {total_ms:.1f} ms")
+    print("各頂層套件匯入時間:")
+    for name, ms in breakdown:
+        print(f"  {name:<30} {ms:8.1f} ms")
+
+    print()
+    print(f"{'run':>4} {'health (s)':>12} {'first pdf (s)':>15} {'total (s)':>11}")
+    for run in range(1, args.runs + 1):
+        timings = measure_first_response(args.port)
+        print(f"{run:>4} {timings['health']:>12.3f} {timings['first_pdf']:>15.3f} {timings['total']:>11.3f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""Debug API endpoints (admin only)."""
+
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from ....core.profiling import get_profile_ring, verify_admin_token
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+
+@router.get("/profiles", summary="List captured request profiles")
+async def list_profiles() -> List[Dict[str, Any]]:
+    """List CPU and memory profiles captured for individual requests."""
+    return get_profile_ring().list()
+
+
+@router.get("/profiles/{name}", summary="Fetch a captured request profile")
+async def get_profile(name: str):
+    """Return a captured profile file as plain text."""
+    path = get_profile_ring().path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="找不到指定的剖析檔案")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=name)
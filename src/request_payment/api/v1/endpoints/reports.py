@@ -0,0 +1,66 @@
+"""支出統計報表 API endpoints."""
+
+import re
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from loguru import logger
+
+from ....core.profiling import verify_admin_token
+from ....models.schemas import (
+    ExpenseType,
+    ProjectType,
+    RequestingUnit,
+    SpendingRebuildResponse,
+    SpendingReportResponse,
+)
+from ....services.spending_report import DIMENSIONS, spending_aggregates
+from .request_forms import payment_requests_storage
+
+router = APIRouter()
+
+_MONTH = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+@router.get("/spending", response_model=SpendingReportResponse)
+async def get_spending_report(
+    group_by: List[str] = Query([], description=f"分組維度，可重複指定：{' / '.join(DIMENSIONS)}"),
+    requesting_unit: Optional[RequestingUnit] = Query(None, description="只統計指定的請款單位"),
+    project_type: Optional[ProjectType] = Query(None, description="只統計指定的專案類型"),
+    expense_type: Optional[ExpenseType] = Query(None, description="只統計指定的費用類型"),
+    month_from: Optional[str] = Query(None, description="起始月份（西元 YYYY-MM，含）"),
+    month_to: Optional[str] = Query(None, description="結束月份（西元 YYYY-MM，含）"),
+):
+    """依請款單位、專案類型、費用類型與月份統計支出
+
+    統計值在建立與更新請款單時逐筆累加，查詢時間與請款單數量無關。月份以
+    申請日期（民國年）換算為西元年月，未填寫申請日期時使用建立時間。
+    """
+    for month in (month_from, month_to):
+        if month is not None and not _MONTH.match(month):
+            raise HTTPException(status_code=422, detail=f"月份格式應為 YYYY-MM：{month}")
+
+    filters = {
+        "requesting_unit": requesting_unit.value if requesting_unit else None,
+        "project_type": project_type.value if project_type else None,
+        "expense_type": expense_type.value if expense_type else None,
+    }
+    try:
+        return spending_aggregates.query(list(dict.fromkeys(group_by)), filters, month_from, month_to)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.post(
+    "/spending/rebuild",
+    response_model=SpendingRebuildResponse,
+    dependencies=[Depends(verify_admin_token)],
+)
+async def rebuild_spending_report():
+    """從請款單儲存重新計算支出統計（需要管理員權杖）"""
+    started = time.perf_counter()
+    forms = spending_aggregates.rebuild(list(payment_requests_storage.values()))
+    seconds = time.perf_counter() - started
+    logger.info("支出統計已重新計算", forms=forms, seconds=round(seconds, 3))
+    return SpendingRebuildResponse(forms=forms, seconds=seconds)
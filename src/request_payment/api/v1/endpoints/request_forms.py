@@ -5,29 +5,63 @@ import io
 import uuid
 import urllib.parse
 import os
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Response
+from fastapi import APIRouter, Depends, Form, Header, HTTPException, UploadFile, File, Query, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import ValidationError
 
+from loguru import logger
+
+from ....core.config import get_settings
+from ....core.idempotency import IDEMPOTENCY_KEY_HEADER, IdempotentRoute
+from ....core.logger import summarize_payment_data
+from ....core.metrics import record_cache_lookup
+from ....core.profiling import run_in_threadpool
+from ....core.tracing import TracedRoute, start_span
 from ....models.schemas import (
+    ExportFormat,
     RequestFormCreate,
+    RequestFormUpdate,
     RequestFormResponse,
     PaymentDetailItem,
     FileUploadResponse,
     PaymentMethod,
-    RequestingUnit
+    RequestingUnit,
+    SearchHit,
+    SearchResponse,
 )
-from ....services.pdf_service import PDFService
 from ....services import file_manager, FileType
+from ....services.bank_book import BankBookImage, decode_bank_book_image, load_bank_book_image
+from ....services.form_export import FormFilter, iter_csv, iter_detail_rows, iter_xlsx
+from ....services.form_record import FormRecord
+from ....services.prerender import prerenderer, rendered_pdfs
+from ....services.search_index import search_index
+from ....services.spending_report import spending_aggregates
+from ....utils.http_cache import RangeNotSatisfiable, etag_matches, iter_file_range, make_file_etag, parse_range
 from ....utils.validators import validate_image_file
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 # 儲存請款單的記憶體數據 (簡化版本，適合 Hugging Face Spaces 部署)
-payment_requests_storage = {}
+payment_requests_storage: Dict[str, FormRecord] = {}
+
+# 已渲染過的 PDF ETag：(請款單編號, 版本, 輸出設定檔) → ETag。
+# PDF 輸出是可重現的，條件式請求命中已知的 ETag 時不必重新渲染即可回傳 304
+_pdf_etags: "OrderedDict[Tuple[str, int, str], str]" = OrderedDict()
+_PDF_ETAG_CACHE_SIZE = 1024
+
+_MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+_EXPORT_MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
 
 
 @router.post("/upload-image", response_model=FileUploadResponse)
@@ -54,96 +88,307 @@ async def upload_bank_book_image(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"檔案上傳失敗: {str(e)}")
 
 
-@router.post("/", response_model=RequestFormResponse)
-async def create_payment_request(request: RequestFormCreate):
-    """創建請款單"""
+async def _decode_bank_book(image_base64: Optional[str]) -> Optional[BankBookImage]:
+    """在執行緒池中解碼並驗證存摺影本，無法使用時回傳 422"""
+    if not image_base64:
+        return None
+    try:
+        with start_span("bank_book.decode", base64_length=len(image_base64)):
+            return await run_in_threadpool(decode_bank_book_image, image_base64, get_settings().max_file_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def create_payment_request(
+    request: RequestFormCreate,
+    idempotency_key: Optional[str] = Header(
+        None, alias=IDEMPOTENCY_KEY_HEADER, description="同一個值重送時回傳原始結果，不會重複建立請款單"
+    ),
+):
+    """創建請款單
+
+    存摺影本在此解碼並驗證一次，解碼結果隨紀錄保存，下載 PDF 時直接使用；
+    紀錄只保留解碼後的圖片，不保留 base64 字串。
+    重複送出（相同的 Idempotency-Key，或短時間內內容完全相同）時由
+    IdempotentRoute 直接回放第一次的回應。
+    """
+    bank_book = await _decode_bank_book(request.bank_book_image)
+    return _store_new_request(request, bank_book)
+
+
+def _store_new_request(request: RequestFormCreate, bank_book: Optional[BankBookImage]) -> RequestFormResponse:
+    """儲存已驗證的新請款單並更新統計與檢索索引（JSON 與 multipart 建立共用）"""
     try:
-        # 計算總金額
-        total_amount = sum(item.amount for item in request.payment_details)
-        
         # 生成請款單 ID
         request_id = str(uuid.uuid4())
         
-        # 儲存請款單數據
-        payment_request_data = {
-            "id": request_id,
-            "application_date": request.application_date,
-            "payee": request.payee,
-            "payment_method": request.payment_method,
-            "payment_method_other": request.payment_method_other,
-            "requesting_unit": request.requesting_unit,
-            "requesting_unit_other": request.requesting_unit_other,
-            "total_amount": total_amount,
-            "payment_details": request.payment_details,
-            "bank_book_image": request.bank_book_image,
-            "created_at": datetime.now(),
-            "pdf_url": f"/api/v1/request-forms/{request_id}/pdf"
-        }
+        with start_span("form.store", request_id=request_id, rows=len(request.payment_details)):
+            # 儲存請款單數據（總金額由明細計算）
+            payment_request_data = FormRecord(request_id, request, bank_book=bank_book, created_at=datetime.now())
+            
+            payment_requests_storage[request_id] = payment_request_data
+            spending_aggregates.add(payment_request_data)
+            search_index.add(request_id, payment_request_data)
         
-        payment_requests_storage[request_id] = payment_request_data
+        # 使用者通常接著就會下載，CPU 有餘裕時先在背景渲染預設設定檔的 PDF
+        prerenderer.schedule(payment_request_data, get_settings().pdf_output_profile.lower())
         
-        return RequestFormResponse(**payment_request_data)
+        return payment_request_data.to_response()
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"創建請款單失敗: {str(e)}")
 
 
+router.add_api_route(
+    "/",
+    create_payment_request,
+    methods=["POST"],
+    response_model=RequestFormResponse,
+    route_class_override=IdempotentRoute,
+)
+
+
+async def _receive_bank_book(upload: UploadFile) -> BankBookImage:
+    """讀出上傳的存摺影本並驗證，超過大小上限或無法使用時回傳 422
+
+    Starlette 解析 multipart 時已將檔案分段寫入暫存檔（較大時轉存到磁碟），這裡
+    只讀出一次。驗證後的圖片與 JSON 建立端點相同，隨紀錄保存，不另外寫入儲存空間。
+    """
+    max_size = get_settings().max_file_size
+    size_error = HTTPException(status_code=422, detail=f"存摺影本不可超過 {max_size / 1024 / 1024:g}MB")
+    if upload.size is not None and upload.size > max_size:
+        raise size_error
+    
+    # 多讀一個位元組即可判斷是否超過上限，不必讀完過大的檔案
+    data = await upload.read(max_size + 1)
+    if len(data) > max_size:
+        raise size_error
+    try:
+        with start_span("bank_book.decode", size=len(data)):
+            return await run_in_threadpool(load_bank_book_image, data, max_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def create_payment_request_multipart(
+    form: str = Form(..., description="請款單欄位的 JSON（與 JSON 建立端點相同，不含 bank_book_image）"),
+    bank_book: Optional[UploadFile] = File(None, description="存摺影本圖片檔案（JPG、PNG、GIF）"),
+    idempotency_key: Optional[str] = Header(
+        None, alias=IDEMPOTENCY_KEY_HEADER, description="同一個值重送時回傳原始結果，不會重複建立請款單"
+    ),
+):
+    """以 multipart/form-data 創建請款單
+
+    存摺影本以二進位檔案上傳，不需要 base64 編碼（傳輸量少三分之一），也不必
+    在 JSON 中解析數 MB 的字串；圖片自上傳暫存檔讀出後驗證一次。其餘規則與
+    JSON 建立端點相同。
+    """
+    try:
+        request = RequestFormCreate.model_validate_json(form, context={"bank_book_attached": bank_book is not None})
+    except ValidationError as e:
+        # 錯誤位置標示在 form 欄位之下，與 JSON 建立端點的 body 錯誤對應
+        raise RequestValidationError([{**error, "loc": ("body", "form", *error["loc"])} for error in e.errors()])
+    if bank_book is not None and request.bank_book_image:
+        raise HTTPException(status_code=422, detail="存摺影本請以檔案或 base64 其中一種方式提供")
+    
+    if bank_book is not None:
+        image = await _receive_bank_book(bank_book)
+    else:
+        image = await _decode_bank_book(request.bank_book_image)
+    return _store_new_request(request, image)
+
+
+router.add_api_route(
+    "/multipart",
+    create_payment_request_multipart,
+    methods=["POST"],
+    response_model=RequestFormResponse,
+    route_class_override=IdempotentRoute,
+)
+
+
+@router.get("/search", response_model=SearchResponse)
+async def search_payment_requests(
+    q: str = Query(..., min_length=1, max_length=200, description="搜尋字詞，以空白分隔多個詞"),
+    page: int = Query(1, ge=1, description="頁碼"),
+    page_size: int = Query(20, ge=1, le=100, description="每頁筆數"),
+):
+    """全文檢索請款單
+
+    比對受款人、執行內容、備註憑證與「其他」說明欄位，結果須包含所有搜尋字詞，
+    依相關度排序（受款人相符的排在前面，分數相同時較新的在前）。
+    """
+    total, hits = await run_in_threadpool(search_index.search, q, (page - 1) * page_size, page_size)
+    items = []
+    for request_id, score in hits:
+        record = payment_requests_storage.get(request_id)
+        if record is not None:
+            items.append(SearchHit(score=score, **{name: record[name] for name in (
+                "id", "payee", "requesting_unit", "total_amount", "created_at"
+            )}))
+    return SearchResponse(query=q, total=total, page=page, page_size=page_size, items=items)
+
+
+def _form_filter(
+    requesting_unit: Optional[RequestingUnit] = Query(None, description="只列出指定的請款單位"),
+    payment_method: Optional[PaymentMethod] = Query(None, description="只列出指定的付款方式"),
+    month_from: Optional[str] = Query(None, pattern=_MONTH_PATTERN, description="起始月份（西元 YYYY-MM，含）"),
+    month_to: Optional[str] = Query(None, pattern=_MONTH_PATTERN, description="結束月份（西元 YYYY-MM，含）"),
+) -> FormFilter:
+    """列表與匯出共用的篩選條件；月份與支出統計相同，以申請日期換算"""
+    return FormFilter(
+        requesting_unit=requesting_unit.value if requesting_unit else None,
+        payment_method=payment_method.value if payment_method else None,
+        month_from=month_from,
+        month_to=month_to,
+    )
+
+
+@router.get("/export")
+async def export_payment_details(
+    format: ExportFormat = Query(ExportFormat.CSV, description="匯出格式"),
+    filters: FormFilter = Depends(_form_filter),
+):
+    """匯出請款明細（每筆明細一列，附請款單表頭欄位）
+
+    以產生器逐批串流輸出，記憶體用量與匯出筆數無關。只先取得目前請款單紀錄的
+    參照；更新請款單會以新的紀錄取代，匯出期間的修改不會造成同一張請款單
+    前後不一致。
+    """
+    records = list(payment_requests_storage.values())
+    rows = iter_detail_rows(filters.apply(records))
+    body = iter_csv(rows) if format is ExportFormat.CSV else iter_xlsx(rows)
+
+    filename = f"請款明細_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format.value}"
+    encoded_filename = urllib.parse.quote(filename, safe='')
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"}
+    logger.info("匯出請款明細", format=format.value, forms=len(records))
+    return StreamingResponse(body, media_type=_EXPORT_MEDIA_TYPES[format], headers=headers)
+
+
 @router.get("/{request_id}", response_model=RequestFormResponse)
 async def get_payment_request(request_id: str):
     """取得請款單詳情"""
     if request_id not in payment_requests_storage:
         raise HTTPException(status_code=404, detail="找不到指定的請款單")
     
-    return RequestFormResponse(**payment_requests_storage[request_id])
+    return payment_requests_storage[request_id].to_response()
+
+
+@router.patch("/{request_id}", response_model=RequestFormResponse)
+async def update_payment_request(request_id: str, update: RequestFormUpdate):
+    """更新請款單
+
+    只需提供要修改的欄位與目前的版本號；版本號與伺服器上的不同時回傳 409，
+    避免覆蓋他人的修改。
+    """
+    if request_id not in payment_requests_storage:
+        raise HTTPException(status_code=404, detail="找不到指定的請款單")
+    
+    current = payment_requests_storage[request_id]
+    if update.version != current.version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"請款單已被修改（目前版本 {current.version}），請重新載入後再試"
+        )
+    
+    # 合併後以建立請款單的規則重新驗證（例如匯款必須附存摺影本）
+    merged = current.form_fields()
+    merged.update(update.model_dump(exclude_unset=True, exclude={"version"}))
+    try:
+        validated = RequestFormCreate(**merged)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    # 存摺影本有更換時才重新解碼
+    if "bank_book_image" in update.model_fields_set:
+        bank_book = await _decode_bank_book(validated.bank_book_image)
+        # 解碼期間可能有其他更新先完成，版本檢查必須與寫入之間沒有 await
+        if payment_requests_storage.get(request_id) is not current:
+            raise HTTPException(status_code=409, detail="請款單已被修改，請重新載入後再試")
+    else:
+        bank_book = current.bank_book
+    
+    # 以新的紀錄取代舊紀錄，正在渲染舊版本的 PDF 仍看到一致的資料
+    updated = FormRecord(
+        request_id,
+        validated,
+        bank_book=bank_book,
+        created_at=current.created_at,
+        updated_at=datetime.now(),
+        version=current.version + 1,
+    )
+    payment_requests_storage[request_id] = updated
+    spending_aggregates.replace(current, updated)
+    search_index.replace(request_id, current, updated)
+    rendered_pdfs.discard_request(request_id)
+    logger.info("請款單已更新", request_id=request_id, version=updated.version)
+    
+    return updated.to_response()
 
 
 @router.get("/{request_id}/pdf")
-async def download_payment_request_pdf(request_id: str):
-    """下載請款單 PDF"""
+async def download_payment_request_pdf(
+    request_id: str,
+    # 不使用 profile 作為參數名稱：?profile=1 是請求剖析的旗標
+    profile: Optional[str] = Query(
+        None, alias="output_profile", description="輸出設定檔：standard / archival / web / mobile，未指定時使用伺服器預設值"
+    ),
+    if_none_match: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+):
+    """下載請款單 PDF
+
+    相同的紀錄與輸出設定檔一定產生相同的位元組，因此回應帶有強 ETag：
+    If-None-Match 符合時回傳 304，並支援單一範圍的 Range 請求（續傳）。
+    PDF 輸出至暫存檔（大型 PDF 轉存到磁碟）後分段串流回應，不在記憶體中保留整份內容。
+    """
     if request_id not in payment_requests_storage:
         raise HTTPException(status_code=404, detail="找不到指定的請款單")
     
+    from ....services.pdf_output import get_output_profile
+
     try:
-        payment_data = payment_requests_storage[request_id]
-        
-        # 添加日誌記錄
-        print(f"開始生成PDF，請款單ID: {request_id}")
-        print(f"請款單數據: {payment_data}")
-        
-        # 使用 PDF 服務生成 PDF
-        pdf_service = PDFService()
-        pdf_buffer = pdf_service.generate_payment_request_pdf(payment_data)
-        
-        # 生成詳細的檔案名稱（只使用時間戳）
-        now = datetime.now()
-        timestamp = now.strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}.pdf"
-        
-        # 獲取PDF內容
-        pdf_content = pdf_buffer.getvalue()
-        print(f"PDF生成成功，大小: {len(pdf_content)} bytes")
-        
-        # URL編碼中文檔名以避免編碼問題
-        encoded_filename = urllib.parse.quote(filename, safe='')
-        
-        # 回傳 PDF 檔案
-        headers = {
-            'Content-Disposition': f'attachment; filename*=UTF-8\'\'{encoded_filename}',
-            'Content-Type': 'application/pdf'
-        }
+        output_profile = get_output_profile(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    payment_data = payment_requests_storage[request_id]
+    etag_key = (request_id, payment_data.get("version", 1), output_profile.name)
+    
+    # 已知 ETag 的條件式請求直接回傳 304，不必渲染
+    known_etag = _pdf_etags.get(etag_key)
+    if if_none_match:
+        record_cache_lookup("pdf_etag", known_etag is not None)
+        if known_etag is not None and etag_matches(if_none_match, known_etag):
+            return Response(status_code=304, headers=_pdf_cache_headers(known_etag))
+    
+    try:
+        # 只記錄摘要欄位，避免把整筆資料（含存摺影本 base64）寫入日誌
+        logger.info("開始生成PDF", **summarize_payment_data(payment_data))
         
-        print(f"PDF下載準備完成，檔名: {filename}")
+        # 建立後預先渲染的結果直接使用，仍在渲染中時等待同一份結果（尚未開始則取消，直接渲染）
+        with start_span("pdf.prerender_wait") as span:
+            prerendered = await prerenderer.wait(etag_key)
+            span.set_attribute("hit", prerendered is not None)
+        record_cache_lookup("pdf_prerender", prerendered is not None)
+        if prerendered is not None:
+            pdf_file = io.BytesIO(prerendered)
+        else:
+            # 使用共用的 PDF 服務在執行緒池中生成 PDF（ReportLab 於第一次下載或暖機時才載入）
+            from ....services.pdf_service import generate_pdf_file_async
+
+            pdf_file = await generate_pdf_file_async(payment_data, profile=output_profile.name)
         
-        return StreamingResponse(
-            io.BytesIO(pdf_content),
-            media_type="application/pdf",
-            headers=headers
-        )
+        # 獲取PDF大小
+        size = pdf_file.seek(0, os.SEEK_END)
+        logger.info("PDF生成成功", request_id=request_id, size=size, profile=output_profile.name)
     
     except Exception as e:
-        print(f"PDF生成失敗: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("PDF生成失敗", request_id=request_id, error=str(e))
         
         # 提供更詳細的錯誤信息
         error_detail = f"PDF生成失敗: {str(e)}"
@@ -153,14 +398,73 @@ async def download_payment_request_pdf(request_id: str):
             error_detail = "PDF生成失敗: 字體載入問題，請檢查字體文件"
         
         raise HTTPException(status_code=500, detail=error_detail)
+    
+    etag = make_file_etag(pdf_file)
+    _remember_pdf_etag(etag_key, etag)
+    headers = _pdf_cache_headers(etag)
+    if etag_matches(if_none_match, etag):
+        pdf_file.close()
+        return Response(status_code=304, headers=headers)
+    
+    # 檔名取自紀錄的建立時間，重新下載時檔名不變
+    timestamp = (payment_data.get("created_at") or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    filename = f"{timestamp}.pdf"
+    
+    # URL編碼中文檔名以避免編碼問題
+    encoded_filename = urllib.parse.quote(filename, safe='')
+    headers['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{encoded_filename}'
+    
+    logger.bind(sample=10).debug("PDF下載準備完成", request_id=request_id, filename=filename)
+    
+    # If-Range 與目前的 ETag 不符時表示檔案已變更，改為回傳完整內容
+    try:
+        byte_range = parse_range(range_header, size) if not if_range or if_range == etag else None
+    except RangeNotSatisfiable:
+        pdf_file.close()
+        headers['Content-Range'] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        status_code = 206
+        start, end = byte_range
+        headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    headers['Content-Length'] = str(end - start + 1)
+    
+    # 回應送出後（或連線中斷時）關閉暫存檔，磁碟上的暫存檔隨之刪除
+    return StreamingResponse(
+        iter_file_range(pdf_file, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+        background=BackgroundTask(pdf_file.close),
+    )
+
+
+def _pdf_cache_headers(etag: str) -> dict:
+    # 內容含個人與帳戶資料，只允許瀏覽器快取；每次使用前以 ETag 重新驗證
+    return {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Accept-Ranges': 'bytes',
+    }
+
+
+def _remember_pdf_etag(key: Tuple[str, int, str], etag: str) -> None:
+    _pdf_etags[key] = etag
+    _pdf_etags.move_to_end(key)
+    while len(_pdf_etags) > _PDF_ETAG_CACHE_SIZE:
+        _pdf_etags.popitem(last=False)
 
 
 @router.get("/")
-async def list_payment_requests():
-    """列出所有請款單"""
+async def list_payment_requests(filters: FormFilter = Depends(_form_filter)):
+    """列出請款單，可依請款單位、付款方式與月份篩選"""
+    items = [record.to_response() for record in filters.apply(payment_requests_storage.values())]
     return {
-        "items": list(payment_requests_storage.values()),
-        "total": len(payment_requests_storage)
+        "items": items,
+        "total": len(items)
     }
 
 
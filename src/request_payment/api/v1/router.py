@@ -1,7 +1,8 @@
 """API v1 main router."""
 
-from fastapi import APIRouter
-from .endpoints import request_forms, health
+from fastapi import APIRouter, Depends
+from .endpoints import request_forms, health, debug, reports
+from ...core.profiling import profile_request
 
 # Create main router for API v1
 router = APIRouter()
@@ -10,10 +11,15 @@ router = APIRouter()
 router.include_router(
     request_forms.router,
     prefix="/request-forms",
-    tags=["request-forms"]
+    tags=["request-forms"],
+    dependencies=[Depends(profile_request)]
 )
 
-
+router.include_router(
+    reports.router,
+    prefix="/reports",
+    tags=["reports"]
+)
 
 router.include_router(
     health.router,
@@ -21,4 +27,10 @@ router.include_router(
     tags=["health"]
 )
 
+router.include_router(
+    debug.router,
+    prefix="/debug",
+    tags=["debug"]
+)
+
  
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""HTTP response compression for RequestPayment system.
+
+Negotiates gzip or brotli from ``Accept-Encoding`` and compresses text-like
+responses (JSON, HTML, CSS, JavaScript) above a size threshold. PDFs,
+images and responses that already carry a ``Content-Encoding`` pass through
+untouched, so the PDF download path keeps its Content-Length, ETag and
+Range handling. Brotli is used only when the optional ``brotli`` package is
+installed.
+"""
+
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .metrics import COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# 值得壓縮的內容類型；PDF 與圖片本身已壓縮，再壓縮只浪費 CPU
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def available_encodings() -> List[str]:
+    """Encodings this process can produce, in order of preference."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def is_compressible_type(content_type: Optional[str]) -> bool:
+    """Whether a Content-Type is worth compressing."""
+    if not content_type:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Sequence[str]) -> Optional[str]:
+    """Pick the encoding with the highest q-value from ``Accept-Encoding``.
+
+    Ties are broken by the order of ``available``; ``identity`` or no match
+    returns None.
+    """
+    if not accept_encoding or not available:
+        return None
+
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+
+    best, best_q = None, 0.0
+    for coding in available:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class _Encoder:
+    """Incremental compressor for one response body."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self._compress = self._compressor.process
+        else:
+            # wbits=31 產生 gzip 標頭，mtime 固定為 0，相同內容的壓縮結果相同
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish() if hasattr(self._compressor, "finish") else self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing text-like responses above a size threshold."""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"), available_encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, _CompressionResponder(self, encoding, send).send)
+
+
+class _CompressionResponder:
+    """Holds back the response start until the first body chunk decides whether to compress."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self._start: Optional[dict] = None
+        self._encoder: Optional[_Encoder] = None
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self._start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._start is not None:
+            start, self._start = self._start, None
+            if not self._should_compress(start, body, more_body):
+                await self._send(start)
+                await self._send(message)
+                return
+            self._encoder = _Encoder(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            # 壓縮後的內容與原始內容不同，強 ETag 降為弱 ETag
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            if more_body:
+                del headers["content-length"]
+                await self._send(start)
+            else:
+                compressed = self._compress(body) + self._finish()
+                headers["Content-Length"] = str(len(compressed))
+                await self._send(start)
+                await self._send({"type": "http.response.body", "body": compressed})
+                return
+        elif self._encoder is None:
+            await self._send(message)
+            return
+
+        chunk = self._compress(body)
+        if not more_body:
+            chunk += self._finish()
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    def _should_compress(self, start: dict, body: bytes, more_body: bool) -> bool:
+        status = start["status"]
+        if status < 200 or status in (204, 206, 304):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers or "no-transform" in headers.get("cache-control", ""):
+            return False
+        if not is_compressible_type(headers.get("content-type")):
+            return False
+        content_length = headers.get("content-length")
+        if content_length is not None:
+            return int(content_length) >= self.middleware.minimum_size
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    def _compress(self, data: bytes) -> bytes:
+        compressed = self._encoder.compress(data)
+        COMPRESSION_BYTES.inc(len(data), encoding=self.encoding, stage="in")
+        COMPRESSION_BYTES.inc(len(compressed), encoding=self.encoding, stage="out")
+        return compressed
+
+    def _finish(self) -> bytes:
+        tail = self._encoder.finish()
+        COMPRESSION_BYTES.inc(len(tail), encoding=self.encoding, stage="out")
+        return tail
@@ -23,6 +23,9 @@ class Settings(BaseSettings):
     environment: str = Field(default="production")  # Changed for Hugging Face Spaces
     debug: bool = Field(default=False)
     log_level: str = Field(default="INFO")
+    log_json: bool = Field(default=False)  # 以 JSON 格式輸出結構化日誌
+    log_max_message_length: int = Field(default=2000)
+    log_max_field_length: int = Field(default=200)
     
     # Server settings (simplified for Hugging Face Spaces)
     host: str = Field(default="0.0.0.0")
@@ -34,6 +37,7 @@ class Settings(BaseSettings):
     algorithm: str = Field(default="HS256")
     access_token_expire_minutes: int = Field(default=30)
     refresh_token_expire_days: int = Field(default=7)
+    admin_token: str = Field(default="")  # 管理員功能（剖析、除錯端點）使用，空值表示停用
     
     # CORS settings (relaxed for demo)
     cors_origins: str = Field(default="*")  # Allow all origins for demo
@@ -48,6 +52,56 @@ class Settings(BaseSettings):
     max_image_size: int = Field(default=2097152)  # 2MB for images
     allowed_file_types: str = Field(default=".jpg,.jpeg,.png,.pdf")
     allowed_image_types: str = Field(default=".jpg,.jpeg,.png")
+    storage_backend: str = Field(default="local")  # 檔案儲存後端：local（IMAGES_DIR）/ s3（S3 相容物件儲存）
+    s3_endpoint_url: str = Field(default="")  # 例如 MinIO 的 http://localhost:9000，空值表示 AWS S3
+    s3_bucket: str = Field(default="")
+    s3_region: str = Field(default="us-east-1")
+    s3_access_key_id: str = Field(default="")
+    s3_secret_access_key: str = Field(default="")
+    s3_prefix: str = Field(default="images/")  # 物件 key 的前綴
+    s3_multipart_chunk_size: int = Field(default=8388608)  # multipart upload 每段大小（至少 5MB）
+    s3_max_connections: int = Field(default=20)  # 連線池大小
+    
+    # HTTP response settings
+    compression_enabled: bool = Field(default=True)  # 依 Accept-Encoding 以 gzip / brotli 壓縮文字類回應
+    compression_min_size: int = Field(default=1024)  # 小於此位元組數的回應不壓縮
+    compression_gzip_level: int = Field(default=6)
+    compression_brotli_quality: int = Field(default=4)  # 即時壓縮使用較低的品質，預先壓縮的靜態檔案使用 11
+    
+    # Idempotency settings
+    idempotency_enabled: bool = Field(default=True)  # 建立請款單時依 Idempotency-Key 或相同內容回放原始回應
+    idempotency_cache_size: int = Field(default=1024)  # 保留的請求結果數量上限
+    idempotency_key_ttl: float = Field(default=86400)  # Idempotency-Key 的有效秒數
+    duplicate_window_seconds: float = Field(default=10)  # 未帶 Idempotency-Key 時，相同內容視為重複送出的秒數
+    
+    # PDF settings
+    pdf_warmup: bool = Field(default=True)  # 啟動後於背景預先載入 ReportLab 與字體
+    pdf_render_concurrency: int = Field(default=2)  # 同時進行的 PDF 渲染數量
+    pdf_fast_path: bool = Field(default=True)  # 請款明細只佔一頁時直接繪製於 canvas，不經 Platypus 排版
+    pdf_output_profile: str = Field(default="standard")  # 預設的 PDF 輸出設定檔：standard / archival / web / mobile
+    pdf_spool_max_memory: int = Field(default=1048576)  # 下載的 PDF 超過此位元組數時暫存至磁碟（1MB）
+    pdf_page_cache_bytes: int = Field(default=0)  # 多頁請款單逐頁渲染的頁面快取上限，0 表示停用（整份渲染）；需要 qpdf
+    pdf_prerender: bool = Field(default=True)  # 建立請款單後於背景預先渲染預設設定檔的 PDF
+    pdf_prerender_cpu_budget: float = Field(default=0.5)  # 行程 CPU 使用率（佔單一核心）超過此比例時不預先渲染
+    pdf_prerender_cache_bytes: int = Field(default=67108864)  # 預先渲染結果儲存區的大小上限（64MB）
+    font_cache_dir: str = Field(default="uploads/temp/fonts")  # 字型度量快取目錄，空值表示停用
+    form_template_dir: str = Field(default="")  # 額外的表單範本目錄（*.json），可新增或覆寫內建範本
+    
+    # Observability settings
+    metrics_enabled: bool = Field(default=True)
+    tracing_enabled: bool = Field(default=False)  # 記錄請求的追蹤 span（上傳、建立、渲染各階段耗時）
+    trace_sample_rate: float = Field(default=0.01)  # 沒有上游 traceparent 時取樣的請求比例
+    trace_exporter: str = Field(default="jsonl")  # jsonl（本機輪替檔案）/ otlp（OTLP/HTTP JSON collector）
+    trace_file: str = Field(default="uploads/temp/traces/spans.jsonl")
+    trace_file_max_bytes: int = Field(default=10485760)  # 超過此大小時輪替（10MB）
+    trace_file_backups: int = Field(default=3)  # 保留的輪替檔案數量
+    trace_otlp_endpoint: str = Field(default="http://localhost:4318/v1/traces")
+    profile_dir: str = Field(default="uploads/temp/profiles")
+    profile_ring_max_bytes: int = Field(default=52428800)  # 50MB
+    profile_ring_max_files: int = Field(default=100)
+    profile_sample_interval_ms: float = Field(default=5.0)
+    profile_traceback_depth: int = Field(default=1)
+    profile_top_allocations: int = Field(default=30)
     
     @field_validator("secret_key")
     @classmethod
@@ -8,6 +8,8 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 from loguru import logger
 import traceback
 
+from .logger import redact
+
 
 class RequestPaymentException(Exception):
     """Base exception for RequestPayment system."""
@@ -23,6 +25,11 @@ class ValidationException(RequestPaymentException):
     pass
 
 
+class StorageException(RequestPaymentException):
+    """Raised when the file storage backend fails."""
+    pass
+
+
 
 
 
@@ -97,7 +104,9 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     Returns:
         JSONResponse: The error response.
     """
-    logger.error(f"Validation error: {exc.errors()}")
+    details = serialize_validation_errors(exc.errors())
+    # 驗證錯誤的 input 可能包含整份請求（含存摺影本 base64），記錄前先遮蔽與截斷
+    logger.error("Validation error", errors=redact(details))
     
     return JSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -106,7 +115,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
                 "code": status.HTTP_422_UNPROCESSABLE_ENTITY,
                 "message": "Validation failed",
                 "type": "validation_error",
-                "details": serialize_validation_errors(exc.errors())
+                "details": details
             }
         }
     )
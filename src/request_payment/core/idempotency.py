@@ -0,0 +1,265 @@
+"""Idempotent replays for non-idempotent endpoints.
+
+Double-clicked submit buttons and client retries on flaky networks send the
+same ``POST`` more than once. Routes declared with ``IdempotentRoute`` look
+each request up before the body is validated:
+
+- With an ``Idempotency-Key`` header, the key identifies the request for
+  ``IDEMPOTENCY_KEY_TTL`` seconds. Reusing a key with a different body is
+  rejected with 422.
+- Without a key, a byte-identical body within ``DUPLICATE_WINDOW_SECONDS``
+  is treated as the same submission.
+
+Browsers pick a new random boundary every time they encode a
+``multipart/form-data`` body, so the boundary is left out of the body
+fingerprint. The body is hashed as it arrives and spooled to a temporary
+file (on disk past ``_SPOOL_MAX_MEMORY``), which then feeds the handler, so a
+large upload is never held in memory as a whole.
+
+A replay gets the stored status, headers and body of the original response
+plus ``Idempotent-Replayed: true``. A duplicate that arrives while the
+original is still being processed waits for it instead of running the
+handler a second time. Only successful (2xx) responses are stored, so a
+failed attempt can be retried.
+"""
+
+import asyncio
+import hashlib
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from starlette.types import Message
+
+from .config import get_settings
+from .metrics import record_cache_lookup
+from .tracing import TracedRoute, start_span
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# 回放時保留的原始回應標頭（content-length 由 Response 重新計算）
+_REPLAYED_HEADERS = ("content-type", "location", "etag")
+
+_MULTIPART_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+# 請求內容暫存於記憶體的上限，超過時轉存到磁碟；重新送給處理函式時每次讀出的位元組數
+_SPOOL_MAX_MEMORY = 1024 * 1024
+_REPLAY_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class StoredResponse:
+    """A response captured for replay."""
+
+    status_code: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    def replay(self) -> Response:
+        response = Response(content=self.body, status_code=self.status_code)
+        for name, value in self.headers:
+            response.headers[name] = value
+        response.headers[REPLAYED_HEADER] = "true"
+        return response
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    expires_at: float
+    done: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class IdempotencyCache:
+    """Bounded LRU of in-flight and completed requests keyed by idempotency scope."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scope: str) -> Optional[_Entry]:
+        entry = self._entries.get(scope)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[scope]
+            return None
+        self._entries.move_to_end(scope)
+        return entry
+
+    def begin(self, scope: str, fingerprint: str, ttl: float) -> _Entry:
+        entry = _Entry(fingerprint, time.monotonic() + ttl)
+        self._entries[scope] = entry
+        self._entries.move_to_end(scope)
+        # 淘汰最舊的項目；進行中的請求仍由持有 entry 的協程完成，只是不再可被查到
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def complete(self, scope: str, entry: _Entry, response: Optional[StoredResponse]) -> None:
+        """Publish the outcome to waiting duplicates; failed attempts are forgotten."""
+        if response is None and self._entries.get(scope) is entry:
+            del self._entries[scope]
+        if not entry.done.done():
+            entry.done.set_result(response)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_caches: Dict[str, IdempotencyCache] = {}
+
+
+def get_idempotency_cache(name: str) -> IdempotencyCache:
+    """Return the process-wide cache for a route, created on first use."""
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = IdempotencyCache(get_settings().idempotency_cache_size)
+    return cache
+
+
+class _BodyHasher:
+    """Incremental SHA-256 of a request body with the multipart boundary removed."""
+
+    def __init__(self, request: Request):
+        self._hash = hashlib.sha256()
+        self._marker = b""
+        self._tail = b""
+        content_type = request.headers.get("content-type", "")
+        if content_type.lower().startswith("multipart/"):
+            match = _MULTIPART_BOUNDARY.search(content_type)
+            if match:
+                self._marker = b"--" + match.group(1).encode("latin-1")
+
+    def update(self, chunk: bytes) -> None:
+        if not self._marker:
+            self._hash.update(chunk)
+            return
+        # 相同內容重新編碼時只有 boundary 不同；boundary 可能跨越兩個區塊，
+        # 保留尾端可能是 boundary 開頭的位元組，與下一個區塊一起比對
+        data = self._tail + chunk
+        parts, position = [], 0
+        while (found := data.find(self._marker, position)) >= 0:
+            parts.append(data[position:found])
+            parts.append(b"--")
+            position = found + len(self._marker)
+        keep = max(position, len(data) - len(self._marker) + 1)
+        parts.append(data[position:keep])
+        self._tail = data[keep:]
+        self._hash.update(b"".join(parts))
+
+    def hexdigest(self) -> str:
+        self._hash.update(self._tail)
+        self._tail = b""
+        return self._hash.hexdigest()
+
+
+async def _spool_body(request: Request) -> Tuple[BinaryIO, str]:
+    """Read the body into a spooled temporary file, returning it with its fingerprint."""
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_MEMORY)
+    hasher = _BodyHasher(request)
+    try:
+        async for chunk in request.stream():
+            hasher.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, hasher.hexdigest()
+
+
+def _replay_request(request: Request, spool: BinaryIO) -> Request:
+    """A copy of the request whose body is read back from the spooled file."""
+
+    finished = False
+
+    async def receive() -> Message:
+        nonlocal finished
+        if not finished:
+            chunk = spool.read(_REPLAY_CHUNK_SIZE)
+            if chunk:
+                return {"type": "http.request", "body": chunk, "more_body": True}
+            finished = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 內容已讀完，之後等待原始連線的中斷通知
+        return await request.receive()
+
+    return Request(request.scope, receive)
+
+
+def _request_scope(request: Request, fingerprint: str) -> Tuple[str, float]:
+    """Return (cache scope, ttl) for a request."""
+    settings = get_settings()
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if key is not None:
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_KEY_HEADER} 必須是 1 到 {MAX_KEY_LENGTH} 個可列印字元")
+        return f"key:{key}", settings.idempotency_key_ttl
+    return f"body:{fingerprint}", settings.duplicate_window_seconds
+
+
+class IdempotentRoute(TracedRoute):
+    """APIRoute that replays stored responses for repeated submissions.
+
+    The lookup happens before FastAPI parses and validates the body, so a
+    replay repeats neither validation nor the handler's side effects.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+        cache_name = self.unique_id
+
+        async def idempotent_handler(request: Request) -> Response:
+            settings = get_settings()
+            if not settings.idempotency_enabled:
+                return await handler(request)
+
+            spool, fingerprint = await _spool_body(request)
+            try:
+                scope, ttl = _request_scope(request, fingerprint)
+                cache = get_idempotency_cache(cache_name)
+                while True:
+                    entry = cache.get(scope)
+                    record_cache_lookup("idempotency", entry is not None)
+                    if entry is None:
+                        break
+                    if entry.fingerprint != fingerprint:
+                        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_KEY_HEADER} 已用於內容不同的請求")
+                    # 原始請求仍在處理時等待其結果；shield 避免重複請求斷線時取消共用的 future
+                    if entry.done.done():
+                        stored = entry.done.result()
+                    else:
+                        with start_span("idempotency.wait"):
+                            stored = await asyncio.shield(entry.done)
+                    if stored is not None:
+                        return stored.replay()
+                    # 原始請求失敗，視為新的請求重新處理
+
+                entry = cache.begin(scope, fingerprint, ttl)
+                stored = None
+                try:
+                    response = await handler(_replay_request(request, spool))
+                    if 200 <= response.status_code < 300 and hasattr(response, "body"):
+                        stored = StoredResponse(
+                            status_code=response.status_code,
+                            headers=[(name, value) for name, value in response.headers.items() if name in _REPLAYED_HEADERS],
+                            body=bytes(response.body),
+                        )
+                    return response
+                finally:
+                    cache.complete(scope, entry, stored)
+            finally:
+                spool.close()
+
+        return idempotent_handler
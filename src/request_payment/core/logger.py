@@ -0,0 +1,145 @@
+"""Structured logging setup for RequestPayment system.
+
+All application logging goes through loguru. The sink is queue-backed
+(``enqueue=True``) so request handlers never block on stdout, every record
+is passed through a patcher that redacts secrets and truncates oversized
+values, and noisy messages can be sampled with ``logger.bind(sample=N)``.
+"""
+
+import sys
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict
+
+from loguru import logger
+
+from .config import Settings, get_settings
+from .tracing import current_span
+
+# 不應出現在日誌中的欄位（存摺影本 base64、憑證等）
+REDACTED_KEYS = {
+    "bank_book_image",
+    "bank_book",
+    "secret_key",
+    "admin_token",
+    "authorization",
+    "x-admin-token",
+    "password",
+}
+
+_sample_counters: Dict[Any, int] = defaultdict(int)
+_sample_lock = threading.Lock()
+
+
+def truncate(value: str, max_length: int) -> str:
+    """Truncate a string, noting how many characters were dropped."""
+    if len(value) <= max_length:
+        return value
+    return f"{value[:max_length]}...(+{len(value) - max_length} chars)"
+
+
+def redact(value: Any, max_length: int = None) -> Any:
+    """Return a log-safe copy of a value.
+
+    Secret keys are replaced by a placeholder, long strings are truncated and
+    containers are processed recursively.
+    """
+    if max_length is None:
+        max_length = get_settings().log_max_field_length
+
+    if isinstance(value, dict):
+        return {
+            key: (_redacted_placeholder(item) if str(key).lower() in REDACTED_KEYS else redact(item, max_length))
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return [redact(item, max_length) for item in value[:10]] + [f"...(+{len(value) - 10} items)"]
+        return [redact(item, max_length) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, Enum):
+        return truncate(str(value.value), max_length)
+    if isinstance(value, str):
+        return truncate(value, max_length)
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    return truncate(str(value), max_length)
+
+
+def _redacted_placeholder(value: Any) -> Any:
+    if value is None:
+        return None
+    size = len(value) if hasattr(value, "__len__") else None
+    return f"<redacted {size} chars>" if size is not None else "<redacted>"
+
+
+def summarize_payment_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a compact, log-safe summary of a payment request record."""
+    details = data.get("payment_details") or []
+    return {
+        "request_id": data.get("id"),
+        "payment_method": redact(data.get("payment_method")),
+        "requesting_unit": redact(data.get("requesting_unit")),
+        "total_amount": redact(data.get("total_amount")),
+        "detail_count": len(details),
+        "has_bank_book_image": data.get("bank_book") is not None or bool(data.get("bank_book_image")),
+    }
+
+
+def _patch_record(record) -> None:
+    """Redact and truncate every record before it reaches a sink."""
+    max_length = get_settings().log_max_message_length
+    record["message"] = truncate(record["message"], max_length)
+    if record["extra"]:
+        record["extra"].update(redact(dict(record["extra"])))
+    # 取樣的請求附上 trace 編號，日誌可與匯出的 span 對照
+    span = current_span()
+    if span.recording:
+        record["extra"].setdefault("trace_id", span.trace_id)
+
+
+def _sampling_filter(record) -> bool:
+    """Keep one of every N records bound with ``sample=N``."""
+    rate = record["extra"].get("sample")
+    if not rate or rate <= 1:
+        return True
+
+    key = (record["name"], record["function"], record["line"])
+    with _sample_lock:
+        count = _sample_counters[key]
+        _sample_counters[key] = count + 1
+    return count % rate == 0
+
+
+def _format_record(record) -> str:
+    """Human-readable format with structured fields appended when present."""
+    fmt = (
+        "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+        "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+    )
+    if any(key != "sample" for key in record["extra"]):
+        fmt += " | {extra}"
+    return fmt + "\n{exception}"
+
+
+def setup_logging(settings: Settings = None) -> None:
+    """Configure loguru with a queue-backed, redacting, sampling sink."""
+    settings = settings or get_settings()
+
+    logger.remove()
+    logger.configure(patcher=_patch_record)
+    logger.add(
+        sys.stderr,
+        level=settings.log_level.upper(),
+        enqueue=True,
+        serialize=settings.log_json,
+        filter=_sampling_filter,
+        backtrace=False,
+        diagnose=False,
+        format=_format_record,
+    )
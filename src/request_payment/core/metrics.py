@@ -0,0 +1,333 @@
+"""Prometheus-compatible metrics for RequestPayment system.
+
+A small dependency-free implementation of counters, gauges and histograms
+rendered in the Prometheus text exposition format. When metrics are
+disabled every recording call returns immediately, so instrumented hot
+paths pay only an attribute lookup.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import get_settings
+
+# Starlette appends "; charset=utf-8" to text/* media types
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4"
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label_value(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    """Format a label set as ``{a="1",b="2"}``."""
+    pairs = [f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value the way Prometheus expects."""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for labelled metrics."""
+
+    metric_type = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter for the given label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the current value for the given label set."""
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Gauge that can go up and down."""
+
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the gauge for the given label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrease the gauge for the given label set."""
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge for the given label set."""
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        """Increase the gauge while the block is running."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        # label set -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        super().__init__(*args, **kwargs)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation for the given label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels: str):
+        """Context manager observing the elapsed time of the block.
+
+        Returns a shared no-op context manager when metrics are disabled.
+        """
+        if not self.registry.enabled:
+            return _NULL_TIMER
+        return self._timer(labels)
+
+    @contextmanager
+    def _timer(self, labels: Dict[str, str]) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(cumulative)}")
+        return lines
+
+
+_NULL_TIMER = nullcontext()
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        """Register a metric with this registry."""
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(_render_cache_hit_ratios())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(enabled=get_settings().metrics_enabled)
+
+# HTTP
+REQUEST_LATENCY = Histogram(
+    registry, "http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(registry, "http_requests_in_flight", "HTTP requests currently being served.")
+COMPRESSION_BYTES = Counter(
+    registry, "http_compression_bytes_total", "Response bytes before (in) and after (out) compression.", ["encoding", "stage"]
+)
+PDF_RENDERS_QUEUED = Gauge(registry, "pdf_renders_queued", "PDF renders waiting for a free render slot.")
+PDF_RENDERS_IN_PROGRESS = Gauge(registry, "pdf_renders_in_progress", "PDF renders currently running.")
+
+# Files
+UPLOAD_BYTES = Counter(registry, "upload_bytes_total", "Bytes received through uploads.", ["file_type"])
+FILE_OPERATION_SECONDS = Histogram(
+    registry, "file_operation_duration_seconds", "FileManager operation latency.", ["operation"]
+)
+
+# PDF rendering
+PDF_RENDERS = Counter(registry, "pdf_renders_total", "Completed PDF renders by engine and output profile.", ["engine", "profile"])
+PDF_PRERENDERS = Counter(
+    registry, "pdf_prerenders_total", "Speculative background renders after create by result.", ["result"]
+)
+PDF_PHASE_SECONDS = Histogram(
+    registry, "pdf_render_phase_seconds", "PDF render time by phase.", ["phase"]
+)
+PDF_PAGES = Histogram(
+    registry, "pdf_render_pages", "Pages per rendered PDF.", buckets=(1, 2, 3, 4, 5, 10, 20, 50, 100, 500)
+)
+PDF_OUTPUT_BYTES = Histogram(
+    registry,
+    "pdf_render_output_bytes",
+    "Size of rendered PDFs in bytes.",
+    buckets=(16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216),
+)
+
+# Caches
+CACHE_REQUESTS = Counter(registry, "cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"])
+
+# Tracing
+TRACE_SPANS = Counter(registry, "trace_spans_total", "Finished trace spans by export result.", ["result"])
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Record a cache hit or miss."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _render_cache_hit_ratios() -> List[str]:
+    """Derive per-cache hit ratios from the lookup counter."""
+    with CACHE_REQUESTS._lock:
+        totals: Dict[str, List[float]] = {}
+        for (cache, result), value in CACHE_REQUESTS._values.items():
+            hits_and_total = totals.setdefault(cache, [0, 0])
+            if result == "hit":
+                hits_and_total[0] += value
+            hits_and_total[1] += value
+
+    lines = [
+        "# HELP cache_hit_ratio Cache hit ratio since process start.",
+        "# TYPE cache_hit_ratio gauge",
+    ]
+    for cache, (hits, total) in sorted(totals.items()):
+        ratio = hits / total if total else 0.0
+        lines.append(f'cache_hit_ratio{{cache="{cache}"}} {_format_value(ratio)}')
+    return lines
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=_route_template(scope),
+                status=str(status_code),
+            )
+
+
+def _route_template(scope) -> str:
+    """Return the matched route template so path parameters don't explode cardinality."""
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    path: Optional[str] = scope.get("path")
+    if path and path.startswith("/static/"):
+        return "/static"
+    return "unmatched"
@@ -0,0 +1,278 @@
+"""On-demand per-request CPU and memory profiling.
+
+Admins can opt a single request into profiling by sending
+``X-Profile: 1`` (or ``?profile=1``) together with a valid
+``X-Admin-Token`` header. The request is then sampled by a background
+stack sampler and traced with ``tracemalloc``; the results are written
+to a size-bounded ring directory and exposed through the debug API.
+
+The CPU profile only holds samples from the threads running the request:
+the event loop while it runs the request's task, and threadpool workers
+while they run work the request submitted through this module's
+``run_in_threadpool``. The memory report is process-wide, because
+``tracemalloc`` traces every thread.
+"""
+
+import asyncio
+import functools
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Set, TypeVar
+
+from fastapi import HTTPException, Request
+from loguru import logger
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+from .config import get_settings
+
+# 只允許環形目錄中由本模組產生的檔名，避免路徑穿越
+PROFILE_NAME_PATTERN = re.compile(r"^[0-9A-Za-z_\-]+\.(cpu\.folded|mem\.txt)$")
+
+# 閒置執行緒停留的函式，取樣時略過以免淹沒真正的工作
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "_wait_for_tstate_lock"}
+
+# 同一時間只允許一個剖析工作，tracemalloc 是全域狀態
+_profile_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def verify_admin_token(request: Request) -> None:
+    """Raise 403 unless the request carries the configured admin token.
+
+    Admin features are disabled (404) when no ``ADMIN_TOKEN`` is configured.
+    """
+    expected = get_settings().admin_token
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    provided = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(provided.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="需要管理員權限")
+
+
+class StackSampler:
+    """Background thread sampling the Python stacks of the profiled request.
+
+    Must be created on the event loop, inside the request's task. Other
+    requests share the event loop thread, so it is only sampled while it
+    runs that task; worker threads are sampled while they run work
+    entered through ``attributed``.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.current_task()
+        self._workers: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def attributed(self, func: Callable[[], T]) -> T:
+        """Run ``func`` in the current worker thread, sampling the thread meanwhile."""
+        thread_id = threading.get_ident()
+        self._workers.add(thread_id)
+        try:
+            return func()
+        finally:
+            self._workers.discard(thread_id)
+
+    def _request_threads(self) -> List[int]:
+        threads = list(self._workers)
+        # 事件迴圈由所有請求共用，只在執行本請求的 task 時取樣
+        if asyncio.current_task(self._loop) is self._task:
+            threads.append(self._loop_thread)
+        return threads
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample_count += 1
+            threads = self._request_threads()
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                if frame is None or frame.f_code.co_name in _IDLE_FUNCTIONS:
+                    continue
+                # 取樣時只記錄 (code, lineno)，輸出時才格式化，降低對被剖析請求的干擾
+                stack = []
+                while frame is not None:
+                    stack.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                self.samples[tuple(stack)] += 1
+
+    def to_folded(self) -> str:
+        """Return the samples in the collapsed-stack format used by flame graph tools."""
+        lines = []
+        for stack, count in self.samples.most_common():
+            frames = (f"{os.path.basename(code.co_filename)}:{code.co_name}:{lineno}" for code, lineno in reversed(stack))
+            lines.append(f"{';'.join(frames)} {count}\n")
+        return "".join(lines)
+
+
+class ProfileRing:
+    """Directory of captured profiles bounded by file count and total size."""
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+    def write(self, name: str, content: str) -> Path:
+        """Write a profile file and evict the oldest files beyond the bounds."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / name
+        path.write_text(content, encoding="utf-8")
+        self._evict()
+        return path
+
+    def list(self) -> List[Dict[str, Any]]:
+        """List captured profiles, newest first."""
+        if not self.directory.exists():
+            return []
+
+        files = []
+        for path in self.directory.iterdir():
+            if path.is_file() and PROFILE_NAME_PATTERN.match(path.name):
+                stat = path.stat()
+                files.append({
+                    "name": path.name,
+                    "size": stat.st_size,
+                    "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                })
+        return sorted(files, key=lambda x: x["created_at"], reverse=True)
+
+    def path_for(self, name: str) -> Optional[Path]:
+        """Return the path of a captured profile, or None if it does not exist."""
+        if not PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+    def _evict(self) -> None:
+        entries = sorted(
+            (p for p in self.directory.iterdir() if p.is_file()),
+            key=lambda p: p.stat().st_mtime,
+        )
+        total = sum(p.stat().st_size for p in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_files):
+            oldest = entries.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+
+
+# 目前請求的取樣器；run_in_threadpool 複製 context，工作執行緒也能取得
+_active_sampler: ContextVar[Optional[StackSampler]] = ContextVar("active_sampler", default=None)
+
+
+async def run_in_threadpool(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """``starlette.concurrency.run_in_threadpool`` that attributes the worker to a profiled request.
+
+    Request code should submit threadpool work through this function so the
+    worker thread shows up in the request's CPU profile.
+    """
+    call = functools.partial(func, *args, **kwargs)
+    sampler = _active_sampler.get()
+    if sampler is None:
+        return await _run_in_threadpool(call)
+    return await _run_in_threadpool(sampler.attributed, call)
+
+
+def get_profile_ring() -> ProfileRing:
+    """Return the profile ring configured in settings."""
+    settings = get_settings()
+    return ProfileRing(settings.profile_dir, settings.profile_ring_max_bytes, settings.profile_ring_max_files)
+
+
+def _profiling_requested(request: Request) -> bool:
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes", "on")
+
+
+def _format_memory_report(request: Request, snapshot: tracemalloc.Snapshot, elapsed: float, samples: int) -> str:
+    settings = get_settings()
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    stats = snapshot.statistics("lineno")
+    current, peak = tracemalloc.get_traced_memory()
+
+    lines = [
+        f"# {request.method} {request.url.path}",
+        f"# elapsed: {elapsed * 1000:.1f} ms, cpu samples: {samples}",
+        "# allocations are process-wide: concurrent requests and background threads are included",
+        f"# traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB",
+        f"# top {settings.profile_top_allocations} allocations by line",
+        "",
+    ]
+    for stat in stats[:settings.profile_top_allocations]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+async def profile_request(request: Request) -> AsyncGenerator[None, None]:
+    """Dependency profiling the request when an admin opts in.
+
+    Captures a sampling CPU profile and a ``tracemalloc`` top-allocations
+    snapshot, written to the profile ring when the request finishes.
+    """
+    if not _profiling_requested(request):
+        yield
+        return
+
+    verify_admin_token(request)
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning(f"Profiling skipped, another capture is running: {request.url.path}")
+        yield
+        return
+
+    settings = get_settings()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(settings.profile_traceback_depth)
+    else:
+        tracemalloc.clear_traces()
+
+    sampler = StackSampler(settings.profile_sample_interval_ms / 1000)
+    _active_sampler.set(sampler)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _active_sampler.set(None)
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        memory_report = _format_memory_report(request, snapshot, elapsed, sampler.sample_count)
+        if started_tracing:
+            tracemalloc.stop()
+        _profile_lock.release()
+
+        capture_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        ring = get_profile_ring()
+        ring.write(f"{capture_id}.cpu.folded", sampler.to_folded())
+        ring.write(f"{capture_id}.mem.txt", memory_report)
+        logger.info(f"Captured profile {capture_id} for {request.method} {request.url.path} ({elapsed * 1000:.1f} ms)")
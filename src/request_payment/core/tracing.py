@@ -0,0 +1,530 @@
+"""Lightweight request tracing.
+
+Per-phase metrics show which phase is slow on average, not why one
+particular download was slow. Spans record the phases of individual
+requests: body validation, storage, image decoding, pagination,
+``doc.build`` and so on.
+
+- ``TracingMiddleware`` opens a root span for each HTTP request. An
+  incoming W3C ``traceparent`` header continues the caller's trace, and its
+  sampled flag decides whether the request is recorded; without one a
+  request is sampled with probability ``TRACE_SAMPLE_RATE``.
+- ``start_span`` opens a child of the current span. The current span lives
+  in a context variable, so spans opened in ``run_in_threadpool`` workers
+  nest under their request. Outside a sampled request it returns a shared
+  no-op span, so unsampled requests cost little more than a context
+  variable lookup.
+- ``TracedRoute`` splits a route into ``request.validate`` (parsing and
+  validating parameters and body) and the endpoint itself.
+
+Finished spans go through a bounded queue to a background thread that
+writes them to a size-rotated JSONL file (``TRACE_EXPORTER=jsonl``) or posts
+them as OTLP/HTTP JSON to a collector (``TRACE_EXPORTER=otlp``). When the
+queue is full, spans are dropped and counted instead of slowing requests.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from loguru import logger
+
+from .config import get_settings
+from .metrics import TRACE_SPANS, _route_template
+
+TRACEPARENT_HEADER = "traceparent"
+TRACERESPONSE_HEADER = "traceresponse"
+SERVICE_NAME = "request-payment"
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+# OTLP span kind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+
+# 匯出佇列長度、每批最多的 span 數與累積一批的最長等待秒數
+_QUEUE_SIZE = 4096
+_BATCH_SIZE = 256
+_FLUSH_INTERVAL = 1.0
+
+# 以單調時鐘計時，換算成 Unix 時間（系統時間被調整時 span 長度仍然正確）
+_WALL_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def _now_ns() -> int:
+    return _WALL_OFFSET_NS + time.perf_counter_ns()
+
+
+def parse_traceparent(value: str) -> Optional[Tuple[str, str, bool]]:
+    """Return (trace id, parent span id, sampled) from a ``traceparent`` header, or None if invalid."""
+    value = value.strip().lower()
+    match = _TRACEPARENT.match(value)
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    # 版本 ff 無效；版本 00 不可附加欄位，較新的版本可能在尾端附加
+    if version == "ff" or (version == "00" and len(value) != match.end()):
+        return None
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 0x01)
+
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool = True) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+
+class Span:
+    """A timed operation within a sampled trace; use as a context manager."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        kind: int = KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = _now_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes if attributes is not None else {}
+        self.error: Optional[str] = None
+        self._token = None
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, trace_id={self.trace_id}, span_id={self.span_id})"
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        """Finish the span and queue it for export (only the first call counts)."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else _now_ns()
+        _get_exporter().export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None and self.error is None:
+            self.error = repr(exc)
+        _current_span.reset(self._token)
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """Stand-in for spans outside a sampled trace; records nothing."""
+
+    __slots__ = ()
+
+    recording = False
+    traceparent = None
+    duration_ms = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+AnySpan = Union[Span, _NoopSpan]
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> AnySpan:
+    """Return the innermost open span, or a no-op span outside a sampled trace."""
+    return _current_span.get() or _NOOP_SPAN
+
+
+def start_span(name: str, **attributes: Any) -> AnySpan:
+    """Open a child of the current span (a no-op outside a sampled trace)."""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+
+
+def record_span(name: str, start_ns: int, error: Optional[str] = None, **attributes: Any) -> None:
+    """Record a child of the current span that started at ``start_ns`` and ends now."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+    span.start_ns = start_ns
+    span.error = error
+    span.end()
+
+
+def start_trace(
+    name: str,
+    traceparent: Optional[str] = None,
+    kind: int = KIND_SERVER,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> AnySpan:
+    """Open a root span, continuing the trace of ``traceparent`` when it is valid.
+
+    The caller's sampled flag is honoured; new traces are sampled with
+    probability ``TRACE_SAMPLE_RATE``.
+    """
+    settings = get_settings()
+    if not settings.tracing_enabled:
+        return _NOOP_SPAN
+    parent = parse_traceparent(traceparent) if traceparent else None
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+        if not sampled:
+            return _NOOP_SPAN
+    else:
+        if random.random() >= settings.trace_sample_rate:
+            return _NOOP_SPAN
+        trace_id, parent_id = os.urandom(16).hex(), None
+    return Span(name, trace_id, parent_id, kind, attributes)
+
+
+# ---------------------------------------------------------------------------
+# Export
+
+
+def span_to_dict(span: Span) -> Dict[str, Any]:
+    """JSONL representation of a finished span."""
+    started = datetime.fromtimestamp(span.start_ns / 1e9, tz=timezone.utc)
+    return {
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_span_id": span.parent_id,
+        "name": span.name,
+        "kind": "server" if span.kind == KIND_SERVER else "internal",
+        "start": started.isoformat(timespec="microseconds"),
+        "duration_ms": round(span.duration_ms, 3),
+        "attributes": span.attributes,
+        "error": span.error,
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """OTLP/HTTP JSON ``ExportTraceServiceRequest`` body for a batch of spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": span.kind,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        # 2 = STATUS_CODE_ERROR，未設定時為 UNSET
+                        "status": {"code": 2, "message": span.error} if span.error else {},
+                    }
+                    for span in spans
+                ],
+            }],
+        }]
+    }
+
+
+class JsonlSpanWriter:
+    """Append spans to a JSONL file, rotating to ``.1`` … ``.N`` past ``max_bytes``."""
+
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def __call__(self, spans: List[Span]) -> None:
+        data = "".join(json.dumps(span_to_dict(span), ensure_ascii=False, default=str) + "\n" for span in spans)
+        encoded = data.encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(encoded) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(encoded)
+
+    def _backup(self, index: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{index}")
+
+    def _rotate(self) -> None:
+        if self.backups <= 0:
+            self.path.unlink(missing_ok=True)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if self._backup(index).exists():
+                os.replace(self._backup(index), self._backup(index + 1))
+        os.replace(self.path, self._backup(1))
+
+
+class OtlpSpanWriter:
+    """POST spans as OTLP/HTTP JSON to a collector endpoint (e.g. ``/v1/traces``)."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def __call__(self, spans: List[Span]) -> None:
+        body = json.dumps(otlp_payload(spans), ensure_ascii=False, default=str).encode("utf-8")
+        request = urllib.request.Request(
+            self.endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SpanExporter:
+    """Background thread writing finished spans in batches."""
+
+    def __init__(self, write: Callable[[List[Span]], None]):
+        self._write = write
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS.inc(result="dropped")
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Flush queued spans and stop the thread."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            # 累積一批再寫出，OTLP 不必每個 span 發送一次請求
+            batch = [first]
+            deadline = time.monotonic() + _FLUSH_INTERVAL
+            while len(batch) < _BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    span = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+            self._flush(batch)
+
+    def _flush(self, batch: List[Span]) -> None:
+        try:
+            self._write(batch)
+        except Exception as e:
+            TRACE_SPANS.inc(len(batch), result="failed")
+            logger.bind(sample=100).warning("追蹤 span 匯出失敗", error=str(e), spans=len(batch))
+        else:
+            TRACE_SPANS.inc(len(batch), result="exported")
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> SpanExporter:
+    global _exporter
+    exporter = _exporter
+    if exporter is not None:
+        return exporter
+    with _exporter_lock:
+        if _exporter is None:
+            settings = get_settings()
+            name = settings.trace_exporter.lower()
+            if name == "otlp":
+                write = OtlpSpanWriter(settings.trace_otlp_endpoint)
+            else:
+                if name != "jsonl":
+                    logger.warning("未知的 TRACE_EXPORTER，改用 jsonl", exporter=settings.trace_exporter)
+                write = JsonlSpanWriter(Path(settings.trace_file), settings.trace_file_max_bytes, settings.trace_file_backups)
+            _exporter = SpanExporter(write)
+        return _exporter
+
+
+def shutdown_tracing(timeout: float = 5.0) -> None:
+    """Flush pending spans; called on application shutdown."""
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.shutdown(timeout)
+
+
+# ---------------------------------------------------------------------------
+# Instrumentation
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span for each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        span = start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if not span.recording:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # 回傳 trace 編號，慢的請求可以直接在匯出的 span 中找到
+                headers = [*message.get("headers", []), (TRACERESPONSE_HEADER.encode(), span.traceparent.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = _route_template(scope)
+                span.name = f"{scope['method']} {route}"
+                span.set_attribute("http.route", route)
+                span.set_attribute("http.status_code", status_code)
+                if status_code >= 500 and span.error is None:
+                    span.error = f"HTTP {status_code}"
+
+
+# TracedRoute 開始處理請求的時間，端點被呼叫時據此記錄 request.validate
+_handler_started: ContextVar[Optional[int]] = ContextVar("handler_started", default=None)
+
+
+def _traced_endpoint(call: Callable, name: str) -> Callable:
+    def enter() -> AnySpan:
+        started = _handler_started.get()
+        if started is not None:
+            record_span("request.validate", started)
+        return start_span(name)
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def traced(*args, **kwargs):
+            if _current_span.get() is None:
+                return await call(*args, **kwargs)
+            with enter():
+                return await call(*args, **kwargs)
+    else:
+        @functools.wraps(call)
+        def traced(*args, **kwargs):
+            if _current_span.get() is None:
+                return call(*args, **kwargs)
+            with enter():
+                return call(*args, **kwargs)
+    return traced
+
+
+class TracedRoute(APIRoute):
+    """APIRoute recording request validation and the endpoint as separate spans."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # FastAPI 已依原本的函式解析參數，執行時才經由 dependant.call 呼叫端點
+        self.dependant.call = _traced_endpoint(self.dependant.call, f"endpoint.{self.name}")
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        handler = super().get_route_handler()
+
+        async def traced_handler(request: Request) -> Response:
+            if _current_span.get() is None:
+                return await handler(request)
+            started = _now_ns()
+            token = _handler_started.set(started)
+            try:
+                return await handler(request)
+            except RequestValidationError as e:
+                # 驗證失敗時不會呼叫端點，在這裡記錄 request.validate
+                record_span("request.validate", started, error=f"{len(e.errors())} validation errors")
+                raise
+            finally:
+                _handler_started.reset(token)
+
+        return traced_handler
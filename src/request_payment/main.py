@@ -1,20 +1,37 @@
 """Main FastAPI application entry point for RequestPayment system."""
 
+import asyncio
 import os
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response
 from loguru import logger
 
 from .api.v1.router import router as api_v1_router
+from .core.compression import CompressionMiddleware
 from .core.config import get_settings
 from .core.exceptions import setup_exception_handlers
+from .core.logger import setup_logging
+from .core.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, registry as metrics_registry
+from .core.tracing import TracingMiddleware, shutdown_tracing
 from .services import file_manager
+from .services.prerender import prerenderer
+from .utils.static_assets import PrecompressedStaticFiles
+
+
+def _warm_up_pdf_service() -> None:
+    """Load ReportLab and fonts ahead of the first PDF download."""
+    try:
+        from .services.pdf_service import warm_up
+
+        warm_up()
+        logger.info("PDF service warmed up")
+    except Exception as e:
+        logger.warning(f"PDF service warm-up failed: {e}")
 
 
 @asynccontextmanager
@@ -27,6 +44,11 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info("Initializing file storage directories...")
     file_manager._ensure_directories()
     logger.info("File storage directories initialized successfully")
+    try:
+        await file_manager.start()
+        logger.info(f"File storage backend ready: {file_manager.storage.name}")
+    except Exception as e:
+        logger.error(f"File storage backend is not ready: {e}")
     
     # 確保uploads目錄存在
     os.makedirs("uploads", exist_ok=True)
@@ -37,12 +59,19 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     # 創建靜態檔案目錄
     os.makedirs("static", exist_ok=True)
 
+    # 在背景執行緒預熱 PDF 服務，不阻塞啟動與健康檢查
+    if get_settings().pdf_warmup:
+        asyncio.get_running_loop().run_in_executor(None, _warm_up_pdf_service)
+
     logger.info("Application initialized successfully")
 
     yield
 
     # Shutdown
     logger.info("Shutting down RequestPayment application...")
+    prerenderer.shutdown()
+    await file_manager.close()
+    shutdown_tracing()
 
 
 def create_app() -> FastAPI:
@@ -52,6 +81,7 @@ def create_app() -> FastAPI:
         FastAPI: The configured application instance.
     """
     settings = get_settings()
+    setup_logging(settings)
 
     app = FastAPI(
         title="RequestPayment API",
@@ -71,6 +101,15 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    # Compress JSON / HTML responses; PDFs and precompressed static files pass through
+    if settings.compression_enabled:
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=settings.compression_min_size,
+            gzip_level=settings.compression_gzip_level,
+            brotli_quality=settings.compression_brotli_quality,
+        )
+
     # Only add TrustedHostMiddleware in production
     if settings.environment != "test":
         app.add_middleware(
@@ -78,11 +117,21 @@ def create_app() -> FastAPI:
             allowed_hosts=settings.get_allowed_hosts_list(),
         )
 
+    # Record per-route latency and in-flight requests
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
+
+    # Sampled per-request spans; added last so the root span covers every other middleware
+    if settings.tracing_enabled:
+        app.add_middleware(TracingMiddleware)
+
     # Setup exception handlers
     setup_exception_handlers(app)
 
-    # Mount static files
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+    # Mount static files (serves build-time .br / .gz variants when present)
+    # 靜態檔案網址不含內容雜湊，不能長效快取；一律以 ETag 重新驗證（未改變時回 304）
+    app.mount("/static", PrecompressedStaticFiles(directory="static", cache_control="no-cache"), name="static")
+    index_files = PrecompressedStaticFiles(directory="static", cache_control="no-cache")
 
     # Include routers
     app.include_router(
@@ -96,10 +145,16 @@ def create_app() -> FastAPI:
         """Health check endpoint."""
         return {"status": "healthy", "version": "0.1.0"}
 
+    if settings.metrics_enabled:
+        @app.get("/metrics", include_in_schema=False)
+        async def metrics():
+            """Prometheus metrics endpoint."""
+            return Response(content=metrics_registry.render(), media_type=CONTENT_TYPE_LATEST)
+
     @app.get("/")
-    async def read_index():
+    async def read_index(request: Request):
         """提供首頁"""
-        return FileResponse('static/index.html')
+        return await index_files.get_response("index.html", request.scope)
 
 
 
@@ -56,6 +56,12 @@ class ExpenseType(str, Enum):
     MISCELLANEOUS = "9.雜支"
 
 
+class ExportFormat(str, Enum):
+    """明細匯出格式枚舉"""
+    CSV = "csv"
+    XLSX = "xlsx"
+
+
 class PaymentDetailItem(BaseModel):
     """請款明細項目"""
     project_type: ProjectType = Field(..., description="專案類型")
@@ -94,11 +100,27 @@ class RequestFormCreate(BaseModel):
         if self.requesting_unit == RequestingUnit.OTHER and not self.requesting_unit_other:
             raise ValueError('選擇其他請款單位時必須填寫說明')
         
-        # 驗證存摺影本
-        if self.payment_method in [PaymentMethod.TRANSFER, PaymentMethod.ADVANCE] and not self.bank_book_image:
+        # 驗證存摺影本（multipart 建立時圖片另以檔案上傳，由驗證 context 告知）
+        bank_book_attached = bool(__context and __context.get("bank_book_attached"))
+        if self.payment_method in [PaymentMethod.TRANSFER, PaymentMethod.ADVANCE] and not (
+            self.bank_book_image or bank_book_attached
+        ):
             raise ValueError('匯款或預支付款方式需要上傳存摺影本')
 
 
+class RequestFormUpdate(BaseModel):
+    """更新請款單的請求模型（只需提供要修改的欄位）"""
+    version: int = Field(..., description="目前的版本號，與伺服器上的版本不同時拒絕更新", ge=1)
+    application_date: Optional[str] = Field(None, description="申請日期 (民國年格式)")
+    payee: Optional[str] = Field(None, description="受款人")
+    payment_method: Optional[PaymentMethod] = Field(None, description="付款方式")
+    payment_method_other: Optional[str] = Field(None, description="其他付款方式說明")
+    requesting_unit: Optional[RequestingUnit] = Field(None, description="請款單位")
+    requesting_unit_other: Optional[str] = Field(None, description="其他請款單位說明")
+    payment_details: Optional[List[PaymentDetailItem]] = Field(None, description="請款明細", min_items=1)
+    bank_book_image: Optional[str] = Field(None, description="存摺影本 base64 編碼")
+
+
 class RequestFormResponse(BaseModel):
     """請款單回應模型"""
     id: str
@@ -111,6 +133,8 @@ class RequestFormResponse(BaseModel):
     total_amount: Decimal
     payment_details: List[PaymentDetailItem]
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    version: int = 1
     pdf_url: Optional[str] = None
 
     class Config:
@@ -132,4 +156,45 @@ class FileInfoResponse(BaseModel):
     file_size: int
     file_type: str
     created_at: str
-    modified_at: str 
\ No newline at end of file
+    modified_at: str 
+
+class SpendingGroup(BaseModel):
+    """支出統計的一個分組"""
+    key: Dict[str, str] = Field(..., description="分組維度 → 值")
+    total_amount: Decimal
+    item_count: int
+
+
+class SpendingReportResponse(BaseModel):
+    """支出統計回應模型（金額為精確的 Decimal，以字串輸出）"""
+    group_by: List[str]
+    filters: Dict[str, str]
+    total_amount: Decimal
+    item_count: int
+    form_count: Optional[int] = Field(None, description="請款單張數，依專案或費用類型篩選時無法計算")
+    groups: List[SpendingGroup]
+
+
+class SpendingRebuildResponse(BaseModel):
+    """重新計算支出統計的回應模型"""
+    forms: int
+    seconds: float
+
+
+class SearchHit(BaseModel):
+    """全文檢索的一筆結果"""
+    id: str
+    payee: str
+    requesting_unit: RequestingUnit
+    total_amount: Decimal
+    created_at: datetime
+    score: float = Field(..., description="相關度分數，越高越相關")
+
+
+class SearchResponse(BaseModel):
+    """全文檢索回應模型"""
+    query: str
+    total: int = Field(..., description="符合的請款單總數")
+    page: int
+    page_size: int
+    items: List[SearchHit]
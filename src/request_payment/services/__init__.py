@@ -2,4 +2,14 @@
 
 from .file_manager import file_manager, FileManager, FileType
 
-__all__ = ["file_manager", "FileManager", "FileType"] 
\ No newline at end of file
+__all__ = ["file_manager", "FileManager", "FileType", "PDFService", "get_pdf_service"]
+
+# PDF 相關服務依賴 ReportLab，延遲到第一次使用時才載入以縮短冷啟動時間
+_LAZY_PDF_ATTRIBUTES = {"PDFService", "get_pdf_service"}
+
+
+def __getattr__(name):
+    if name in _LAZY_PDF_ATTRIBUTES:
+        from . import pdf_service
+        return getattr(pdf_service, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
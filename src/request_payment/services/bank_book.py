@@ -0,0 +1,127 @@
+"""存摺影本圖片.
+
+建立請款單時解碼並驗證 base64 圖片一次，結果（圖片位元組、尺寸、內容雜湊）
+隨紀錄保存；下載 PDF 時直接使用，不再重複解碼。依輸出設定檔縮小並重新
+編碼的結果也只在第一次使用時計算。
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import threading
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .pdf_output import OutputProfile
+
+# 可嵌入 PDF 的圖片格式（與上傳端點、前端允許的格式一致）
+ALLOWED_FORMATS = ("JPEG", "PNG", "GIF")
+
+
+class BankBookImage:
+    """已驗證的存摺影本"""
+
+    __slots__ = ("data", "width", "height", "format", "digest", "_variants", "_lock", "__weakref__")
+
+    def __init__(self, data: bytes, width: int, height: int, format: str):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.format = format
+        self.digest = hashlib.sha256(data).hexdigest()
+        self._variants: Dict[Tuple[float, float, str], bytes] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"BankBookImage({self.format} {self.width}x{self.height}, {len(self.data)} bytes)"
+
+    @property
+    def aspect_ratio(self) -> float:
+        return self.width / self.height
+
+    def for_profile(self, width: float, height: float, profile: "OutputProfile") -> bytes:
+        """依輸出設定檔處理後要嵌入 PDF 的圖片，結果依版面尺寸與設定檔快取"""
+        from .pdf_output import prepare_image
+
+        key = (round(width, 3), round(height, 3), profile.name)
+        with self._lock:
+            variant = self._variants.get(key)
+        if variant is None:
+            variant = prepare_image(self.data, width, height, profile)
+            with self._lock:
+                self._variants[key] = variant
+        return variant
+
+
+# 內容相同的存摺影本共用同一個物件（含縮圖快取）；不再被任何紀錄參照時自動釋放
+_shared_images: "weakref.WeakValueDictionary[str, BankBookImage]" = weakref.WeakValueDictionary()
+_shared_lock = threading.Lock()
+
+
+def share_bank_book(image: BankBookImage) -> BankBookImage:
+    """取得與 image 內容相同、已被其他紀錄使用的物件，沒有時登記 image 本身"""
+    with _shared_lock:
+        shared = _shared_images.get(image.digest)
+        if shared is None:
+            _shared_images[image.digest] = shared = image
+        return shared
+
+
+def decode_bank_book_image(image_base64: str, max_size: Optional[int] = None) -> BankBookImage:
+    """解碼並驗證 base64 編碼的存摺影本
+
+    圖片會被完整解碼一次，截斷或損壞的檔案在此就會被拒絕，而不是在產生 PDF 時
+    才以錯誤訊息的形式出現在頁面上。
+
+    Args:
+        image_base64: base64 字串，可帶 data URL 前綴（data:image/png;base64,）
+        max_size: 解碼後的位元組數上限
+
+    Returns:
+        BankBookImage: 已驗證的圖片
+
+    Raises:
+        ValueError: 不是有效的 base64、超過大小上限、格式不支援或無法解碼
+    """
+    text = image_base64.strip()
+    if text.startswith("data:"):
+        text = text.partition(",")[2]
+    try:
+        data = base64.b64decode("".join(text.split()), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError("存摺影本不是有效的 base64 編碼") from e
+    return load_bank_book_image(data, max_size)
+
+
+def load_bank_book_image(data: bytes, max_size: Optional[int] = None) -> BankBookImage:
+    """驗證以二進位上傳的存摺影本（規則與 decode_bank_book_image 相同）
+
+    Raises:
+        ValueError: 超過大小上限、格式不支援或無法解碼
+    """
+    if not data:
+        raise ValueError("存摺影本內容為空")
+    if max_size is not None and len(data) > max_size:
+        raise ValueError(f"存摺影本不可超過 {max_size / 1024 / 1024:g}MB")
+
+    # Pillow 只在實際解碼存摺影本時才載入，避免拖慢啟動
+    from PIL import Image as PILImage
+
+    try:
+        with PILImage.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            width, height = image.size
+            if image_format in ALLOWED_FORMATS:
+                image.load()
+    except PILImage.UnidentifiedImageError as e:
+        raise ValueError("存摺影本不是可辨識的圖片檔案") from e
+    except Exception as e:
+        raise ValueError(f"存摺影本圖片無法解碼：{e}") from e
+
+    if image_format not in ALLOWED_FORMATS:
+        raise ValueError(f"存摺影本僅支援 JPG、PNG、GIF 格式（收到 {image_format}）")
+    if width <= 0 or height <= 0:
+        raise ValueError("存摺影本圖片尺寸不正確")
+    return BankBookImage(data, width, height, image_format)
@@ -0,0 +1,361 @@
+"""離線批次渲染請款單 PDF.
+
+月結時一次產生大量 PDF，不經過 FastAPI 應用程式：
+
+    python -m src.request_payment.services.batch_render forms.jsonl --output out/
+    python -m src.request_payment.services.batch_render --storage-prefix forms-2024-05 --output out/
+
+輸入為 JSONL，每行一張請款單（建立請款單 API 的欄位，可另帶 id、created_at、
+updated_at、version；列表 API 的輸出也可直接使用），可來自本機檔案、標準輸入，
+或儲存後端中指定前綴下的 .jsonl 物件。
+
+渲染以行程池分散到所有 CPU 核心，每個子行程各自建立 PDFService，PDF 由子行程
+直接寫入輸出目錄，不經過主行程傳遞。每張完成的請款單附加一行到輸出目錄的
+manifest.jsonl（內容雜湊、檔案大小）；重新執行時，內容雜湊相同且檔案仍在的
+請款單直接跳過，中斷後可從上次的進度繼續。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 請款單編號中不能出現在檔名的字元
+_UNSAFE_FILENAME = re.compile(r"[^\w.-]")
+
+
+@dataclass
+class BatchJob:
+    """一張待渲染的請款單"""
+
+    form_id: str
+    content_hash: str
+    form: Dict[str, Any]
+    filename: str
+
+
+@dataclass
+class BatchStats:
+    """批次渲染結果統計"""
+
+    rendered: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+
+    @property
+    def forms_per_second(self) -> float:
+        return self.rendered / self.seconds if self.seconds > 0 else 0.0
+
+
+def content_hash(form: Dict[str, Any], profile: str, engine: str) -> str:
+    """請款單內容與輸出選項的雜湊；鍵值順序與空白不影響結果"""
+    canonical = json.dumps(
+        {"form": form, "profile": profile, "engine": engine},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def iter_jsonl_file(path: str) -> Iterator[Tuple[str, str]]:
+    """逐行讀取本機 JSONL 檔案（"-" 為標準輸入），產生 (來源位置, 內容)"""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for number, line in enumerate(stream, start=1):
+            yield f"{path}:{number}", line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def iter_storage_jsonl(prefix: str) -> Iterator[Tuple[str, str]]:
+    """逐一讀取儲存後端中指定前綴下的 .jsonl 物件，產生 (來源位置, 內容)"""
+    from ..core.config import get_settings
+    from .storage import create_storage
+
+    storage = create_storage(get_settings())
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(storage.ensure_ready())
+        objects = loop.run_until_complete(storage.list(prefix))
+        for info in sorted(objects, key=lambda item: item.key):
+            if not info.key.endswith(".jsonl"):
+                continue
+            data = loop.run_until_complete(storage.get(info.key))
+            if data is None:
+                logger.warning("儲存物件已不存在", key=info.key)
+                continue
+            for number, line in enumerate(data.decode("utf-8").splitlines(), start=1):
+                yield f"{storage.name}:{info.key}:{number}", line
+    finally:
+        loop.run_until_complete(storage.close())
+        loop.close()
+
+
+def load_manifest(output_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """讀取先前執行的 manifest，同一張請款單以最後一筆為準"""
+    entries: Dict[str, Dict[str, Any]] = {}
+    path = output_dir / MANIFEST_NAME
+    if not path.exists():
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entries[entry["id"]] = entry
+            except (ValueError, KeyError):
+                # 寫到一半中斷的最後一行
+                continue
+    return entries
+
+
+def is_up_to_date(job: BatchJob, entry: Optional[Dict[str, Any]], output_dir: Path) -> bool:
+    """輸出檔案存在、大小符合且內容雜湊相同時不需要重新渲染"""
+    if entry is None or entry.get("sha256") != job.content_hash:
+        return False
+    try:
+        return (output_dir / job.filename).stat().st_size == entry.get("bytes")
+    except OSError:
+        return False
+
+
+def _configure_logging(level: str) -> None:
+    """命令列只需簡單的 stderr 輸出；不使用應用程式的佇列 sink，避免在 fork 前啟動背景執行緒"""
+    logger.remove()
+    logger.add(sys.stderr, level=level, format="{time:HH:mm:ss} | {level: <8} | {message} | {extra}")
+
+
+# 子行程中共用的渲染設定
+_worker_options: Dict[str, str] = {}
+
+
+def _init_worker(profile: str, engine: str, log_level: str) -> None:
+    _configure_logging(log_level)
+    _worker_options.update(profile=profile, engine=engine)
+    # 每個子行程只註冊一次字體
+    from .pdf_service import get_pdf_service
+    service = get_pdf_service()
+    # 批次中的請款單各不相同，頁面快取不會命中，逐頁拼接只會增加成本
+    service.page_cache = None
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, str) and value:
+        return datetime.fromisoformat(value)
+    return None
+
+
+def _render_job(job: BatchJob, output_dir: str) -> Tuple[int, float]:
+    """在子行程中驗證並渲染一張請款單，寫入暫存檔後改名，回傳 (位元組數, 秒數)
+
+    例外只以訊息傳回主行程：部分例外（例如 pydantic 的 ValidationError）無法
+    pickle，直接拋出會讓整個行程池中斷。
+    """
+    try:
+        return _render_to_file(job, output_dir)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _render_to_file(job: BatchJob, output_dir: str) -> Tuple[int, float]:
+    from ..core.config import get_settings
+    from ..models.schemas import RequestFormCreate
+    from .bank_book import decode_bank_book_image
+    from .pdf_service import get_pdf_service
+
+    started = time.perf_counter()
+    validated = RequestFormCreate(**job.form)
+    bank_book = None
+    if validated.bank_book_image:
+        bank_book = decode_bank_book_image(validated.bank_book_image, get_settings().max_file_size)
+    payment_data = {
+        **validated.model_dump(),
+        "id": job.form_id,
+        "payment_details": validated.payment_details,
+        "bank_book": bank_book,
+        "total_amount": sum(item.amount for item in validated.payment_details),
+        # 未提供時間時 PDF 不帶日期，相同內容每次產生相同的檔案
+        "created_at": _parse_datetime(job.form.get("created_at")),
+        "updated_at": _parse_datetime(job.form.get("updated_at")),
+        "version": job.form.get("version", 1),
+    }
+
+    target = os.path.join(output_dir, job.filename)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "w+b") as output:
+            size = get_pdf_service().write_payment_request_pdf(
+                payment_data, output, engine=_worker_options["engine"], profile=_worker_options["profile"]
+            )
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return size, time.perf_counter() - started
+
+
+def iter_jobs(lines: Iterator[Tuple[str, str]], profile: str, engine: str) -> Iterator[Tuple[str, Any]]:
+    """解析輸入行，產生 (來源位置, BatchJob 或錯誤訊息)；空白行略過"""
+    for source, line in lines:
+        if not line.strip():
+            continue
+        try:
+            form = json.loads(line)
+        except ValueError as e:
+            yield source, f"JSON 格式錯誤: {e}"
+            continue
+        if not isinstance(form, dict):
+            yield source, "每行必須是一張請款單的 JSON 物件"
+            continue
+        digest = content_hash(form, profile, engine)
+        # 未提供編號時以內容雜湊命名，重新執行時檔名不變
+        form_id = str(form.get("id") or digest[:16])
+        filename = _UNSAFE_FILENAME.sub("_", form_id) + ".pdf"
+        yield source, BatchJob(form_id, digest, form, filename)
+
+
+def run_batch(
+    lines: Iterator[Tuple[str, str]],
+    output_dir: Path,
+    workers: int,
+    profile: str,
+    engine: str = "auto",
+    log_level: str = "WARNING",
+    force: bool = False,
+    progress_interval: float = 5.0,
+) -> BatchStats:
+    """以行程池渲染所有請款單
+
+    同時送出的工作數量限制為 workers 的數倍，輸入不會一次全部讀進記憶體。
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {} if force else load_manifest(output_dir)
+    stats = BatchStats()
+    seen: Dict[str, str] = {}
+    pending: Deque[Tuple[str, BatchJob, Future]] = deque()
+    started = last_report = time.perf_counter()
+
+    def report(final: bool = False) -> None:
+        stats.seconds = time.perf_counter() - started
+        print(
+            f"{'完成' if final else '進度'}：渲染 {stats.rendered}、跳過 {stats.skipped}、失敗 {stats.failed}，"
+            f"{stats.seconds:.1f} 秒，{stats.forms_per_second:.1f} 張/秒",
+            file=sys.stderr,
+        )
+
+    with open(output_dir / MANIFEST_NAME, "a", encoding="utf-8") as manifest_file, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(profile, engine, log_level)
+    ) as pool:
+
+        def collect(source: str, job: BatchJob, future: Future) -> None:
+            try:
+                size, seconds = future.result()
+            except Exception as e:
+                stats.failed += 1
+                logger.error("請款單渲染失敗", source=source, form_id=job.form_id, error=str(e))
+                return
+            stats.rendered += 1
+            stats.bytes_written += size
+            entry = {"id": job.form_id, "file": job.filename, "sha256": job.content_hash, "bytes": size,
+                     "seconds": round(seconds, 4)}
+            manifest_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest_file.flush()
+
+        for source, job in iter_jobs(lines, profile, engine):
+            if isinstance(job, str):
+                stats.failed += 1
+                logger.error("無法讀取請款單", source=source, error=job)
+                continue
+            if seen.setdefault(job.filename, source) != source:
+                stats.failed += 1
+                logger.error("請款單編號重複", source=source, form_id=job.form_id, first=seen[job.filename])
+                continue
+            if is_up_to_date(job, manifest.get(job.form_id), output_dir):
+                stats.skipped += 1
+                continue
+
+            pending.append((source, job, pool.submit(_render_job, job, str(output_dir))))
+            while len(pending) >= workers * 4 or (pending and pending[0][2].done()):
+                collect(*pending.popleft())
+
+            if progress_interval and time.perf_counter() - last_report >= progress_interval:
+                report()
+                last_report = time.perf_counter()
+
+        while pending:
+            collect(*pending.popleft())
+
+    report(final=True)
+    return stats
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="以多核心批次渲染請款單 PDF（可中斷後續跑）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("input", nargs="?", help="JSONL 檔案路徑，- 為標準輸入")
+    source.add_argument("--storage-prefix", help="從儲存後端讀取此前綴下的 .jsonl 物件")
+    parser.add_argument("--output", "-o", required=True, help="PDF 輸出目錄")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count() or 1, help="子行程數量（預設為 CPU 核心數）")
+    parser.add_argument("--profile", default=None, help="PDF 輸出設定檔（預設為 PDF_OUTPUT_PROFILE）")
+    parser.add_argument("--engine", choices=("auto", "canvas", "platypus"), default="auto", help="渲染引擎")
+    parser.add_argument("--force", action="store_true", help="忽略 manifest，全部重新渲染")
+    parser.add_argument("--log-level", default="WARNING", help="日誌等級")
+    args = parser.parse_args()
+
+    from .pdf_output import get_output_profile
+
+    try:
+        profile = get_output_profile(args.profile).name
+    except ValueError as e:
+        parser.error(str(e))
+
+    _configure_logging(args.log_level.upper())
+    lines = iter_storage_jsonl(args.storage_prefix) if args.storage_prefix else iter_jsonl_file(args.input)
+
+    stats = run_batch(
+        lines,
+        Path(args.output),
+        workers=max(args.workers, 1),
+        profile=profile,
+        engine=args.engine,
+        log_level=args.log_level.upper(),
+        force=args.force,
+    )
+    print(
+        json.dumps(
+            {
+                "rendered": stats.rendered,
+                "skipped": stats.skipped,
+                "failed": stats.failed,
+                "bytes": stats.bytes_written,
+                "seconds": round(stats.seconds, 3),
+                "forms_per_second": round(stats.forms_per_second, 2),
+            },
+            ensure_ascii=False,
+        )
+    )
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""直接繪製（canvas）的請款單快速渲染引擎.
+
+大多數請款單的明細表格只佔一頁，版面是固定的：標題、基本資訊、說明文字、
+明細表格、單據憑證黏貼單與存摺影本。這個引擎第一次使用時讓 Platypus 排版一次
+固定的內容（段落換行、表格欄寬與儲存格樣式），之後每次渲染只需把資料直接畫在
+canvas 上，省去 SimpleDocTemplate、Table、TableStyle 的排版與分頁成本。
+
+輸出與 Platypus 的結果在視覺上相同；表格超過一頁或存摺影本無法解碼時，
+由 PDFService 改用 Platypus 渲染。
+"""
+
+import io
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Paragraph, Spacer, Table
+
+from ..core.tracing import start_span
+from .form_template import RenderPlan
+from .pdf_layout import FRAME_HEIGHT, FRAME_TOP, FRAME_WIDTH, FRAME_X
+from .pdf_output import OutputProfile
+
+
+class _Block(NamedTuple):
+    """依 Frame 堆疊規則排列的一個版面區塊"""
+    width: float
+    height: float
+    space_before: float
+    space_after: float
+    h_align: str
+    draw: Optional[Callable[[Canvas, float, float], None]]
+
+
+class _ParagraphLayout(NamedTuple):
+    """預先換行的靜態段落"""
+    lines: List[str]
+    font_name: str
+    font_size: float
+    leading: float
+    centered: bool
+
+
+class _TableLayout(NamedTuple):
+    """從 Platypus Table 擷取的欄寬、儲存格樣式與框線"""
+    col_widths: List[float]
+    header_styles: Optional[list]
+    body_styles: list
+    grid: Optional[Tuple[float, Any]]
+
+
+def _stack(canvas: Canvas, blocks: Sequence[_Block]) -> None:
+    """依 platypus Frame.add 的規則由上而下排列並繪製區塊
+
+    頁首第一個區塊的 spaceBefore 不計，相鄰區塊的 spaceBefore 與前一個
+    區塊的 spaceAfter 重疊，水平對齊依 Flowable.hAlign。
+    """
+    y = FRAME_TOP
+    previous_space_after = 0.0
+    for index, block in enumerate(blocks):
+        if index:
+            y -= max(block.space_before - previous_space_after, 0)
+        y -= block.height
+        if block.draw is not None:
+            x = FRAME_X
+            if block.h_align == 'CENTER':
+                x += (FRAME_WIDTH - block.width) / 2
+            elif block.h_align == 'RIGHT':
+                x += FRAME_WIDTH - block.width
+            block.draw(canvas, x, y)
+        y -= block.space_after
+        previous_space_after = block.space_after
+
+
+def _spacer(height: float) -> _Block:
+    return _Block(0, height, 0, 0, 'LEFT', None)
+
+
+def _paragraph_layout(paragraph: Paragraph) -> _ParagraphLayout:
+    """以 Platypus 換行一次，保留每一行的文字"""
+    paragraph.wrap(FRAME_WIDTH, FRAME_HEIGHT)
+    style = paragraph.style
+    return _ParagraphLayout(
+        lines=[" ".join(words) for _, words in paragraph.blPara.lines],
+        font_name=style.fontName,
+        font_size=style.fontSize,
+        leading=style.leading,
+        centered=style.alignment == TA_CENTER,
+    )
+
+
+def _paragraph_block(paragraph: Paragraph, layout: _ParagraphLayout) -> _Block:
+    def draw(canvas: Canvas, x: float, y: float) -> None:
+        canvas.setFont(layout.font_name, layout.font_size, layout.leading)
+        baseline = y + len(layout.lines) * layout.leading - layout.font_size
+        for line in layout.lines:
+            if layout.centered:
+                canvas.drawCentredString(x + FRAME_WIDTH / 2, baseline, line)
+            else:
+                canvas.drawString(x, baseline, line)
+            baseline -= layout.leading
+
+    return _Block(
+        FRAME_WIDTH,
+        len(layout.lines) * layout.leading,
+        paragraph.getSpaceBefore(),
+        paragraph.getSpaceAfter(),
+        'LEFT',
+        draw,
+    )
+
+
+def _table_layout(table: Table, has_header: bool) -> _TableLayout:
+    """擷取表格版面；有表頭時第 0 列為表頭樣式，其後的列沿用第 1 列的樣式"""
+    table.wrap(FRAME_WIDTH, FRAME_HEIGHT)
+    grid = None
+    for command in table._linecmds:
+        if command[0] in ('GRID', 'BOX'):
+            grid = (command[3], command[4])
+    return _TableLayout(
+        col_widths=list(table._colWidths),
+        header_styles=table._cellStyles[0] if has_header else None,
+        body_styles=table._cellStyles[1 if has_header else 0],
+        grid=grid,
+    )
+
+
+def _table_block(layout: _TableLayout, rows: List[List[str]], row_heights: List[float], header: Optional[List[str]] = None) -> _Block:
+    """以擷取的表格版面繪製資料，儲存格文字位置與 Table._drawCell 相同"""
+    if header is not None:
+        rows = [header] + rows
+    width = sum(layout.col_widths)
+    height = sum(row_heights)
+
+    def draw(canvas: Canvas, x: float, y: float) -> None:
+        canvas.saveState()
+        current_style = None
+        row_top = y + height
+        for row_index, (row, row_height) in enumerate(zip(rows, row_heights)):
+            row_bottom = row_top - row_height
+            styles = layout.header_styles if header is not None and row_index == 0 else layout.body_styles
+            col_x = x
+            for value, style, col_width in zip(row, styles, layout.col_widths):
+                if value is None:
+                    # Table 不繪製 None 儲存格
+                    col_x += col_width
+                    continue
+                if style is not current_style:
+                    canvas.setFillColor(style.color)
+                    canvas.setFont(style.fontname, style.fontsize, style.leading)
+                    current_style = style
+                lines = str(value).split("\n")
+                text_x = col_x + style.leftPadding
+                text_y = row_bottom + (style.bottomPadding + row_height - style.topPadding + len(lines) * style.leading) / 2.0 - style.fontsize
+                for line in lines:
+                    canvas.drawString(text_x, text_y, line)
+                    text_y -= style.leading
+                col_x += col_width
+            row_top = row_bottom
+
+        if layout.grid is not None:
+            weight, color = layout.grid
+            canvas.setLineWidth(weight)
+            canvas.setStrokeColor(color)
+            canvas.setLineCap(1)
+            col_positions = [x]
+            for col_width in layout.col_widths:
+                col_positions.append(col_positions[-1] + col_width)
+            row_positions = [y + height]
+            for row_height in row_heights:
+                row_positions.append(row_positions[-1] - row_height)
+            canvas.lines(
+                [(col_positions[0], row_y, col_positions[-1], row_y) for row_y in row_positions]
+                + [(col_x, row_positions[-1], col_x, row_positions[0]) for col_x in col_positions]
+            )
+        canvas.restoreState()
+
+    return _Block(width, height, 0, 0, 'CENTER', draw)
+
+
+class CanvasRenderer:
+    """直接在 canvas 上繪製單頁請款單的渲染引擎"""
+
+    def __init__(self, service):
+        self.service = service
+        self._layouts: Dict[str, Dict[str, Any]] = {}
+
+    def can_render(self, split_indices: list) -> bool:
+        """請款明細只佔一頁時才使用快速渲染"""
+        return len(split_indices) == 1
+
+    def render(
+        self,
+        data: Dict[str, Any],
+        rows: List[List[str]],
+        row_heights: List[float],
+        buffer,
+        profile: OutputProfile,
+        plan: RenderPlan,
+    ) -> Optional[Tuple[Canvas, int]]:
+        """在寫入 buffer 的 canvas 上繪製整份請款單（由呼叫端呼叫 canvas.save()）
+
+        Returns:
+            Optional[Tuple[Canvas, int]]: canvas 與頁數；存摺影本無法解碼時回傳 None，
+            由呼叫端改用 Platypus 顯示錯誤訊息
+        """
+        layouts = self._get_layouts(plan)
+        service = self.service
+
+        bank_book = None
+        if service._needs_bank_book_page(data):
+            bank_book = self._bank_book_blocks(data, layouts, profile, plan)
+            if bank_book is None:
+                return None
+
+        canvas = service._make_canvas(data, buffer, pagesize=A4)
+
+        # 第一頁：請款單
+        service._draw_page_elements(canvas, data, 1, plan)
+        _stack(canvas, [
+            *layouts["title"],
+            _table_block(layouts["basic_info"], service._build_basic_info_rows(data, plan), layouts["basic_info_heights"]),
+            *layouts["notes"],
+            _table_block(layouts["detail"], rows, [layouts["detail_header_height"]] + row_heights, header=plan.detail_headers),
+        ])
+        canvas.showPage()
+
+        # 第二頁：單據憑證黏貼單
+        service._draw_page_elements(canvas, data, 1, plan)
+        receipt_info = [[plan.receipt["payee_label"], data.get("payee", ""), plan.receipt["date_label"], data.get("application_date", "")]]
+        _stack(canvas, [
+            *layouts["receipt_title"],
+            _table_block(layouts["receipt_info"], receipt_info, layouts["receipt_info_heights"]),
+            *layouts["receipt_notes"],
+        ])
+        canvas.showPage()
+        page_count = 2
+
+        # 第三頁：存摺影本 (條件性)
+        if bank_book is not None:
+            service._draw_page_elements(canvas, data, 1, plan)
+            _stack(canvas, bank_book)
+            canvas.showPage()
+            page_count += 1
+
+        return canvas, page_count
+
+    def _bank_book_blocks(
+        self, data: Dict[str, Any], layouts: Dict[str, Any], profile: OutputProfile, plan: RenderPlan
+    ) -> Optional[List[_Block]]:
+        """存摺影本頁面的區塊；沒有圖片時顯示提示文字，圖片依輸出設定檔縮小並重新編碼"""
+        blocks = list(layouts["bank_book_title"])
+        if data.get("bank_book") is None and not data.get("bank_book_image"):
+            return blocks + [layouts["bank_book_placeholder"]]
+
+        try:
+            image = self.service._get_bank_book(data)
+        except ValueError:
+            return None
+
+        # 與請款明細表格同寬，等比例縮放；超過頁面剩餘高度時縮小到剛好放得下
+        aspect_ratio = image.aspect_ratio
+        target_width = plan.detail_width
+        target_height = target_width / aspect_ratio
+        available_height = _stack_height(blocks, FRAME_HEIGHT)
+        if target_height > available_height:
+            target_width, target_height = available_height * aspect_ratio, available_height
+        try:
+            with start_span("pdf.bank_book_image", source_bytes=len(image.data)):
+                image_data = image.for_profile(target_width, target_height, profile)
+        except Exception:
+            return None
+
+        def draw(canvas: Canvas, x: float, y: float) -> None:
+            canvas.drawImage(ImageReader(io.BytesIO(image_data)), x, y, target_width, target_height)
+
+        return blocks + [_Block(target_width, target_height, 0, 0, 'CENTER', draw)]
+
+    def _get_layouts(self, plan: RenderPlan) -> Dict[str, Any]:
+        """讓 Platypus 排版一次固定內容並擷取結果（每個表單範本只做一次）"""
+        layouts = self._layouts.get(plan.name)
+        if layouts is None:
+            layouts = self._layouts[plan.name] = self._build_layouts(plan)
+        return layouts
+
+    def _build_layouts(self, plan: RenderPlan) -> Dict[str, Any]:
+        service = self.service
+        sample = {"payee": "", "application_date": ""}
+        layouts: Dict[str, Any] = {}
+
+        header = service._build_payment_request_header(sample, plan)
+        basic_info = header[2]
+        layouts["title"] = self._static_blocks(header[:2])
+        layouts["basic_info"] = _table_layout(basic_info, has_header=False)
+        layouts["basic_info_heights"] = list(basic_info._argH)
+        layouts["notes"] = self._static_blocks(header[3:])
+
+        detail = service._build_detail_table([[""] * len(plan.columns)], [0], plan)
+        layouts["detail"] = _table_layout(detail, has_header=True)
+        layouts["detail_header_height"] = detail._argH[0]
+
+        receipt = service._build_receipt_attachment_page(sample, plan)
+        receipt_info = receipt[2]
+        layouts["receipt_title"] = self._static_blocks(receipt[:2])
+        layouts["receipt_info"] = _table_layout(receipt_info, has_header=False)
+        layouts["receipt_info_heights"] = list(receipt_info._argH)
+        layouts["receipt_notes"] = self._static_blocks(receipt[3:])
+
+        bank_book = service._build_bank_book_page({}, plan)
+        layouts["bank_book_title"] = self._static_blocks(bank_book[:2])
+        layouts["bank_book_placeholder"] = self._static_blocks(bank_book[2:])[0]
+        return layouts
+
+    @staticmethod
+    def _static_blocks(flowables: list) -> List[_Block]:
+        blocks = []
+        for flowable in flowables:
+            if isinstance(flowable, Paragraph):
+                blocks.append(_paragraph_block(flowable, _paragraph_layout(flowable)))
+            elif isinstance(flowable, Spacer):
+                blocks.append(_spacer(flowable.height))
+            else:
+                raise TypeError(f"無法預先排版的元件: {type(flowable).__name__}")
+        return blocks
+
+
+def _stack_height(blocks: Sequence[_Block], available: float) -> float:
+    """計算區塊堆疊後 Frame 剩餘的高度"""
+    used = 0.0
+    previous_space_after = 0.0
+    for index, block in enumerate(blocks):
+        if index:
+            used += max(block.space_before - previous_space_after, 0)
+        used += block.height + block.space_after
+        previous_space_after = block.space_after
+    return available - used
@@ -1,18 +1,20 @@
 """File management service for handling uploads, storage, and retrieval."""
 
-import os
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import AsyncIterable, AsyncIterator, Optional, Dict, Any
 from enum import Enum
 
-import aiofiles
 from fastapi import UploadFile, HTTPException
-from PIL import Image
+from loguru import logger
 import io
 
 from ..core.config import get_settings
+from ..core.metrics import FILE_OPERATION_SECONDS, UPLOAD_BYTES
+from ..core.tracing import start_span
+from .storage import StorageBackend, create_storage
 
 
 class FileType(str, Enum):
@@ -22,11 +24,16 @@ class FileType(str, Enum):
 
 
 class FileManager:
-    """File management service for handling file operations."""
+    """File management service for handling file operations.
     
-    def __init__(self):
+    檔案實際寫入的位置由儲存後端決定（STORAGE_BACKEND：本機目錄或 S3 相容物件儲存），
+    file_id 即為物件在後端中的 key。
+    """
+    
+    def __init__(self, storage: Optional[StorageBackend] = None):
         """Initialize file manager with settings."""
         self.settings = get_settings()
+        self.storage = storage or create_storage(self.settings)
         self._ensure_directories()
     
     def _ensure_directories(self) -> None:
@@ -38,17 +45,22 @@ class FileManager:
         
         for directory in directories:
             Path(directory).mkdir(parents=True, exist_ok=True)
-            print(f"確保目錄存在: {directory}")
+            logger.debug("確保目錄存在", directory=directory)
     
-    def _get_file_path(self, file_type: FileType, filename: str) -> str:
-        """Get the appropriate file path based on file type."""
-        base_paths = {
-            FileType.IMAGE: self.settings.images_dir,
-            FileType.DOCUMENT: self.settings.images_dir,  # Use images_dir for documents too
-        }
-        
-        base_path = base_paths.get(file_type, self.settings.upload_dir)
-        return os.path.join(base_path, filename)
+    @contextmanager
+    def _operation(self, operation: str, **attributes: Any):
+        """Time a storage operation and record it as a trace span."""
+        with FILE_OPERATION_SECONDS.time(operation=operation), \
+                start_span(f"file.{operation}", backend=self.storage.name, **attributes) as span:
+            yield span
+    
+    async def start(self) -> None:
+        """Prepare the storage backend (create directories or check the bucket)."""
+        await self.storage.ensure_ready()
+    
+    async def close(self) -> None:
+        """Release storage backend resources such as pooled connections."""
+        await self.storage.close()
     
     def _generate_unique_filename(
         self,
@@ -112,11 +124,10 @@ class FileManager:
                 detail="不支援的圖片格式。僅支援 JPG, PNG, GIF 格式"
             )
         
-        # Read file content
-        file_content = await file.read()
-        
-        # Validate file size
-        if not self.validate_file_size(len(file_content), FileType.IMAGE):
+        # 大小以 Starlette 暫存的上傳檔計算，不必先讀進記憶體
+        file_size = file.file.seek(0, io.SEEK_END)
+        file.file.seek(0)
+        if not self.validate_file_size(file_size, FileType.IMAGE):
             raise HTTPException(
                 status_code=400,
                 detail=f"圖片檔案過大。最大允許大小為 {self.settings.max_image_size // 1024 // 1024}MB"
@@ -124,33 +135,34 @@ class FileManager:
         
         # Validate image content if required
         if validate_image:
+            # Pillow 只在實際驗證圖片時才載入，避免拖慢啟動
+            from PIL import Image
+
             try:
-                image = Image.open(io.BytesIO(file_content))
-                image.verify()
+                with self._operation("verify_image"):
+                    image = Image.open(file.file)
+                    image.verify()
             except Exception:
                 raise HTTPException(status_code=400, detail="無效的圖片檔案")
+            finally:
+                file.file.seek(0)
         
-        # Generate unique filename
-        unique_filename = self._generate_unique_filename(
+        return await self.save_stream(
+            self._read_chunks(file),
             file.filename,
+            file.content_type,
+            file_type=FileType.IMAGE,
             prefix=prefix
         )
-        
-        # Save file
-        file_path = self._get_file_path(FileType.IMAGE, unique_filename)
-        
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_content)
-        
-        return {
-            "file_id": unique_filename,
-            "original_filename": file.filename,
-            "file_path": file_path,
-            "file_size": len(file_content),
-            "content_type": file.content_type,
-            "file_type": FileType.IMAGE,
-            "created_at": datetime.now().isoformat()
-        }
+    
+    @staticmethod
+    async def _read_chunks(file: UploadFile, chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+        """Read an upload in fixed-size chunks."""
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
     
     async def save_document(
         self,
@@ -167,87 +179,55 @@ class FileManager:
         )
         
         # Save file
-        file_path = self._get_file_path(FileType.DOCUMENT, unique_filename)
-        
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_content)
+        UPLOAD_BYTES.inc(len(file_content), file_type=FileType.DOCUMENT.value)
+        with self._operation("write", file_type=FileType.DOCUMENT.value, size=len(file_content)):
+            await self.storage.put(unique_filename, file_content, content_type)
         
         return {
             "file_id": unique_filename,
             "original_filename": filename,
-            "file_path": file_path,
+            "file_path": self.storage.location(unique_filename),
             "file_size": len(file_content),
             "content_type": content_type,
             "file_type": FileType.DOCUMENT,
             "created_at": datetime.now().isoformat()
         }
     
-
-    
-    async def get_file(self, file_id: str, file_type: FileType) -> Optional[bytes]:
-        """Retrieve file content by file ID."""
-        file_path = self._get_file_path(file_type, file_id)
-        
-        if not os.path.exists(file_path):
-            return None
-        
-        async with aiofiles.open(file_path, 'rb') as f:
-            return await f.read()
-    
-    def get_file_info(self, file_id: str, file_type: FileType) -> Optional[Dict[str, Any]]:
-        """Get file information."""
-        file_path = self._get_file_path(file_type, file_id)
+    async def save_stream(
+        self,
+        chunks: AsyncIterable[bytes],
+        filename: str,
+        content_type: str,
+        file_type: FileType = FileType.DOCUMENT,
+        prefix: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Save a file from an async byte stream without buffering it in memory."""
+        unique_filename = self._generate_unique_filename(filename, prefix=prefix)
         
-        if not os.path.exists(file_path):
-            return None
+        with self._operation("write", file_type=file_type.value) as span:
+            file_size = await self.storage.put_stream(unique_filename, chunks, content_type)
+            span.set_attribute("size", file_size)
+        UPLOAD_BYTES.inc(file_size, file_type=file_type.value)
         
-        stat = os.stat(file_path)
         return {
-            "file_id": file_id,
-            "file_path": file_path,
-            "file_size": stat.st_size,
+            "file_id": unique_filename,
+            "original_filename": filename,
+            "file_path": self.storage.location(unique_filename),
+            "file_size": file_size,
+            "content_type": content_type,
             "file_type": file_type,
-            "created_at": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-            "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat()
+            "created_at": datetime.now().isoformat()
         }
     
-    def list_files(self, file_type: FileType) -> List[Dict[str, Any]]:
-        """List all files of a specific type."""
-        base_path = self._get_file_path(file_type, "")
-        
-        if not os.path.exists(base_path):
-            return []
-        
-        files = []
-        for filename in os.listdir(base_path):
-            file_path = os.path.join(base_path, filename)
-            if os.path.isfile(file_path):
-                stat = os.stat(file_path)
-                files.append({
-                    "file_id": filename,
-                    "file_path": file_path,
-                    "file_size": stat.st_size,
-                    "file_type": file_type,
-                    "created_at": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                    "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat()
-                })
-        
-        return sorted(files, key=lambda x: x["created_at"], reverse=True)
+    async def get_file(self, file_id: str, file_type: FileType) -> Optional[bytes]:
+        """Retrieve file content by file ID."""
+        with self._operation("read", file_type=file_type.value):
+            return await self.storage.get(file_id)
     
     async def delete_file(self, file_id: str, file_type: FileType) -> bool:
         """Delete a file."""
-        file_path = self._get_file_path(file_type, file_id)
-        
-        if not os.path.exists(file_path):
-            return False
-        
-        try:
-            os.remove(file_path)
-            return True
-        except Exception:
-            return False
-    
-
+        with self._operation("delete", file_type=file_type.value):
+            return await self.storage.delete(file_id)
 
 
 # Global file manager instance
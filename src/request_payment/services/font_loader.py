@@ -0,0 +1,172 @@
+"""字體載入服務.
+
+TrueType 字體檔以 mmap 唯讀對映，不再由每個行程各自把整個字體檔讀進記憶體；
+對映的頁面屬於作業系統的檔案快取，多個 uvicorn worker 或渲染行程之間共用，
+且只有嵌入子集時實際讀到的 glyph 才會載入。
+
+解析字體得到的度量資料（字元對應、字寬、表格目錄、glyph 位置等）序列化成
+快取檔，其他行程啟動時直接載入，不必重新解析字體。快取以字體檔路徑、大小、
+修改時間與 ReportLab 版本為指紋，字體檔更新後會自動重建。
+"""
+
+import hashlib
+import mmap
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import reportlab
+from loguru import logger
+from reportlab.pdfbase.ttfonts import TTEncoding, TTFont, TTFontFace
+
+from ..core.config import get_settings
+from ..core.metrics import record_cache_lookup
+
+# 快取內容格式變更時遞增，舊版快取檔會被視為失效
+CACHE_FORMAT_VERSION = 1
+CACHE_SUFFIX = ".metrics"
+
+# 字體檔內容與讀取位置不寫進快取，載入時改由 mmap 提供
+_UNCACHED_ATTRIBUTES = ("_ttf_data", "_pos")
+
+
+class MappedTTFont(TTFont):
+    """以 mmap 字體檔與預先解析的度量資料建立的 TTFont
+
+    與 TTFont 行為相同，只是跳過讀檔與解析：字體內容由 face 上的 mmap 提供，
+    嵌入子集時才依 glyph 位置讀取需要的片段。
+    """
+
+    def __init__(self, name: str, face: TTFontFace, asciiReadable: Optional[int] = None):
+        from weakref import WeakKeyDictionary
+        from reportlab import rl_config
+
+        self.fontName = name
+        self.face = face
+        self.encoding = TTEncoding()
+        self.state = WeakKeyDictionary()
+        if asciiReadable is None:
+            asciiReadable = rl_config.ttfAsciiReadable
+        self._asciiReadable = asciiReadable
+
+
+def load_ttf_font(font_name: str, font_path: str, cache_dir: Optional[str] = None) -> TTFont:
+    """載入 TrueType 字體
+
+    Args:
+        font_name: 註冊到 ReportLab 的字體名稱
+        font_path: 字體檔路徑（.ttf / .ttc，使用第一個子字體）
+        cache_dir: 度量快取目錄，未指定時使用設定值，空字串表示不使用快取
+
+    Returns:
+        TTFont: 可直接交給 pdfmetrics.registerFont 的字體
+    """
+    if cache_dir is None:
+        cache_dir = get_settings().font_cache_dir
+
+    started = time.perf_counter()
+    font_path = os.path.realpath(font_path)
+    data = _map_file(font_path)
+    fingerprint = _fingerprint(font_path)
+    cache_path = _cache_path(cache_dir, font_path) if cache_dir else None
+
+    metrics = _read_cache(cache_path, fingerprint) if cache_path else None
+    if cache_path:
+        record_cache_lookup("font_metrics", metrics is not None)
+
+    if metrics is None:
+        face = _parse_face(font_path, data)
+        if cache_path:
+            _write_cache(cache_path, fingerprint, _face_metrics(face))
+    else:
+        face = _restore_face(data, metrics)
+
+    logger.debug(
+        "字體載入完成",
+        font_path=font_path,
+        cached=metrics is not None,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
+    return MappedTTFont(font_name, face)
+
+
+def _map_file(font_path: str) -> mmap.mmap:
+    """以唯讀方式對映字體檔（檔案描述子關閉後對映仍有效）"""
+    with open(font_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _fingerprint(font_path: str) -> Tuple[Any, ...]:
+    stat = os.stat(font_path)
+    return (CACHE_FORMAT_VERSION, reportlab.Version, font_path, stat.st_size, stat.st_mtime_ns)
+
+
+def _cache_path(cache_dir: str, font_path: str) -> str:
+    # 路徑雜湊避免不同目錄下的同名字體互相覆蓋
+    digest = hashlib.sha1(font_path.encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(font_path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest}{CACHE_SUFFIX}")
+
+
+def _parse_face(font_path: str, data: mmap.mmap) -> TTFontFace:
+    """解析字體檔；預先放入 _ttf_data 讓 ReportLab 直接使用 mmap 而不讀檔"""
+    face = TTFontFace.__new__(TTFontFace)
+    face._ttf_data = data
+    face.filename = font_path
+    TTFontFace.__init__(face, font_path)
+    return face
+
+
+def _restore_face(data: mmap.mmap, metrics: Dict[str, Any]) -> TTFontFace:
+    face = TTFontFace.__new__(TTFontFace)
+    face.__dict__.update(metrics)
+    face._ttf_data = data
+    face._pos = 0
+    return face
+
+
+def _face_metrics(face: TTFontFace) -> Dict[str, Any]:
+    return {key: value for key, value in face.__dict__.items() if key not in _UNCACHED_ATTRIBUTES}
+
+
+def _read_cache(cache_path: str, fingerprint: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+    """讀取度量快取，不存在、損毀或指紋不符時回傳 None"""
+    try:
+        with open(cache_path, "rb") as f:
+            cached_fingerprint, metrics = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("字型度量快取無法讀取，將重新建立", cache_path=cache_path, error=str(e))
+        return None
+
+    if cached_fingerprint != fingerprint:
+        logger.info("字體檔已變更，重新建立字型度量快取", cache_path=cache_path)
+        return None
+    return metrics
+
+
+def _write_cache(cache_path: str, fingerprint: Tuple[Any, ...], metrics: Dict[str, Any]) -> None:
+    """寫入度量快取
+
+    先寫入同目錄的暫存檔再以 os.replace 取代，多個 worker 同時重建時
+    其他行程只會讀到完整的舊檔或新檔。寫入失敗只影響下次啟動的速度。
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((fingerprint, metrics), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except Exception as e:
+        logger.warning("字型度量快取寫入失敗", cache_path=cache_path, error=str(e))
+        return
+
+    logger.info("已建立字型度量快取", cache_path=cache_path)
+
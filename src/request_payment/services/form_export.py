@@ -0,0 +1,253 @@
+"""請款明細匯出.
+
+每筆請款明細輸出為一列，並帶上所屬請款單的表頭欄位，供會計匯入試算表。
+CSV 與 XLSX 都以產生器逐批輸出：一次只處理一小批明細列，記憶體用量與
+匯出的筆數無關。XLSX 不依賴第三方套件，直接以 zipfile 串流寫出最精簡的
+Office Open XML 活頁簿（字串以 inlineStr 內嵌，不需要共用字串表）。
+"""
+
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+from .spending_report import record_month
+
+# 每列依序為請款單表頭欄位與明細欄位
+EXPORT_COLUMNS: List[str] = [
+    "請款單編號",
+    "申請日期",
+    "受款人",
+    "付款方式",
+    "付款方式說明",
+    "請款單位",
+    "請款單位說明",
+    "請款總金額",
+    "建立時間",
+    "版本",
+    "明細序號",
+    "專案類型",
+    "費用類型",
+    "執行時間",
+    "執行內容",
+    "金額",
+    "備註憑證",
+]
+
+# 每次產出的列數：太小時每列都要經過一次串流回應，太大則佔用記憶體
+_BATCH_ROWS = 500
+
+# 開頭為這些字元的儲存格會被試算表當作公式執行（CSV injection）
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# XML 1.0 不允許的控制字元
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+@dataclass(frozen=True)
+class FormFilter:
+    """請款單篩選條件（列表與匯出共用），未指定的條件不篩選"""
+
+    requesting_unit: Optional[str] = None
+    payment_method: Optional[str] = None
+    month_from: Optional[str] = None
+    month_to: Optional[str] = None
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        if self.requesting_unit is not None and _text(record.get("requesting_unit")) != self.requesting_unit:
+            return False
+        if self.payment_method is not None and _text(record.get("payment_method")) != self.payment_method:
+            return False
+        if self.month_from is not None or self.month_to is not None:
+            month = record_month(record)
+            if self.month_from is not None and month < self.month_from:
+                return False
+            if self.month_to is not None and month > self.month_to:
+                return False
+        return True
+
+    def apply(self, records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        return (record for record in records if self.matches(record))
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if hasattr(value, "value"):
+        return str(value.value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    return str(value)
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+def iter_detail_rows(records: Iterable[Dict[str, Any]]) -> Iterator[List[Any]]:
+    """逐筆產生明細列（請款單表頭 + 明細），數值欄位保留 Decimal / int"""
+    for record in records:
+        header = [
+            record.get("id"),
+            record.get("application_date"),
+            record.get("payee"),
+            record.get("payment_method"),
+            record.get("payment_method_other"),
+            record.get("requesting_unit"),
+            record.get("requesting_unit_other"),
+            record.get("total_amount"),
+            record.get("created_at"),
+            record.get("version"),
+        ]
+        for index, item in enumerate(record.get("payment_details") or [], start=1):
+            yield header + [
+                index,
+                _field(item, "project_type"),
+                _field(item, "expense_type"),
+                _field(item, "execution_time"),
+                _field(item, "execution_content"),
+                _field(item, "amount"),
+                _field(item, "receipt_note"),
+            ]
+
+
+def _number(value: Any) -> Optional[str]:
+    """數值欄位的文字表示（Decimal 不使用科學記號），非數值回傳 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, Decimal):
+        return format(value, "f")
+    if isinstance(value, int):
+        return str(value)
+    return None
+
+
+def _csv_cell(value: Any) -> str:
+    number = _number(value)
+    if number is not None:
+        return number
+    text = _text(value)
+    # 文字欄位以單引號開頭，避免在試算表中被當成公式
+    return "'" + text if text.startswith(_FORMULA_PREFIXES) else text
+
+
+def iter_csv(rows: Iterable[List[Any]]) -> Iterator[bytes]:
+    """以 UTF-8（含 BOM，Excel 才能正確辨識中文）逐批產生 CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        pending += 1
+        # 累積一批後再輸出，減少串流回應的往返次數
+        if pending >= _BATCH_ROWS:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """收集 zipfile 寫出的位元組；不可 seek，zipfile 會改用 data descriptor 串流寫出"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="請款明細" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def _xlsx_row(number: int, values: Iterable[Any]) -> str:
+    cells = []
+    for value in values:
+        numeric = _number(value)
+        if numeric is not None:
+            cells.append(f"<c><v>{numeric}</v></c>")
+        else:
+            text = _XML_ILLEGAL.sub("", _text(value))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+def iter_xlsx(rows: Iterable[List[Any]]) -> Iterator[bytes]:
+    """以串流方式逐批產生 XLSX 活頁簿（單一工作表，第一列為標題）"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+
+        # 工作表可能超過 4GB，預先啟用 ZIP64
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, EXPORT_COLUMNS).encode("utf-8"))
+            batch: List[str] = []
+            for number, row in enumerate(rows, start=2):
+                batch.append(_xlsx_row(number, row))
+                if len(batch) >= _BATCH_ROWS:
+                    sheet.write("".join(batch).encode("utf-8"))
+                    batch.clear()
+                    data = sink.drain()
+                    if data:
+                        yield data
+            if batch:
+                sheet.write("".join(batch).encode("utf-8"))
+            sheet.write(b"</sheetData></worksheet>")
+        yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,308 @@
+"""請款單的記憶體內紀錄.
+
+所有請款單都保存在行程記憶體中。以 dict 加上 Pydantic 明細模型保存時，每張
+請款單都帶著欄位名稱的雜湊表、每筆明細的模型實例（含 __dict__ 與
+fields_set）、Decimal 與 datetime 物件，以及與解碼後圖片重複的 base64 字串，
+額外負擔遠大於實際資料。FormRecord 改為：
+
+- 表頭欄位放在 __slots__，付款方式與請款單位存成小整數代碼，時間存成整數微秒
+- 明細以欄為單位保存：專案與費用類型為一個位元組的代碼，金額為整數係數與
+  十進位指數的 array，文字欄位攤平在同一個 tuple 中
+- 存摺影本不保留 base64 字串，只參照依內容雜湊共用的 BankBookImage
+
+FormRecord 實作唯讀的 Mapping 介面，渲染、統計、檢索與匯出沿用原本以
+record.get(...) 讀取的程式；Pydantic 回應模型只在 API 回應時以 to_response
+建立。紀錄建立後不再修改，更新請款單時以新的 FormRecord 取代。
+"""
+
+import base64
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from ..models.schemas import (
+    ExpenseType,
+    PaymentDetailItem,
+    PaymentMethod,
+    ProjectType,
+    RequestFormCreate,
+    RequestFormResponse,
+    RequestingUnit,
+)
+from .bank_book import BankBookImage, share_bank_book
+
+# 列舉值 ↔ 代碼（依宣告順序；只存在記憶體中，調整順序不影響相容性）
+_PAYMENT_METHODS = tuple(PaymentMethod)
+_REQUESTING_UNITS = tuple(RequestingUnit)
+_PROJECT_TYPES = tuple(ProjectType)
+_EXPENSE_TYPES = tuple(ExpenseType)
+_CODES = {
+    enum: {member: code for code, member in enumerate(enum)}
+    for enum in (PaymentMethod, RequestingUnit, ProjectType, ExpenseType)
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# 對外的欄位（與先前以 dict 保存時的鍵相同）
+FIELDS = (
+    "id",
+    "application_date",
+    "payee",
+    "payment_method",
+    "payment_method_other",
+    "requesting_unit",
+    "requesting_unit_other",
+    "total_amount",
+    "payment_details",
+    "bank_book_image",
+    "bank_book",
+    "created_at",
+    "updated_at",
+    "version",
+    "pdf_url",
+)
+_FIELD_SET = frozenset(FIELDS)
+
+# 明細文字欄位在攤平 tuple 中的順序
+_TEXT_FIELDS = ("execution_time", "execution_content", "receipt_note")
+
+
+def _code(enum, value: Any) -> int:
+    return _CODES[enum][enum(value)]
+
+
+def _to_micros(value: Optional[datetime]) -> Optional[int]:
+    return None if value is None else (value - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(value: Optional[int]) -> Optional[datetime]:
+    return None if value is None else _EPOCH + timedelta(microseconds=value)
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name)
+
+
+def _pack_amounts(amounts: Iterable[Decimal]) -> Tuple[Union[array, Tuple[Decimal, ...]], Optional[array]]:
+    """金額拆成整數係數與十進位指數，保留原本的位數（100.50 不會變成 100.5）
+
+    係數超過 64 位元、指數超出範圍或不是有限數（NaN、Infinity）時改為保留 Decimal，
+    指數回傳 None。
+    """
+    amounts = tuple(amounts)
+    units, exponents = array("q"), array("b")
+    try:
+        for amount in amounts:
+            sign, digits, exponent = amount.as_tuple()
+            value = int("".join(map(str, digits)))
+            units.append(-value if sign else value)
+            exponents.append(exponent)
+    except (OverflowError, TypeError, ValueError):
+        # NaN 沒有係數位數（ValueError），Infinity 的指數不是整數（TypeError）
+        return amounts, None
+    return units, exponents
+
+
+class DetailRow:
+    """欄式明細中的一列，以屬性讀取（與 PaymentDetailItem 相同的欄位名稱）"""
+
+    __slots__ = ("_rows", "_index")
+
+    def __init__(self, rows: "DetailRows", index: int):
+        self._rows = rows
+        self._index = index
+
+    def __repr__(self) -> str:
+        return f"DetailRow({self.to_model()!r})"
+
+    @property
+    def project_type(self) -> ProjectType:
+        return _PROJECT_TYPES[self._rows._project_types[self._index]]
+
+    @property
+    def expense_type(self) -> ExpenseType:
+        return _EXPENSE_TYPES[self._rows._expense_types[self._index]]
+
+    @property
+    def execution_time(self) -> Optional[str]:
+        return self._rows._texts[3 * self._index]
+
+    @property
+    def execution_content(self) -> str:
+        return self._rows._texts[3 * self._index + 1]
+
+    @property
+    def receipt_note(self) -> Optional[str]:
+        return self._rows._texts[3 * self._index + 2]
+
+    @property
+    def amount(self) -> Decimal:
+        return self._rows.amount(self._index)
+
+    def to_model(self) -> PaymentDetailItem:
+        """建立回應用的模型（資料建立紀錄時已驗證過，不再重新驗證）"""
+        return PaymentDetailItem.model_construct(
+            project_type=self.project_type,
+            expense_type=self.expense_type,
+            execution_time=self.execution_time,
+            execution_content=self.execution_content,
+            amount=self.amount,
+            receipt_note=self.receipt_note,
+        )
+
+
+class DetailRows(Sequence):
+    """以欄為單位保存的請款明細"""
+
+    __slots__ = ("_project_types", "_expense_types", "_texts", "_units", "_exponents")
+
+    def __init__(self, items: Iterable[Any]):
+        items = list(items)
+        self._project_types = bytes(_code(ProjectType, _field(item, "project_type")) for item in items)
+        self._expense_types = bytes(_code(ExpenseType, _field(item, "expense_type")) for item in items)
+        self._texts = tuple(_field(item, name) for item in items for name in _TEXT_FIELDS)
+        self._units, self._exponents = _pack_amounts(Decimal(_field(item, "amount")) for item in items)
+
+    def __len__(self) -> int:
+        return len(self._project_types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [DetailRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("請款明細索引超出範圍")
+        return DetailRow(self, index)
+
+    def __iter__(self) -> Iterator[DetailRow]:
+        return (DetailRow(self, index) for index in range(len(self)))
+
+    def amount(self, index: int) -> Decimal:
+        if self._exponents is None:
+            return self._units[index]
+        return Decimal(self._units[index]).scaleb(self._exponents[index])
+
+    def amounts(self) -> Iterator[Decimal]:
+        return (self.amount(index) for index in range(len(self)))
+
+
+class FormRecord(Mapping):
+    """一張請款單（唯讀）"""
+
+    __slots__ = (
+        "id",
+        "application_date",
+        "payee",
+        "_payment_method",
+        "payment_method_other",
+        "_requesting_unit",
+        "requesting_unit_other",
+        "payment_details",
+        "bank_book",
+        "_created_at",
+        "_updated_at",
+        "version",
+    )
+
+    def __init__(
+        self,
+        request_id: str,
+        form: Any,
+        *,
+        bank_book: Optional[BankBookImage],
+        created_at: datetime,
+        updated_at: Optional[datetime] = None,
+        version: int = 1,
+    ):
+        """以已驗證的表單（RequestFormCreate 或相同欄位的 dict）建立紀錄"""
+        self.id = request_id
+        self.application_date = _field(form, "application_date")
+        self.payee = _field(form, "payee")
+        self._payment_method = _code(PaymentMethod, _field(form, "payment_method"))
+        self.payment_method_other = _field(form, "payment_method_other")
+        self._requesting_unit = _code(RequestingUnit, _field(form, "requesting_unit"))
+        self.requesting_unit_other = _field(form, "requesting_unit_other")
+        self.payment_details = DetailRows(_field(form, "payment_details"))
+        self.bank_book = share_bank_book(bank_book) if bank_book is not None else None
+        self._created_at = _to_micros(created_at)
+        self._updated_at = _to_micros(updated_at)
+        self.version = version
+
+    def __repr__(self) -> str:
+        return f"FormRecord({self.id!r}, version={self.version}, details={len(self.payment_details)})"
+
+    @property
+    def payment_method(self) -> PaymentMethod:
+        return _PAYMENT_METHODS[self._payment_method]
+
+    @property
+    def requesting_unit(self) -> RequestingUnit:
+        return _REQUESTING_UNITS[self._requesting_unit]
+
+    @property
+    def total_amount(self) -> Decimal:
+        return sum(self.payment_details.amounts(), Decimal(0))
+
+    @property
+    def created_at(self) -> datetime:
+        return _from_micros(self._created_at)
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return _from_micros(self._updated_at)
+
+    @property
+    def pdf_url(self) -> str:
+        return f"/api/v1/request-forms/{self.id}/pdf"
+
+    @property
+    def bank_book_image(self) -> Optional[str]:
+        """存摺影本的 base64 字串，每次讀取時重新編碼（只有更新請款單時需要）"""
+        if self.bank_book is None:
+            return None
+        return base64.b64encode(self.bank_book.data).decode("ascii")
+
+    # Mapping 介面
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in _FIELD_SET:
+            return default
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FIELDS)
+
+    def __len__(self) -> int:
+        return len(FIELDS)
+
+    def form_fields(self) -> Dict[str, Any]:
+        """建立請款單時的欄位，供更新請款單時與修改的欄位合併後重新驗證"""
+        fields = {name: self[name] for name in RequestFormCreate.model_fields}
+        fields["payment_details"] = [row.to_model() for row in self.payment_details]
+        return fields
+
+    def to_response(self) -> RequestFormResponse:
+        """建立 API 回應模型"""
+        return RequestFormResponse(
+            id=self.id,
+            application_date=self.application_date,
+            payee=self.payee,
+            payment_method=self.payment_method,
+            payment_method_other=self.payment_method_other,
+            requesting_unit=self.requesting_unit,
+            requesting_unit_other=self.requesting_unit_other,
+            total_amount=self.total_amount,
+            payment_details=[row.to_model() for row in self.payment_details],
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+            version=self.version,
+            pdf_url=self.pdf_url,
+        )
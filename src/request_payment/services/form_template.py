@@ -0,0 +1,200 @@
+"""請款單表單範本.
+
+表單的固定內容（標題、欄位名稱、明細表格的欄位與欄寬、代碼對照、說明文字、
+簽名欄）定義在 form_templates/*.json，第一次使用時編譯成 RenderPlan 並快取，
+渲染時只處理隨資料變動的部分。新增單位專用的表單只需要新增一個 JSON 檔，
+例如：
+
+    {"name": "info_media", "extends": "default", "units": ["資訊媒體執委會"], "title": "資訊媒體請款單"}
+
+extends 指定的範本先合併（dict 逐層覆寫，其餘值整個取代），units 列出使用
+此範本的請款單位；沒有對應範本的單位使用 default。FORM_TEMPLATE_DIR 指定的
+目錄中的範本可新增或覆寫內建範本。
+"""
+
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from loguru import logger
+from reportlab.lib.units import cm
+
+from ..core.config import get_settings
+from ..utils.validators import format_currency
+
+DEFAULT_TEMPLATE = "default"
+BUILTIN_TEMPLATE_DIR = Path(__file__).parent / "form_templates"
+
+# 明細欄位的種類：code 依代碼對照簡化、wrap 依欄寬換行、currency 金額、text 原值、blank 留空
+COLUMN_KINDS = ("code", "wrap", "currency", "text", "blank")
+SIGNATURE_ROLES = 5  # 簽名區域固定 5 欄：前 3 欄屬於第一個群組，後 2 欄屬於第二個群組
+
+
+def enum_value(value: Any) -> str:
+    """取得枚舉值或字串的顯示文字"""
+    if hasattr(value, "value"):
+        return str(value.value)
+    if isinstance(value, str):
+        return value
+    return str(value) if value else ""
+
+
+@dataclass(frozen=True)
+class DetailColumn:
+    """請款明細表格的一欄"""
+    header: str
+    width: float  # pt
+    field: Optional[str]
+    kind: str
+    formatter: Optional[Callable[[Any], str]]  # wrap 欄位需要字體換行，由 PDFService 處理，其餘欄位預先編譯
+
+
+@dataclass(frozen=True)
+class RenderPlan:
+    """編譯後的表單範本"""
+    name: str
+    units: Tuple[str, ...]
+    title: str
+    form_number_labels: Tuple[str, str]
+    labels: Mapping[str, str]
+    detail_heading: str
+    detail_notes: Tuple[str, ...]
+    columns: Tuple[DetailColumn, ...]
+    receipt: Mapping[str, str]
+    bank_book: Mapping[str, str]
+    signature_groups: Tuple[str, str]
+    signature_roles: Tuple[str, ...]
+
+    @property
+    def detail_headers(self) -> List[str]:
+        return [column.header for column in self.columns]
+
+    @property
+    def detail_col_widths(self) -> List[float]:
+        return [column.width for column in self.columns]
+
+    @property
+    def detail_width(self) -> float:
+        return sum(column.width for column in self.columns)
+
+
+def get_render_plan(requesting_unit: Optional[str] = None) -> RenderPlan:
+    """取得請款單位使用的表單範本，沒有專用範本時使用 default"""
+    plans, by_unit = _load_plans()
+    return by_unit.get(requesting_unit or "", plans[DEFAULT_TEMPLATE])
+
+
+@lru_cache()
+def _load_plans() -> Tuple[Dict[str, RenderPlan], Dict[str, RenderPlan]]:
+    """讀取並編譯所有範本，回傳 (名稱 → 範本, 請款單位 → 範本)"""
+    sources: Dict[str, dict] = {}
+    directories = [BUILTIN_TEMPLATE_DIR]
+    if get_settings().form_template_dir:
+        directories.append(Path(get_settings().form_template_dir))
+
+    for directory in directories:
+        if not directory.is_dir():
+            logger.warning("找不到表單範本目錄", directory=str(directory))
+            continue
+        for path in sorted(directory.glob("*.json")):
+            with open(path, encoding="utf-8") as f:
+                source = json.load(f)
+            source.setdefault("name", path.stem)
+            sources[source["name"]] = source
+
+    if DEFAULT_TEMPLATE not in sources:
+        raise ValueError(f"缺少 {DEFAULT_TEMPLATE} 表單範本")
+
+    plans = {name: _compile(name, _resolve(name, sources, ())) for name in sources}
+    by_unit: Dict[str, RenderPlan] = {}
+    for plan in plans.values():
+        for unit in plan.units:
+            if unit in by_unit:
+                raise ValueError(f"請款單位 {unit} 同時對應到範本 {by_unit[unit].name} 與 {plan.name}")
+            by_unit[unit] = plan
+
+    logger.info("表單範本已編譯", templates=list(plans), units=list(by_unit))
+    return plans, by_unit
+
+
+def _resolve(name: str, sources: Dict[str, dict], chain: Tuple[str, ...]) -> dict:
+    """合併 extends 鏈上的範本"""
+    if name in chain:
+        raise ValueError(f"表單範本循環繼承: {' → '.join(chain + (name,))}")
+    if name not in sources:
+        raise ValueError(f"找不到表單範本: {name}")
+
+    source = dict(sources[name])
+    parent = source.pop("extends", None)
+    if parent is None:
+        return source
+    # units 只屬於宣告它的範本，不繼承
+    base = {key: value for key, value in _resolve(parent, sources, chain + (name,)).items() if key != "units"}
+    return _merge(base, source)
+
+
+def _merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _compile(name: str, source: dict) -> RenderPlan:
+    """把範本編譯成渲染計畫，格式錯誤時拋出 ValueError"""
+    try:
+        codes = source.get("codes", {})
+        columns = tuple(_compile_column(column, codes) for column in source["detail"]["columns"])
+        groups = tuple(source["signature"]["groups"])
+        roles = tuple(source["signature"]["roles"])
+        if len(groups) != 2 or len(roles) != SIGNATURE_ROLES:
+            raise ValueError(f"簽名區域需要 2 個群組與 {SIGNATURE_ROLES} 個職稱")
+        return RenderPlan(
+            name=name,
+            units=tuple(source.get("units", ())),
+            title=source["title"],
+            form_number_labels=tuple(source["form_number_labels"]),
+            labels=MappingProxyType(dict(source["labels"])),
+            detail_heading=source["detail"]["heading"],
+            detail_notes=tuple(source["detail"].get("notes", ())),
+            columns=columns,
+            receipt=MappingProxyType(dict(source["receipt"])),
+            bank_book=MappingProxyType(dict(source["bank_book"])),
+            signature_groups=groups,
+            signature_roles=roles,
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"表單範本 {name} 格式錯誤: {e!r}") from e
+
+
+def _compile_column(column: dict, codes: Dict[str, Dict[str, str]]) -> DetailColumn:
+    kind = column.get("kind", "text")
+    if kind not in COLUMN_KINDS:
+        raise ValueError(f"未知的欄位種類: {kind}")
+    field = column.get("field")
+    if field is None and kind != "blank":
+        raise ValueError(f"欄位 {column['header']} 缺少 field")
+
+    if kind == "code":
+        mapping = dict(codes.get(column.get("codes", field), {}))
+
+        def format_code(value: Any) -> str:
+            text = enum_value(value)
+            return mapping.get(text, text)
+
+        formatter = format_code
+    elif kind == "currency":
+        formatter = lambda value: f"NT$ {format_currency(float(value))}"
+    elif kind == "text":
+        formatter = enum_value
+    elif kind == "blank":
+        formatter = lambda value: ""
+    else:
+        formatter = None
+    return DetailColumn(column["header"], column["width_cm"] * cm, field, kind, formatter)
@@ -0,0 +1,63 @@
+"""PDF 單頁快取.
+
+多頁請款單可以逐頁渲染成單頁 PDF，再以 qpdf 拼接成完整文件。每一頁的 PDF
+依該頁的所有輸入（表格資料列、基本資訊與總計、受款人、存摺影本雜湊、頁碼、
+輸出設定檔等）建立快取鍵；編輯請款單後重新下載時，輸入沒有變動的頁面直接
+重用已渲染的位元組，只有受影響的頁面需要重新排版與繪製。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from ..core.metrics import record_cache_lookup
+
+
+def page_key(*parts: Any) -> str:
+    """由頁面的輸入組成快取鍵（輸入須有穩定的 repr）"""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class PageCache:
+    """渲染完成的單頁 PDF，依總位元組數以 LRU 淘汰（執行緒安全）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        record_cache_lookup("pdf_page", data is not None)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """存入單頁 PDF；超過容量四分之一的頁面（例如高解析度存摺影本）不保留"""
+        if len(data) > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,29 @@
+"""請款單 PDF 版面常數.
+
+Platypus 與直接繪製（canvas）兩種渲染方式共用同一組版面設定，確保輸出一致。
+"""
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+
+# 頁面版面（SimpleDocTemplate 的邊距與 Frame 預設的內距）
+PAGE_LEFT_MARGIN = 1.5*cm
+PAGE_RIGHT_MARGIN = 1.5*cm
+PAGE_TOP_MARGIN = 2*cm
+PAGE_BOTTOM_MARGIN = 6*cm
+FRAME_PADDING = 6
+CONTINUATION_TOP_SPACE = 4*cm
+
+# Frame 內可用的寬度與高度，以及內容起始的 x、y 座標
+FRAME_X = PAGE_LEFT_MARGIN + FRAME_PADDING
+FRAME_TOP = A4[1] - PAGE_TOP_MARGIN - FRAME_PADDING
+FRAME_WIDTH = A4[0] - PAGE_LEFT_MARGIN - PAGE_RIGHT_MARGIN - 2 * FRAME_PADDING
+FRAME_HEIGHT = A4[1] - PAGE_TOP_MARGIN - PAGE_BOTTOM_MARGIN - 2 * FRAME_PADDING
+
+# 請款明細表格（欄位名稱與欄寬定義在表單範本）
+DETAIL_HEADER_HEIGHT = 1.2*cm
+DETAIL_FONT_SIZE = 11
+DETAIL_CELL_PADDING = 10
+
+# 與 platypus 判斷是否放得下時使用的容許誤差一致
+LAYOUT_EPSILON = 1e-6
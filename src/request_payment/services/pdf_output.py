@@ -0,0 +1,305 @@
+"""PDF 輸出設定檔.
+
+同一份請款單依用途需要不同的輸出：歸檔要保留原始影像品質，行動裝置在
+弱網路下要最小的檔案。輸出設定檔以名稱選擇（Settings 的預設值或下載時
+指定），控制：
+
+- 資料流壓縮等級：ReportLab 產生 PDF 後以指定等級重新壓縮所有 Flate 資料流
+- 存摺影本的 JPEG 品質與解析度：依版面上的實際尺寸降採樣後重新編碼
+- 線性化（fast web view）：透過 qpdf 產生，讓瀏覽器下載完第一頁即可顯示
+
+qpdf 也用於把逐頁渲染的單頁 PDF 拼接成完整文件（見 merge_pages）。
+"""
+
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from PIL import Image as PILImage
+from reportlab.pdfbase.pdfutils import asciiBase85Decode
+
+from ..core.config import get_settings
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """PDF 輸出設定檔"""
+    name: str
+    description: str
+    compression_level: Optional[int] = None  # zlib 壓縮等級 0-9，None 表示保留 ReportLab 原本的輸出
+    image_jpeg_quality: Optional[int] = None  # 影像重新編碼為 JPEG 的品質，None 表示保留原始編碼
+    image_dpi: Optional[int] = None  # 影像依版面尺寸降採樣的解析度，None 表示不降採樣
+    linearize: bool = False  # 產生線性化（fast web view）PDF
+
+    @property
+    def rewrites_images(self) -> bool:
+        return self.image_jpeg_quality is not None or self.image_dpi is not None
+
+    @property
+    def rewrites_output(self) -> bool:
+        return self.compression_level is not None or self.linearize
+
+
+OUTPUT_PROFILES: Dict[str, OutputProfile] = {
+    profile.name: profile
+    for profile in (
+        OutputProfile("standard", "ReportLab 預設壓縮、保留原始影像"),
+        OutputProfile("archival", "無損影像、最高壓縮等級，適合歸檔", compression_level=9),
+        OutputProfile("web", "影像 150 DPI / JPEG 85、線性化，適合線上瀏覽", 6, 85, 150, True),
+        OutputProfile("mobile", "影像 96 DPI / JPEG 60、線性化，檔案最小", 9, 60, 96, True),
+    )
+}
+
+_STREAM_MARKER = b"\nstream\n"
+_LENGTH_PATTERN = re.compile(rb"/Length (\d+)")
+_FILTER_PATTERN = re.compile(rb"/Filter \[([^\]]*)\]")
+_XREF_ENTRY_PATTERN = re.compile(rb"(\d{10}) (\d{5}) ([nf]) ?\r?\n")
+_STARTXREF_PATTERN = re.compile(rb"startxref\s+(\d+)\s+%%EOF\s*$")
+
+
+def get_output_profile(name: Optional[str] = None) -> OutputProfile:
+    """依名稱取得輸出設定檔
+
+    Args:
+        name: 設定檔名稱，未指定時使用 PDF_OUTPUT_PROFILE 設定
+
+    Raises:
+        ValueError: 沒有這個名稱的設定檔
+    """
+    name = name or get_settings().pdf_output_profile
+    profile = OUTPUT_PROFILES.get(name.lower())
+    if profile is None:
+        raise ValueError(f"未知的 PDF 輸出設定檔: {name}（可用: {', '.join(OUTPUT_PROFILES)}）")
+    return profile
+
+
+def prepare_image(image_data: bytes, width: float, height: float, profile: OutputProfile) -> bytes:
+    """依輸出設定檔縮小並重新編碼要嵌入的圖片
+
+    Args:
+        image_data: 原始圖片位元組
+        width: 圖片在頁面上的寬度（pt）
+        height: 圖片在頁面上的高度（pt）
+        profile: 輸出設定檔
+
+    Returns:
+        bytes: 處理後的圖片；結果沒有比原圖小時回傳原圖
+    """
+    if not profile.rewrites_images:
+        return image_data
+
+    with PILImage.open(io.BytesIO(image_data)) as image:
+        image.load()
+        processed = image
+        if profile.image_dpi is not None:
+            # 1pt = 1/72 英吋，只縮小不放大
+            target_size = (round(width / 72 * profile.image_dpi), round(height / 72 * profile.image_dpi))
+            if target_size[0] < image.width and target_size[1] < image.height:
+                processed = image.resize(target_size, PILImage.LANCZOS)
+
+        buffer = io.BytesIO()
+        if profile.image_jpeg_quality is not None:
+            _flatten(processed).save(buffer, format="JPEG", quality=profile.image_jpeg_quality, optimize=True)
+        elif processed is not image:
+            processed.save(buffer, format="PNG", optimize=True)
+        else:
+            return image_data
+
+    output = buffer.getvalue()
+    return output if len(output) < len(image_data) else image_data
+
+
+def _flatten(image: PILImage.Image) -> PILImage.Image:
+    """JPEG 不支援透明度，透明區域以白色背景合成"""
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        background = PILImage.new("RGB", rgba.size, "white")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def finalize_pdf(pdf_data: bytes, profile: OutputProfile) -> bytes:
+    """依輸出設定檔重新壓縮資料流並線性化"""
+    if profile.compression_level is not None:
+        pdf_data = recompress_streams(pdf_data, profile.compression_level)
+    if profile.linearize:
+        pdf_data = linearize(pdf_data)
+    return pdf_data
+
+
+def recompress_streams(pdf_data: bytes, level: int) -> bytes:
+    """以指定的 zlib 等級重新壓縮 ReportLab 產生的 PDF 中所有資料流
+
+    依 xref 表逐一改寫物件並重建 xref。Flate 資料流以新的等級重新壓縮
+    （等級 0 表示不壓縮），ASCII85 編碼一律移除；使用其他篩選器的資料流
+    （例如 JPEG 的 DCTDecode）保留原始內容。
+    """
+    xref_offset = int(_STARTXREF_PATTERN.search(pdf_data).group(1))
+    entries = _read_xref(pdf_data, xref_offset)
+    objects = sorted((offset, number) for number, (offset, in_use) in enumerate(entries) if in_use)
+
+    output = bytearray(pdf_data[:objects[0][0]] if objects else pdf_data[:xref_offset])
+    new_offsets: Dict[int, int] = {}
+    for index, (offset, number) in enumerate(objects):
+        end = objects[index + 1][0] if index + 1 < len(objects) else xref_offset
+        new_offsets[number] = len(output)
+        output += _recompress_object(pdf_data[offset:end], level)
+
+    new_xref_offset = len(output)
+    output += _write_xref(entries, new_offsets)
+    trailer_start = pdf_data.index(b"trailer", xref_offset)
+    trailer = pdf_data[trailer_start:]
+    output += _STARTXREF_PATTERN.sub(b"startxref\n%d\n%%%%EOF\n" % new_xref_offset, trailer)
+    return bytes(output)
+
+
+def _read_xref(pdf_data: bytes, xref_offset: int) -> List[Tuple[int, bool]]:
+    """讀取 xref 表，回傳每個物件編號的 (位移, 是否使用中)"""
+    header_end = pdf_data.index(b"\n", pdf_data.index(b"\n", xref_offset) + 1) + 1
+    first, count = (int(value) for value in pdf_data[pdf_data.index(b"\n", xref_offset) + 1:header_end].split())
+    if first != 0:
+        raise ValueError("不支援的 xref 表格式")
+
+    entries = []
+    position = header_end
+    for _ in range(count):
+        match = _XREF_ENTRY_PATTERN.match(pdf_data, position)
+        if match is None:
+            raise ValueError("xref 表格式錯誤")
+        entries.append((int(match.group(1)), match.group(3) == b"n"))
+        position = match.end()
+    return entries
+
+
+def _write_xref(entries: List[Tuple[int, bool]], new_offsets: Dict[int, int]) -> bytes:
+    lines = [b"xref\n0 %d\n" % len(entries)]
+    for number, (offset, in_use) in enumerate(entries):
+        if in_use:
+            lines.append(b"%010d 00000 n \n" % new_offsets[number])
+        else:
+            lines.append(b"%010d 65535 f \n" % offset)
+    return b"".join(lines)
+
+
+def _recompress_object(obj: bytes, level: int) -> bytes:
+    marker = obj.find(_STREAM_MARKER)
+    if marker < 0:
+        return obj
+
+    dictionary = obj[:marker]
+    length_match = _LENGTH_PATTERN.search(dictionary)
+    filter_match = _FILTER_PATTERN.search(dictionary)
+    if length_match is None or filter_match is None:
+        return obj
+
+    content_start = marker + len(_STREAM_MARKER)
+    content_end = content_start + int(length_match.group(1))
+    filters = [name.decode() for name in re.findall(rb"/(\w+)", filter_match.group(1))]
+    content = obj[content_start:content_end]
+
+    if filters[:1] == ["ASCII85Decode"]:
+        content = asciiBase85Decode(content)
+        filters = filters[1:]
+    if filters == ["FlateDecode"]:
+        raw = zlib.decompress(content)
+        if level > 0:
+            content = zlib.compress(raw, level)
+        else:
+            content, filters = raw, []
+    elif not filters or len(filters) > 1 or filters[0] not in ("DCTDecode",):
+        return obj
+
+    if filters:
+        dictionary = _FILTER_PATTERN.sub(b"/Filter [ /%s ]" % filters[0].encode(), dictionary)
+    else:
+        dictionary = _FILTER_PATTERN.sub(b"", dictionary)
+    dictionary = _LENGTH_PATTERN.sub(b"/Length %d" % len(content), dictionary)
+    return dictionary + _STREAM_MARKER + content + obj[content_end:]
+
+
+def linearize(pdf_data: bytes) -> bytes:
+    """以 qpdf 產生線性化 PDF；找不到 qpdf 時回傳原檔"""
+    qpdf = _find_qpdf()
+    if qpdf is None:
+        return pdf_data
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source.pdf")
+        target = os.path.join(workdir, "linearized.pdf")
+        with open(source, "wb") as f:
+            f.write(pdf_data)
+        # qpdf 的結束碼 3 表示成功但有警告；--deterministic-id 讓相同輸入得到相同的輸出
+        result = subprocess.run(
+            [qpdf, "--linearize", "--deterministic-id", source, target], capture_output=True, timeout=60
+        )
+        if result.returncode not in (0, 3):
+            logger.warning("PDF 線性化失敗", returncode=result.returncode, error=result.stderr.decode(errors="replace")[:200])
+            return pdf_data
+        with open(target, "rb") as f:
+            return f.read()
+
+
+def qpdf_available() -> bool:
+    """是否可使用 qpdf（線性化與逐頁拼接）"""
+    return _find_qpdf() is not None
+
+
+def merge_pages(shell: bytes, pages: List[bytes], linearize: bool = False) -> Optional[bytes]:
+    """以 qpdf 把單頁 PDF 依序拼接成一份文件
+
+    輸出以 shell 為主文件，保留其文件資訊（標題、作者、日期等），頁面則全部
+    取自 pages；--deterministic-id 讓相同的輸入得到相同的位元組。qpdf 預設不會
+    重新壓縮已是 Flate 的資料流，各頁已套用的壓縮等級原樣保留。
+
+    Args:
+        shell: 提供文件資訊的 PDF，其頁面不會出現在輸出中
+        pages: 依順序排列的單頁 PDF
+        linearize: 同時產生線性化（fast web view）PDF
+
+    Returns:
+        Optional[bytes]: 拼接後的 PDF；找不到 qpdf 或拼接失敗時回傳 None
+    """
+    qpdf = _find_qpdf()
+    if qpdf is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        shell_path = os.path.join(workdir, "shell.pdf")
+        target = os.path.join(workdir, "merged.pdf")
+        with open(shell_path, "wb") as f:
+            f.write(shell)
+        command = [qpdf, "--deterministic-id"]
+        if linearize:
+            command.append("--linearize")
+        command += [shell_path, "--pages"]
+        for number, page in enumerate(pages, start=1):
+            path = os.path.join(workdir, f"page-{number}.pdf")
+            with open(path, "wb") as f:
+                f.write(page)
+            command += [path, "1"]
+        command += ["--", target]
+        result = subprocess.run(command, capture_output=True, timeout=60)
+        if result.returncode not in (0, 3):
+            logger.warning("PDF 頁面拼接失敗", returncode=result.returncode, error=result.stderr.decode(errors="replace")[:200])
+            return None
+        with open(target, "rb") as f:
+            return f.read()
+
+
+@lru_cache()
+def _find_qpdf() -> Optional[str]:
+    qpdf = shutil.which("qpdf")
+    if qpdf is None:
+        logger.warning("找不到 qpdf，輸出設定檔的線性化與逐頁拼接將被略過")
+    return qpdf
@@ -1,27 +1,146 @@
 """PDF 生成服務."""
 
+import asyncio
+import hashlib
 import io
-import base64
 import os
 import platform
-from typing import Dict, Any, Optional
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, partial
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
 from decimal import Decimal
 from PIL import Image as PILImage
 
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm, mm
 from reportlab.platypus import (
     SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, 
-    PageBreak, Image as ReportLabImage, Frame, PageTemplate
+    PageBreak, Image as ReportLabImage, Frame, PageTemplate, Flowable
 )
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFDictionary, PDFName, PDFStream, PDFZCompress
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 
-from ..models.schemas import PaymentMethod
+from loguru import logger
+
+from ..core.config import get_settings
+from ..core.metrics import (
+    PDF_OUTPUT_BYTES,
+    PDF_PAGES,
+    PDF_PHASE_SECONDS,
+    PDF_RENDERS,
+    PDF_RENDERS_IN_PROGRESS,
+    PDF_RENDERS_QUEUED,
+    record_cache_lookup,
+)
+from ..core.profiling import run_in_threadpool
+from ..core.tracing import current_span, start_span
+from ..models.schemas import PaymentMethod, ProjectType, ExpenseType, RequestingUnit
 from ..utils.validators import format_currency
+from .bank_book import BankBookImage, decode_bank_book_image
+from .canvas_renderer import CanvasRenderer
+from .font_loader import load_ttf_font
+from .form_template import RenderPlan, enum_value, get_render_plan
+from .page_cache import PageCache, page_key
+from .pdf_output import OutputProfile, finalize_pdf, get_output_profile, merge_pages, qpdf_available, recompress_streams
+from .pdf_layout import (
+    CONTINUATION_TOP_SPACE,
+    DETAIL_CELL_PADDING,
+    DETAIL_FONT_SIZE,
+    DETAIL_HEADER_HEIGHT,
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    LAYOUT_EPSILON,
+    PAGE_BOTTOM_MARGIN,
+    PAGE_LEFT_MARGIN,
+    PAGE_RIGHT_MARGIN,
+    PAGE_TOP_MARGIN,
+)
+from .text_layout import get_text_layout
+
+# PDF 只透過 HTTP 以二進位傳輸，不需要 7-bit 安全的 ASCII85 編碼：
+# 資料流小約 20%，也省下每份文件重新編碼標誌與存摺影本的時間
+rl_config.useA85 = 0
+
+# 尚未載入的快取值標記
+_NOT_LOADED = object()
+
+
+class _ImageBytesFlowable(Flowable):
+    """由記憶體中的圖片位元組繪製的圖片
+
+    每次繪製都建立新的 ImageReader，不共用檔案指標，同時渲染的文件不會互相干擾。
+    """
+    
+    def __init__(self, image_data: bytes, width: float, height: float):
+        super().__init__()
+        self.image_data = image_data
+        self.width = width
+        self.height = height
+        self.hAlign = 'CENTER'
+    
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+    
+    def draw(self):
+        self.canv.drawImage(ImageReader(io.BytesIO(self.image_data)), 0, 0, self.width, self.height)
+
+
+class _LazyStory(list):
+    """逐頁向產生器取得內容的 story
+
+    doc.build 以 list 的方式操作 story（len、flowables[0]、del flowables[0]、
+    把分割後的剩餘部分插回開頭），這裡在目前的內容用完時才向產生器取下一頁。
+    已繪製的 flowable 隨即可被回收，整份 story 不必同時存在於記憶體中。
+    """
+
+    def __init__(self, pages: Iterator[list]):
+        super().__init__()
+        self._pages: Optional[Iterator[list]] = pages
+
+    def _refill(self) -> None:
+        while self._pages is not None and not super().__len__():
+            page = next(self._pages, None)
+            if page is None:
+                self._pages = None
+            else:
+                self.extend(page)
+
+    def __len__(self) -> int:
+        self._refill()
+        return super().__len__()
+
+    def __getitem__(self, index):
+        self._refill()
+        return super().__getitem__(index)
+
+
+class _CompactCanvas(Canvas):
+    """每頁結束時立即壓縮頁面內容的 canvas
+
+    ReportLab 把每頁未壓縮的內容保留到 save() 才一起壓縮，數百頁的請款單
+    佔用的記憶體與頁數成正比。這裡在換頁時就以相同的 Flate 編碼壓縮並標記
+    Filter，save() 時原樣寫出，輸出的位元組不變。
+    """
+
+    def showPage(self):
+        super().showPage()
+        page = self._doc.Pages.pages[-1]
+        if page.compression and page.stream and not rl_config.useA85:
+            contents = PDFStream(
+                PDFDictionary({"Filter": PDFArray([PDFName(PDFZCompress.pdfname)])}),
+                PDFZCompress.encode(page.stream),
+            )
+            contents.__Comment__ = "page stream"
+            page.Contents = contents
+            page.stream = None
 
 
 class PDFService:
@@ -29,6 +148,11 @@ class PDFService:
     
     def __init__(self):
         self.chinese_font = self.setup_fonts()
+        self._mark_image = _NOT_LOADED
+        self._table_capacities: Dict[str, Tuple[float, float]] = {}
+        self._canvas_renderer = CanvasRenderer(self)
+        page_cache_bytes = get_settings().pdf_page_cache_bytes
+        self.page_cache: Optional[PageCache] = PageCache(page_cache_bytes) if page_cache_bytes > 0 else None
         
     def setup_fonts(self):
         """設定中文字體"""
@@ -43,12 +167,12 @@ class PDFService:
             for custom_font_path in custom_font_paths:
                 if os.path.exists(custom_font_path):
                     try:
-                        pdfmetrics.registerFont(TTFont(font_name, custom_font_path))
+                        pdfmetrics.registerFont(load_ttf_font(font_name, custom_font_path))
                         font_registered = True
-                        print(f"成功註冊標楷體字體: {custom_font_path}")
+                        logger.info("成功註冊標楷體字體", font_path=custom_font_path)
                         break
                     except Exception as e:
-                        print(f"標楷體字體註冊失敗: {e}")
+                        logger.warning("標楷體字體註冊失敗", font_path=custom_font_path, error=str(e))
                         continue
             
             # 如果標楷體註冊失敗，使用系統字體
@@ -74,134 +198,444 @@ class PDFService:
                 for font_path in font_paths:
                     if os.path.exists(font_path):
                         try:
-                            pdfmetrics.registerFont(TTFont(font_name, font_path))
+                            pdfmetrics.registerFont(load_ttf_font(font_name, font_path))
                             font_registered = True
-                            print(f"成功註冊系統字體: {font_path}")
+                            logger.info("成功註冊系統字體", font_path=font_path)
                             break
                         except Exception as e:
-                            print(f"系統字體註冊失敗: {e}")
+                            logger.warning("系統字體註冊失敗", font_path=font_path, error=str(e))
                             continue
             
             # 如果所有字體都註冊失敗，使用預設字體
             if not font_registered:
-                print("警告：無法註冊中文字體，將使用預設字體")
+                logger.warning("無法註冊中文字體，將使用預設字體")
                 font_name = "Helvetica"
             
             return font_name
             
         except Exception as e:
-            print(f"字體設定失敗: {e}")
+            logger.error("字體設定失敗", error=str(e))
             return "Helvetica"
     
-    def generate_payment_request_pdf(self, payment_data: Dict[str, Any]) -> io.BytesIO:
+    def generate_payment_request_pdf(
+        self, payment_data: Dict[str, Any], engine: str = "auto", profile: Optional[str] = None
+    ) -> io.BytesIO:
         """生成請款單 PDF
         
         Args:
             payment_data: 請款單數據
+            engine: 渲染引擎，"auto" 於請款明細只佔一頁時直接繪製於 canvas（可由
+                PDF_FAST_PATH 停用），多頁時在啟用頁面快取且有 qpdf 時逐頁渲染後拼接；
+                "canvas" 強制嘗試直接繪製，"pages" 強制嘗試逐頁渲染，"platypus" 一律
+                以 Platypus 渲染整份文件
+            profile: 輸出設定檔名稱（壓縮等級、影像品質、線性化），未指定時使用
+                PDF_OUTPUT_PROFILE 設定
             
         Returns:
             io.BytesIO: PDF 檔案流
         """
         buffer = io.BytesIO()
+        self.write_payment_request_pdf(payment_data, buffer, engine=engine, profile=profile)
+        buffer.seek(0)
+        return buffer
+    
+    def generate_payment_request_file(
+        self, payment_data: Dict[str, Any], engine: str = "auto", profile: Optional[str] = None
+    ) -> tempfile.SpooledTemporaryFile:
+        """生成請款單 PDF 至暫存檔
+        
+        輸出小於 PDF_SPOOL_MAX_MEMORY 時留在記憶體中，超過時自動轉存到磁碟，
+        明細數千筆的大型請款單不會在記憶體中留下整份 PDF。呼叫端負責關閉檔案。
+        
+        Returns:
+            tempfile.SpooledTemporaryFile: 已移回開頭的 PDF 暫存檔
+        """
+        output = tempfile.SpooledTemporaryFile(max_size=get_settings().pdf_spool_max_memory, suffix=".pdf")
+        try:
+            self.write_payment_request_pdf(payment_data, output, engine=engine, profile=profile)
+        except BaseException:
+            output.close()
+            raise
+        output.seek(0)
+        return output
+    
+    def write_payment_request_pdf(
+        self, payment_data: Dict[str, Any], output: BinaryIO, engine: str = "auto", profile: Optional[str] = None
+    ) -> int:
+        """將請款單 PDF 寫入可寫入的二進位檔案物件
+        
+        參數同 generate_payment_request_pdf。
+        
+        Returns:
+            int: 寫入的位元組數
+        """
+        output_profile = get_output_profile(profile)
+        details = len(payment_data.get("payment_details") or ())
+        with start_span("pdf.render", request_id=payment_data.get("id"), profile=output_profile.name, rows=details):
+            return self._write_pdf(payment_data, output, engine, output_profile)
+    
+    def _write_pdf(self, payment_data: Dict[str, Any], output: BinaryIO, engine: str, output_profile: OutputProfile) -> int:
+        """write_payment_request_pdf 的實作，於 pdf.render span 內執行"""
+        plan = self._get_render_plan(payment_data)
+        
+        # 排版請款明細並計算分頁（只計算一次，供表格繪製與每頁的簽名區域使用）
+        with _phase("pagination"):
+            rows, row_heights = self._layout_payment_details(payment_data, plan)
+            split_indices = self._calculate_split_indices(row_heights, plan)
+            payment_pages = len(split_indices)
+        
+        # 單頁請款單直接繪製於 canvas，省去 Platypus 的排版成本
+        use_canvas = engine == "canvas" or (engine == "auto" and get_settings().pdf_fast_path)
+        if use_canvas and self._canvas_renderer.can_render(split_indices):
+            with PDF_RENDERS_IN_PROGRESS.track():
+                with _phase("canvas_draw"):
+                    rendered = self._canvas_renderer.render(payment_data, rows, row_heights, output, output_profile, plan)
+                if rendered is not None:
+                    canvas, page_count = rendered
+                    with _phase("serialization"):
+                        canvas.save()
+            if rendered is not None:
+                return self._finish_render(output, page_count, "canvas", output_profile)
+        
+        # 多頁請款單逐頁渲染後以 qpdf 拼接，編輯後只重新渲染輸入有變動的頁面
+        use_pages = engine == "pages" or (engine == "auto" and self.page_cache is not None and qpdf_available())
+        if use_pages:
+            written = self._write_pages(payment_data, rows, row_heights, split_indices, output, output_profile, plan)
+            if written is not None:
+                return written
         
         # 建立 PDF 文件
         doc = SimpleDocTemplate(
-            buffer,
+            output,
             pagesize=A4,
-            rightMargin=1.5*cm,
-            leftMargin=1.5*cm,
-            topMargin=2*cm,
-            bottomMargin=6*cm  # 增加底部邊距以容納簽名區域
+            rightMargin=PAGE_RIGHT_MARGIN,
+            leftMargin=PAGE_LEFT_MARGIN,
+            topMargin=PAGE_TOP_MARGIN,
+            bottomMargin=PAGE_BOTTOM_MARGIN,  # 增加底部邊距以容納簽名區域
+            **self._document_metadata(payment_data)
         )
+        # 由我們自行呼叫 canvas.save()，以便分開計算序列化時間
+        doc._doSave = 0
         
-        # 建立內容
-        story = []
+        # 內容逐頁產生：doc.build 用完目前的頁面才建立下一頁，已繪製的 flowable 隨即釋放
+        story = _LazyStory(self._iter_story_pages(payment_data, rows, row_heights, split_indices, output_profile, plan))
         
-        # 計算請款明細表格需要的頁數
-        required_pages = self._calculate_required_pages(payment_data)
+        page_count = 0
         
-        if required_pages > 1:
-            # 如果表格需要多頁，生成多頁請款單
-            story.extend(self._build_multi_page_payment_request(payment_data, required_pages))
-        else:
-            # 第一頁：請款單
-            story.extend(self._build_payment_request_page(payment_data))
+        # 建立頁碼和簽名區域模板
+        def add_page_elements(canvas, doc):
+            """添加頁碼和簽名區域到每頁底部"""
+            nonlocal page_count
+            page_count = max(page_count, canvas.getPageNumber())
+            self._draw_page_elements(canvas, payment_data, payment_pages, plan)
+        
+        # 生成 PDF（頁面內容於 doc_build 階段邊產生邊繪製）
+        with PDF_RENDERS_IN_PROGRESS.track():
+            with _phase("doc_build"):
+                doc.build(
+                    story,
+                    onFirstPage=add_page_elements,
+                    onLaterPages=add_page_elements,
+                    canvasmaker=partial(self._make_canvas, payment_data),
+                )
+            with _phase("serialization"):
+                doc.canv.save()
+        
+        return self._finish_render(output, page_count, "platypus", output_profile)
+    
+    def _finish_render(
+        self, output: BinaryIO, page_count: int, engine: str, profile: OutputProfile, finalized: bool = False
+    ) -> int:
+        """依輸出設定檔完成 PDF 並記錄渲染指標，回傳輸出的位元組數
+
+        finalized 表示輸出已套用設定檔的壓縮與線性化（逐頁渲染時由各頁與 qpdf 完成）。
+        """
+        if profile.rewrites_output and not finalized:
+            with _phase("postprocess"):
+                output.seek(0)
+                pdf_data = finalize_pdf(output.read(), profile)
+                output.seek(0)
+                output.truncate()
+                output.write(pdf_data)
+        size = output.tell()
+        span = current_span()
+        span.set_attribute("engine", engine)
+        span.set_attribute("pages", page_count)
+        span.set_attribute("bytes", size)
+        PDF_RENDERS.inc(engine=engine, profile=profile.name)
+        PDF_PAGES.observe(page_count)
+        PDF_OUTPUT_BYTES.observe(size)
+        return size
+    
+    def _write_pages(
+        self,
+        data: Dict[str, Any],
+        rows: List[List[str]],
+        row_heights: List[float],
+        split_indices: list,
+        output: BinaryIO,
+        profile: OutputProfile,
+        plan: RenderPlan,
+    ) -> Optional[int]:
+        """逐頁渲染成單頁 PDF 並以 qpdf 拼接，頁面快取中輸入相同的頁面直接重用
+
+        不論頁面是否來自快取，輸出都經由相同的單頁渲染與拼接產生，同一份紀錄
+        每次下載的位元組相同。
+
+        Returns:
+            Optional[int]: 寫入的位元組數；無法逐頁渲染或拼接時回傳 None，
+            由呼叫端改為整份渲染
+        """
+        payment_pages = len(split_indices)
+        pages: List[bytes] = []
+        reused = 0
+        with PDF_RENDERS_IN_PROGRESS.track():
+            with _phase("page_render"):
+                specs = self._iter_page_specs(data, rows, row_heights, split_indices, profile, plan)
+                for page_number, (inputs, build) in enumerate(specs, start=1):
+                    key = page_key(plan.name, self.chinese_font, profile.name, page_number, payment_pages, *inputs)
+                    page = self.page_cache.get(key) if self.page_cache is not None else None
+                    if page is not None:
+                        reused += 1
+                    else:
+                        page = self._render_page(data, build(), page_number, payment_pages, profile, plan)
+                        if page is None:
+                            return None
+                        if self.page_cache is not None:
+                            self.page_cache.put(key, page)
+                    pages.append(page)
+            with _phase("merge"):
+                merged = merge_pages(self._render_shell(data), pages, linearize=profile.linearize)
+        if merged is None:
+            return None
+        
+        output.write(merged)
+        current_span().set_attribute("pages_reused", reused)
+        return self._finish_render(output, len(pages), "pages", profile, finalized=True)
+    
+    def _iter_page_specs(
+        self,
+        data: Dict[str, Any],
+        rows: List[List[str]],
+        row_heights: List[float],
+        split_indices: list,
+        profile: OutputProfile,
+        plan: RenderPlan,
+    ) -> Iterator[Tuple[tuple, Callable[[], list]]]:
+        """依序產生每一頁的 (影響該頁內容的輸入, 建立該頁 flowable 的函式)
+
+        頁面與 _iter_story_pages 相同。請款單頁面的簽名區域上方印有總計，因此
+        修改金額會影響所有請款單頁面；只修改文字欄位時只有該列所在的頁面改變。
+        頁碼、表單範本、字體與輸出設定檔由呼叫端加入快取鍵。
+        """
+        total = str(data.get("total_amount", 0))
+        bounds = [0, *split_indices]
+        for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            page_rows, page_heights = rows[start:end], row_heights[start:end]
+            if index == 0:
+                inputs = ("payment", self._build_basic_info_rows(data, plan), page_rows, page_heights, total)
+                yield inputs, partial(self._build_payment_request_page, data, page_rows, page_heights, plan)
+            else:
+                inputs = ("continuation", page_rows, page_heights, total)
+                yield inputs, partial(self._build_payment_request_page_continuation, page_rows, page_heights, plan)
+        
+        yield ("receipt", data.get("payee"), data.get("application_date")), partial(
+            self._build_receipt_attachment_page, data, plan
+        )
+        if self._needs_bank_book_page(data):
+            yield ("bank_book", self._bank_book_digest(data)), partial(self._build_bank_book_page, data, plan, profile)
+    
+    def _render_page(
+        self,
+        data: Dict[str, Any],
+        flowables: list,
+        page_number: int,
+        payment_pages: int,
+        profile: OutputProfile,
+        plan: RenderPlan,
+    ) -> Optional[bytes]:
+        """把一頁的 flowable 渲染成單頁 PDF（含頁碼、標誌與簽名區域），內容超過一頁時回傳 None"""
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            rightMargin=PAGE_RIGHT_MARGIN,
+            leftMargin=PAGE_LEFT_MARGIN,
+            topMargin=PAGE_TOP_MARGIN,
+            bottomMargin=PAGE_BOTTOM_MARGIN,
+        )
+        doc._doSave = 0
+        drawn = 0
+        
+        def add_page_elements(canvas, doc):
+            nonlocal drawn
+            drawn += 1
+            self._draw_page_elements(canvas, data, payment_pages, plan)
+        
+        doc.build(
+            flowables,
+            onFirstPage=add_page_elements,
+            onLaterPages=add_page_elements,
+            canvasmaker=partial(self._make_page_canvas, page_number),
+        )
+        if drawn != 1:
+            logger.warning("單頁渲染超過一頁，改為整份渲染", page_number=page_number, pages=drawn)
+            return None
+        doc.canv.save()
+        
+        pdf_data = buffer.getvalue()
+        if profile.compression_level is not None:
+            pdf_data = recompress_streams(pdf_data, profile.compression_level)
+        return pdf_data
+    
+    @staticmethod
+    def _make_page_canvas(page_number: int, *args, **kwargs) -> Canvas:
+        """單頁 PDF 的 canvas：頁碼從 page_number 起算，內容只由該頁的輸入決定"""
+        kwargs["invariant"] = 1
+        canvas = _CompactCanvas(*args, **kwargs)
+        canvas._pageNumber = page_number
+        return canvas
+    
+    def _render_shell(self, data: Dict[str, Any]) -> bytes:
+        """拼接時作為主文件的空白 PDF，只提供與整份渲染相同的文件資訊"""
+        buffer = io.BytesIO()
+        canvas = self._make_canvas(data, buffer, pagesize=A4)
+        canvas.showPage()
+        canvas.save()
+        return buffer.getvalue()
+    
+    def _iter_story_pages(
+        self,
+        data: Dict[str, Any],
+        rows: List[List[str]],
+        row_heights: List[float],
+        split_indices: list,
+        profile: OutputProfile,
+        plan: RenderPlan,
+    ) -> Iterator[list]:
+        """依序產生每一頁的 flowable（第二頁起以 PageBreak 開頭）"""
+        # 第一頁起：請款單（表格過長時延續到後續頁面）
+        yield from self._iter_payment_request_pages(data, rows, row_heights, split_indices, plan)
         
         # 第二頁：單據憑證黏貼單
-        story.append(PageBreak())
-        story.extend(self._build_receipt_attachment_page(payment_data))
+        yield [PageBreak(), *self._build_receipt_attachment_page(data, plan)]
         
         # 第三頁：存摺影本 (條件性)
-        if self._needs_bank_book_page(payment_data):
-            story.append(PageBreak())
-            story.extend(self._build_bank_book_page(payment_data))
+        if self._needs_bank_book_page(data):
+            yield [PageBreak(), *self._build_bank_book_page(data, plan, profile)]
+    
+    def _make_canvas(self, data: Dict[str, Any], *args, **kwargs) -> Canvas:
+        """建立輸出可重現的 canvas
         
-        # 建立頁碼和簽名區域模板
-        def add_page_elements(canvas, doc):
-            """添加頁碼和簽名區域到每頁底部"""
-            page_num = canvas.getPageNumber()
-            canvas.saveState()
-            canvas.setFont(self.chinese_font, 12)
-            canvas.setFillColor(colors.black)
-            
-            # 在頁面底部中央添加頁碼
-            canvas.drawCentredString(A4[0]/2, 1.5*cm, str(page_num))
-            
-            # 在右上角添加費用申請單號
-            canvas.setFont(self.chinese_font, 10)
-            canvas.drawRightString(A4[0] - 2*cm, A4[1] - 2*cm, "費用申請單號：")
-            canvas.drawRightString(A4[0] - 2*cm, A4[1] - 2.3*cm, "(財務組填寫)")
-            
-            # 在左上角添加mark.jpg圖片（等比例調整為高度2cm）
-            try:
-                mark_paths = ["./mark.jpg", "/app/mark.jpg"]
-                mark_path = None
-                for path in mark_paths:
-                    if os.path.exists(path):
-                        mark_path = path
-                        break
-                
-                if mark_path:
-                    # 載入圖片並獲取原始尺寸
-                    pil_image = PILImage.open(mark_path)
-                    original_width, original_height = pil_image.size
-                    
-                    # 計算等比例縮放，高度固定為2cm
-                    target_height_cm = 2
-                    target_height_pt = target_height_cm * 28.35  # 1cm = 28.35 points
-                    
-                    # 計算等比例寬度
-                    aspect_ratio = original_width / original_height
-                    target_width_pt = target_height_pt * aspect_ratio
-                    
-                    # 載入並使用調整後的大小
-                    img = ReportLabImage(mark_path, width=target_width_pt, height=target_height_pt)
-                    img.drawOn(canvas, 2*cm, A4[1] - 2.5*cm)
-            except Exception as e:
-                print(f"載入mark.jpg失敗: {e}")
-            
-            # 在所有請款單頁面都添加簽名區域
-            # 修正：直接計算實際的請款單頁數
-            details = payment_data.get("payment_details", [])
-            if len(details) == 0:
-                payment_pages = 1
-            else:
-                # 計算分頁點來確定實際頁數
-                split_indices = self._calculate_split_indices(payment_data, self._calculate_required_pages(payment_data))
-                payment_pages = len(split_indices)
-            
-            if page_num <= payment_pages:
-                self._draw_signature_area(canvas, payment_data)
-            
-            canvas.restoreState()
+        ReportLab 預設把產生時間寫進 CreationDate 並以此計算文件 ID，同一筆紀錄
+        每次下載的位元組都不同。這裡改用 invariant 模式，日期取自紀錄的最後修改時間、
+        文件 ID 由紀錄編號與版本決定，相同的紀錄與輸出設定檔一定產生相同的位元組，
+        可作為強 ETag 並支援續傳。
+        """
+        kwargs["invariant"] = 1
+        canvas = _CompactCanvas(*args, **kwargs)
+        metadata = self._document_metadata(data)
+        canvas.setTitle(metadata["title"])
+        canvas.setAuthor(metadata["author"])
+        canvas.setSubject(metadata["subject"])
+        canvas.setCreator(metadata["creator"])
+        canvas.setKeywords(metadata["keywords"])
+        
+        modified_at = data.get("updated_at") or data.get("created_at")
+        if isinstance(modified_at, datetime):
+            pdf_date = self._format_pdf_date(modified_at)
+            canvas.setDateFormatter(lambda *_: pdf_date)
+        canvas._doc.updateSignature(f"{data.get('id')}:{data.get('version', 1)}")
+        return canvas
+    
+    def _document_metadata(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """由請款單紀錄決定的 PDF 中繼資料"""
+        return {
+            "title": f"費用請款單 {data.get('application_date') or ''}".strip(),
+            "author": data.get("payee") or None,
+            "subject": data.get("id") or None,
+            "creator": get_settings().app_name,
+            "keywords": [],
+        }
+    
+    @staticmethod
+    def _format_pdf_date(value: datetime) -> str:
+        """格式化為 PDF 日期字串，例如 D:20240115093000+08'00'"""
+        pdf_date = value.strftime("D:%Y%m%d%H%M%S")
+        offset = value.utcoffset()
+        if offset is not None:
+            minutes = int(offset.total_seconds()) // 60
+            sign = "+" if minutes >= 0 else "-"
+            pdf_date += f"{sign}{abs(minutes) // 60:02d}'{abs(minutes) % 60:02d}'"
+        return pdf_date
+    
+    def _draw_page_elements(self, canvas, data: Dict[str, Any], payment_pages: int, plan: RenderPlan):
+        """在目前頁面繪製頁碼、費用申請單號、標誌，請款單頁面另加簽名區域"""
+        page_num = canvas.getPageNumber()
+        canvas.saveState()
+        canvas.setFont(self.chinese_font, 12)
+        canvas.setFillColor(colors.black)
         
-        # 生成 PDF
-        doc.build(story, onFirstPage=add_page_elements, onLaterPages=add_page_elements)
-        buffer.seek(0)
+        # 在頁面底部中央添加頁碼
+        canvas.drawCentredString(A4[0]/2, 1.5*cm, str(page_num))
         
-        return buffer
+        # 在右上角添加費用申請單號
+        canvas.setFont(self.chinese_font, 10)
+        form_number_label, form_number_note = plan.form_number_labels
+        canvas.drawRightString(A4[0] - 2*cm, A4[1] - 2*cm, form_number_label)
+        canvas.drawRightString(A4[0] - 2*cm, A4[1] - 2.3*cm, form_number_note)
+        
+        # 在左上角添加mark.jpg圖片（等比例調整為高度2cm）
+        try:
+            mark = self._get_mark_image()
+            if mark:
+                mark_path, target_width_pt, target_height_pt = mark
+                img = ReportLabImage(mark_path, width=target_width_pt, height=target_height_pt)
+                img.drawOn(canvas, 2*cm, A4[1] - 2.5*cm)
+        except Exception as e:
+            logger.bind(sample=100).warning("載入mark.jpg失敗", error=str(e))
+        
+        # 在所有請款單頁面都添加簽名區域
+        if page_num <= payment_pages:
+            self._draw_signature_area(canvas, data, plan)
+        
+        canvas.restoreState()
+    
+    def _get_mark_image(self) -> Optional[Tuple[str, float, float]]:
+        """取得 mark.jpg 路徑及等比例縮放後的尺寸（高度固定 2cm），結果會被快取"""
+        cached = self._mark_image is not _NOT_LOADED
+        record_cache_lookup("mark_image", cached)
+        if not cached:
+            self._mark_image = self._load_mark_image()
+        return self._mark_image
     
-    def _draw_signature_area(self, canvas, data: Dict[str, Any]):
+    def _load_mark_image(self) -> Optional[Tuple[str, float, float]]:
+        """載入 mark.jpg 並計算等比例縮放後的尺寸"""
+        mark_paths = ["./mark.jpg", "/app/mark.jpg"]
+        mark_path = None
+        for path in mark_paths:
+            if os.path.exists(path):
+                mark_path = path
+                break
+        
+        if not mark_path:
+            return None
+        
+        # 載入圖片並獲取原始尺寸
+        with PILImage.open(mark_path) as pil_image:
+            original_width, original_height = pil_image.size
+        
+        # 計算等比例縮放，高度固定為2cm
+        target_height_cm = 2
+        target_height_pt = target_height_cm * 28.35  # 1cm = 28.35 points
+        
+        # 計算等比例寬度
+        aspect_ratio = original_width / original_height
+        target_width_pt = target_height_pt * aspect_ratio
+        
+        return mark_path, target_width_pt, target_height_pt
+    
+    def _draw_signature_area(self, canvas, data: Dict[str, Any], plan: RenderPlan):
         """在頁面底部繪製有框線的簽名區域：2格、5格、5格結構。"""
         # 簽名區域距離底部2cm
         signature_y_start = 2*cm
@@ -229,15 +663,15 @@ class PDFService:
         canvas.rect(x_starts[3], signature_y_start + row_heights[1] + row_heights[2], 2 * signature_col_width, row_heights[0])
         # 第一行文字
         canvas.setFont(self.chinese_font, 14)
-        canvas.drawCentredString(x_starts[0] + 1.5 * signature_col_width, signature_y_start + row_heights[1] + row_heights[2] + 0.25*cm, "付款單位")
-        canvas.drawCentredString(x_starts[3] + signature_col_width, signature_y_start + row_heights[1] + row_heights[2] + 0.25*cm, "請款單位")
+        payer_group, requester_group = plan.signature_groups
+        canvas.drawCentredString(x_starts[0] + 1.5 * signature_col_width, signature_y_start + row_heights[1] + row_heights[2] + 0.25*cm, payer_group)
+        canvas.drawCentredString(x_starts[3] + signature_col_width, signature_y_start + row_heights[1] + row_heights[2] + 0.25*cm, requester_group)
         
         # 第二行：5格（職稱）
         for i in range(5):
             canvas.rect(x_starts[i], signature_y_start + row_heights[2], signature_col_width, row_heights[1])
-        positions = ["執行秘書", "財務主管", "財務經辦", "請款單位主管", "請款人"]
         canvas.setFont(self.chinese_font, 13)
-        for i, pos in enumerate(positions):
+        for i, pos in enumerate(plan.signature_roles):
             center = x_starts[i] + signature_col_width / 2
             canvas.drawCentredString(center, signature_y_start + row_heights[2] + 0.25*cm, pos)
         
@@ -249,11 +683,22 @@ class PDFService:
         # 在簽名區域正上方繪製總計金額
         canvas.setFont(self.chinese_font, 14)
         canvas.setFillColor(colors.black)
-        total_text = f"總計：NT$ {format_currency(float(data.get('total_amount', 0)))}"
+        total_text = f"{plan.labels['total']}：NT$ {format_currency(float(data.get('total_amount', 0)))}"
         canvas.drawRightString(x_starts[5], signature_y_start + signature_height + 0.5*cm, total_text)
     
-    def _build_payment_request_page(self, data: Dict[str, Any]) -> list:
-        """建立請款單頁面內容"""
+    def _build_payment_request_page(
+        self, data: Dict[str, Any], rows: List[List[str]], row_heights: List[float], plan: RenderPlan
+    ) -> list:
+        """建立請款單頁面內容（標題、基本資訊與請款明細表格第一部分）"""
+        story = self._build_payment_request_header(data, plan)
+        story.append(self._build_detail_table(rows, row_heights, plan))
+        
+        # 移除總計欄位，因為現在會顯示在簽名區域上方
+        
+        return story
+    
+    def _build_payment_request_header(self, data: Dict[str, Any], plan: RenderPlan) -> list:
+        """建立請款單第一頁表格之前的內容（標題、基本資訊、請款明細標題與說明文字）"""
         story = []
         styles = getSampleStyleSheet()
         
@@ -267,15 +712,11 @@ class PDFService:
             fontName=self.chinese_font,
             textColor=colors.black
         )
-        story.append(Paragraph("請款單", title_style))
+        story.append(Paragraph(plan.title, title_style))
         story.append(Spacer(1, 10))  # 大幅減少間距
         
         # 基本資訊表格 - 移除建立時間欄位
-        basic_info_data = [
-            ["申請日期", data.get("application_date", "") or "（未填寫）", "請款單位", self._get_requesting_unit_display(data)],
-            ["受款人", data.get("payee", ""), "付款方式", self._get_payment_method_display(data)],
-            ["請款金額", f"NT$ {format_currency(float(data.get('total_amount', 0)))}", "", ""]
-        ]
+        basic_info_data = self._build_basic_info_rows(data, plan)
         
         basic_info_table = Table(basic_info_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm], rowHeights=[0.8*cm]*3)
         basic_info_table.setStyle(TableStyle([
@@ -304,7 +745,7 @@ class PDFService:
             spaceAfter=8,  # 大幅減少間距
             spaceBefore=5  # 大幅減少間距
         )
-        story.append(Paragraph("請款明細", heading2_style))
+        story.append(Paragraph(plan.detail_heading, heading2_style))
         story.append(Spacer(1, 5))  # 大幅減少間距
         
         # 新增說明文字（在標題底下，表格之前）
@@ -319,87 +760,48 @@ class PDFService:
             spaceBefore=2  # 大幅減少間距
         )
         
-        # 專案說明
-        project_note = "專案：A.會議(理監事會議、審查會議、幹事會議等) B.活動(含年會、各項座談會、年度志工激勵活動、各區學生輔導活動等) C.志工培訓(含志工會議) D.學校訪談 E.專案補助 F.其他"
-        story.append(Paragraph(project_note, note_style))
-        
-        # 費用類型說明
-        expense_note = "費用類型：1.交通費 2.場地租借 3.餐費 4.文宣 5.電話費 6.補助 7.志工津貼 8.設備器材(含軟硬體) 9.雜支"
-        story.append(Paragraph(expense_note, note_style))
+        # 代碼說明（專案、費用類型）
+        for note in plan.detail_notes:
+            story.append(Paragraph(note, note_style))
         
         story.append(Spacer(1, 8))  # 大幅減少表格前的間距
         
-        # 請款明細表格（移除總計行）
-        detail_headers = ["專案", "費用類型", "執行時間", "執行內容", "金額", "備註憑證"]
-        detail_data = [detail_headers]
-        
-        for item in data.get("payment_details", []):
-            # 處理 Pydantic 模型或字典，使用簡化顯示
-            if hasattr(item, 'project_type'):
-                # Pydantic 模型
-                project_text = self._get_simplified_display(item.project_type)
-                expense_text = self._get_simplified_display(item.expense_type)
-                row = [
-                    project_text,  # 簡化後不需要換行
-                    expense_text,  # 簡化後不需要換行
-                    item.execution_time or "",
-                    self._wrap_text(item.execution_content, 9),  # 執行內容超過9個字自動換行
-                    f"NT$ {format_currency(float(item.amount))}",
-                    ""  # 備註憑證留空
-                ]
-            else:
-                # 字典
-                project_text = self._get_simplified_display(item["project_type"])
-                expense_text = self._get_simplified_display(item["expense_type"])
-                row = [
-                    project_text,  # 簡化後不需要換行
-                    expense_text,  # 簡化後不需要換行
-                    item.get("execution_time", ""),
-                    self._wrap_text(item["execution_content"], 9),  # 執行內容超過9個字自動換行
-                    f"NT$ {format_currency(float(item['amount']))}",
-                    ""  # 備註憑證留空
-                ]
-            detail_data.append(row)
-        
-        # 動態計算每行的高度
-        row_heights = []
-        for i, row in enumerate(detail_data):
-            if i == 0:  # 標題行
-                row_heights.append(1.2*cm)
-            else:  # 資料行
-                # 計算每行文字的最大行數
-                max_lines = 1
-                for cell_text in row:
-                    if cell_text:
-                        lines = cell_text.count('\n') + 1
-                        max_lines = max(max_lines, lines)
-                # 根據行數調整高度，每行至少 0.8cm
-                row_height = max(0.8*cm, max_lines * 0.6*cm)
-                row_heights.append(row_height)
-        
-        detail_table = Table(detail_data, colWidths=[3*cm, 3*cm, 2.5*cm, 4*cm, 2.5*cm, 2.5*cm], rowHeights=row_heights)
+        return story
+    
+    def _build_basic_info_rows(self, data: Dict[str, Any], plan: RenderPlan) -> List[List[str]]:
+        """基本資訊表格的內容"""
+        labels = plan.labels
+        return [
+            [labels["application_date"], data.get("application_date", "") or labels["application_date_missing"],
+             labels["requesting_unit"], self._get_requesting_unit_display(data)],
+            [labels["payee"], data.get("payee", ""), labels["payment_method"], self._get_payment_method_display(data)],
+            [labels["total_amount"], f"NT$ {format_currency(float(data.get('total_amount', 0)))}", "", ""]
+        ]
+    
+    def _build_detail_table(self, rows: List[List[str]], row_heights: List[float], plan: RenderPlan) -> Table:
+        """建立請款明細表格（rows 與 row_heights 來自 _layout_payment_details，不含表頭）"""
+        detail_table = Table(
+            [plan.detail_headers] + rows,
+            colWidths=plan.detail_col_widths,
+            rowHeights=[DETAIL_HEADER_HEIGHT] + row_heights,
+        )
         detail_table.setStyle(TableStyle([
             ('FONTNAME', (0, 0), (-1, -1), self.chinese_font),
-            ('FONTSIZE', (0, 0), (-1, -1), 11),
+            ('FONTSIZE', (0, 0), (-1, -1), DETAIL_FONT_SIZE),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
             ('ALIGN', (0, 0), (-1, -1), 'LEFT'),  # 改為左對齊，更清晰
             ('FONTSIZE', (0, 0), (-1, 0), 12),  # 表頭字體稍大
             ('TOPPADDING', (0, 0), (-1, -1), 8),
             ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+            ('LEFTPADDING', (0, 0), (-1, -1), DETAIL_CELL_PADDING),
+            ('RIGHTPADDING', (0, 0), (-1, -1), DETAIL_CELL_PADDING),
             # 添加黑線框
             ('GRID', (0, 0), (-1, -1), 1, colors.black),
             ('BOX', (0, 0), (-1, -1), 1, colors.black),
         ]))
-        story.append(detail_table)
-        story.append(Spacer(1, 20))  # 減少間距
-        
-        # 移除總計欄位，因為現在會顯示在簽名區域上方
-        
-        return story
+        return detail_table
     
-    def _build_receipt_attachment_page(self, data: Dict[str, Any]) -> list:
+    def _build_receipt_attachment_page(self, data: Dict[str, Any], plan: RenderPlan) -> list:
         """建立單據憑證黏貼單頁面內容"""
         story = []
         styles = getSampleStyleSheet()
@@ -414,12 +816,12 @@ class PDFService:
             fontName=self.chinese_font,
             textColor=colors.black
         )
-        story.append(Paragraph("單據憑證黏貼單", title_style))
+        story.append(Paragraph(plan.receipt["title"], title_style))
         story.append(Spacer(1, 5))  # 進一步減少間距
         
         # 基本資訊 - 改成左右排放
         info_data = [
-            ["請款人", data.get("payee", ""), "申請日期", data.get("application_date", "")]
+            [plan.receipt["payee_label"], data.get("payee", ""), plan.receipt["date_label"], data.get("application_date", "")]
         ]
         
         info_table = Table(info_data, colWidths=[3*cm, 5*cm, 3*cm, 5*cm], rowHeights=[2*cm])
@@ -444,13 +846,15 @@ class PDFService:
             fontSize=14,  # 跟請款人字體大小一致
             spaceAfter=3  # 進一步減少間距
         )
-        story.append(Paragraph("請將收據、發票等憑證黏貼於下方空白處", normal_style))
+        story.append(Paragraph(plan.receipt["instruction"], normal_style))
         story.append(Spacer(1, 200))  # 大空白區域
         
         return story
     
-    def _build_bank_book_page(self, data: Dict[str, Any]) -> list:
-        """建立存摺影本頁面內容"""
+    def _build_bank_book_page(
+        self, data: Dict[str, Any], plan: RenderPlan, profile: Optional[OutputProfile] = None
+    ) -> list:
+        """建立存摺影本頁面內容，圖片依輸出設定檔縮小並重新編碼"""
         story = []
         styles = getSampleStyleSheet()
         
@@ -464,37 +868,29 @@ class PDFService:
             fontName=self.chinese_font,
             textColor=colors.black
         )
-        story.append(Paragraph("存摺影本", title_style))
+        story.append(Paragraph(plan.bank_book["title"], title_style))
         story.append(Spacer(1, 30))
         
         # 如果有上傳圖片，嘗試顯示
-        bank_book_image = data.get("bank_book_image")
-        if bank_book_image:
+        if data.get("bank_book") is not None or data.get("bank_book_image"):
             try:
-                # 解碼 base64 圖片
-                image_data = base64.b64decode(bank_book_image)
-                image_buffer = io.BytesIO(image_data)
-                
-                # 使用 PIL 處理圖片並調整大小
-                pil_image = PILImage.open(image_buffer)
+                image = self._get_bank_book(data)
                 
-                # 計算與請款明細表格相同的寬度
-                col_widths = [3*cm, 3*cm, 2.5*cm, 4*cm, 2.5*cm, 2.5*cm]
-                target_width = sum(col_widths)  # 與請款明細表格同寬
-                
-                # 獲取原始尺寸
-                original_width, original_height = pil_image.size
-                
-                # 計算等比例縮放
-                aspect_ratio = original_width / original_height
+                # 與請款明細表格同寬，等比例縮放
+                target_width = plan.detail_width
+                aspect_ratio = image.aspect_ratio
                 target_height = target_width / aspect_ratio
                 
-                # 重新打開圖片緩衝區
-                image_buffer.seek(0)
+                # 直式圖片超過頁面剩餘高度時等比例縮小，否則整頁放不下會導致 PDF 生成失敗
+                available_height = FRAME_HEIGHT - self._measure_flowables(story)
+                if target_height > available_height:
+                    target_width, target_height = available_height * aspect_ratio, available_height
+                
+                with start_span("pdf.bank_book_image", source_bytes=len(image.data)):
+                    image_data = image.for_profile(target_width, target_height, profile) if profile is not None else image.data
                 
                 # 添加圖片到 PDF，使用固定寬度等比例調整
-                img = ReportLabImage(image_buffer, width=target_width, height=target_height)
-                story.append(img)
+                story.append(_ImageBytesFlowable(image_data, target_width, target_height))
                 
             except Exception as e:
                 # 如果圖片處理失敗，顯示佔位符
@@ -503,70 +899,24 @@ class PDFService:
                     parent=styles['Normal'],
                     fontName=self.chinese_font
                 )
-                story.append(Paragraph(f"存摺影本圖片載入失敗：{str(e)}", normal_style))
+                story.append(Paragraph(f"{plan.bank_book['load_error']}{str(e)}", normal_style))
         else:
             normal_style = ParagraphStyle(
                 'NormalChinese',
                 parent=styles['Normal'],
                 fontName=self.chinese_font
             )
-            story.append(Paragraph("請黏貼存摺影本", normal_style))
+            story.append(Paragraph(plan.bank_book["placeholder"], normal_style))
         
         return story
     
     def _get_enum_value(self, value) -> str:
         """安全獲取枚舉值的字符串表示"""
-        if hasattr(value, 'value'):
-            return str(value.value)
-        elif isinstance(value, str):
-            return value
-        return str(value) if value else ""
-    
-    def _get_simplified_display(self, value) -> str:
-        """獲取簡化的顯示文字（用於表格內顯示）"""
-        if hasattr(value, 'value'):
-            value_str = str(value.value)
-        elif isinstance(value, str):
-            value_str = value
-        else:
-            value_str = str(value) if value else ""
-        
-        # 專案類型簡化
-        if "A.會議" in value_str:
-            return "A"
-        elif "B.活動" in value_str:
-            return "B"
-        elif "C.志工培訓" in value_str:
-            return "C"
-        elif "D.學校訪談" in value_str:
-            return "D"
-        elif "E.專案補助" in value_str:
-            return "E"
-        elif "F.其他" in value_str:
-            return "F"
-        
-        # 費用類型簡化
-        elif "1.交通費" in value_str:
-            return "1"
-        elif "2.場地租借" in value_str:
-            return "2"
-        elif "3.餐費" in value_str:
-            return "3"
-        elif "4.文宣" in value_str:
-            return "4"
-        elif "5.電話費" in value_str:
-            return "5"
-        elif "6.補助" in value_str:
-            return "6"
-        elif "7.志工津貼" in value_str:
-            return "7"
-        elif "8.設備器材" in value_str:
-            return "8"
-        elif "9.雜支" in value_str:
-            return "9"
-        
-        # 如果沒有匹配，返回原值
-        return value_str
+        return enum_value(value)
+    
+    def _get_render_plan(self, data: Dict[str, Any]) -> RenderPlan:
+        """取得請款單位使用的表單範本"""
+        return get_render_plan(self._get_enum_value(data.get("requesting_unit")))
     
     def _get_payment_method_display(self, data: Dict[str, Any]) -> str:
         """取得付款方式顯示文字"""
@@ -584,409 +934,218 @@ class PDFService:
             return f"{unit_value} ({data.get('requesting_unit_other', '')})"
         return unit_value
     
+    def _get_bank_book(self, data: Dict[str, Any]) -> BankBookImage:
+        """取得建立請款單時已解碼的存摺影本
+
+        直接傳入 base64 字串的呼叫端（暖機、基準測試）在此解碼，無法解碼時拋出 ValueError。
+        """
+        image = data.get("bank_book")
+        if image is None:
+            image = decode_bank_book_image(data.get("bank_book_image") or "")
+        return image
+    
+    def _bank_book_digest(self, data: Dict[str, Any]) -> Optional[str]:
+        """存摺影本內容的雜湊，作為存摺影本頁的快取鍵"""
+        image = data.get("bank_book")
+        if image is not None:
+            return image.digest
+        encoded = data.get("bank_book_image")
+        return hashlib.sha256(encoded.encode()).hexdigest() if encoded else None
+    
     def _needs_bank_book_page(self, data: Dict[str, Any]) -> bool:
         """判斷是否需要存摺影本頁面"""
         payment_method = data.get("payment_method")
         return payment_method in [PaymentMethod.TRANSFER.value, PaymentMethod.ADVANCE.value] 
 
-    def _wrap_text(self, text: str, max_chars: int) -> str:
-        """將文字按指定字數換行"""
-        if len(text) <= max_chars:
-            return text
-        
-        # 每 max_chars 個字插入換行符
-        wrapped_text = ""
-        for i in range(0, len(text), max_chars):
-            wrapped_text += text[i:i+max_chars] + "\n"
-        
-        return wrapped_text.strip()
-    
-    def _calculate_required_pages(self, data: Dict[str, Any]) -> int:
-        """計算請款明細表格需要的頁數"""
-        # 計算表格的實際高度
-        details = data.get("payment_details", [])
-        if len(details) == 0:
-            return 1
-        
-        # 計算表格高度：標題行 + 資料行 + 說明文字
-        header_height = 1.2 * cm  # 標題行高度
-        note_height = 2 * cm  # 說明文字高度
-        
-        # 計算每行的實際高度（考慮文字換行）
-        total_row_height = 0
-        for item in details:
-            if hasattr(item, 'execution_content'):
-                content = item.execution_content
-            else:
-                content = item["execution_content"] if isinstance(item, dict) else ""
-            
-            # 計算執行內容的行數（每9個字換一行）
-            content_lines = (len(content) + 8) // 9  # 向上取整
-            max_lines = max(1, content_lines)
-            
-            # 每行至少0.8cm，每多一行增加0.6cm
-            row_height = max(0.8*cm, max_lines * 0.6*cm)
-            total_row_height += row_height
-        
-        table_height = header_height + total_row_height + note_height
-        
-        # 可用頁面高度（扣除頁面邊距和簽名區域）
-        available_height = A4[1] - 4*cm - 6*cm  # 頁面高度 - 上邊距 - 下邊距
+    def _layout_payment_details(
+        self, data: Dict[str, Any], plan: RenderPlan
+    ) -> Tuple[List[List[str]], List[float]]:
+        """排版請款明細表格的資料列
+
+        欄位與格式取自表單範本：代碼欄位查表簡化，wrap 欄位依字體實際字寬換行
+        並決定列高。分頁計算與表格繪製共用同一份結果，不需要重新排版。
+
+        Returns:
+            Tuple[List[List[str]], List[float]]: 表格資料列（不含表頭）與對應的列高
+        """
+        layout = get_text_layout(self.chinese_font)
+        columns = [
+            (column.field, column.formatter, column.width - 2 * DETAIL_CELL_PADDING)
+            for column in plan.columns
+        ]
         
-        # 計算需要的頁數
-        required_pages = max(1, int((table_height + available_height - 1) // available_height))
-        return required_pages
+        rows = []
+        row_heights = []
+        for item in data.get("payment_details", []):
+            # 處理 Pydantic 模型或字典
+            get = item.get if isinstance(item, dict) else partial(getattr, item)
+            row = []
+            max_lines = 1
+            for field, formatter, text_width in columns:
+                value = get(field, None) if field else None
+                if formatter is not None:
+                    row.append(formatter(value))
+                    continue
+                lines = layout.wrap(value or "", text_width, DETAIL_FONT_SIZE)
+                max_lines = max(max_lines, len(lines))
+                row.append("\n".join(lines))
+            rows.append(row)
+            # 根據行數調整高度，每列至少 0.8cm
+            row_heights.append(max(0.8*cm, max_lines * 0.6*cm))
+        
+        return rows, row_heights
     
-    def _build_multi_page_payment_request(self, data: Dict[str, Any], required_pages: int) -> list:
-        """建立多頁請款單內容"""
-        story = []
-        
-        # 計算所有分頁點
-        split_indices = self._calculate_split_indices(data, required_pages)
-        
-        # 檢查分頁點數量
-        if len(split_indices) < 2:
-            # 如果只有一個分頁點，說明內容不需要分頁
-            story.extend(self._build_payment_request_page_part1(data, split_indices[0]))
-            return story
-        
-        # 第一頁：標題、基本資訊、表格第一部分
-        story.extend(self._build_payment_request_page_part1(data, split_indices[0]))
-        
-        # 後續頁面：每頁都包含表格部分、總計和簽名區域
-        for i in range(1, len(split_indices)):
-            story.append(PageBreak())
-            if i == len(split_indices) - 1:
-                # 最後一頁：表格最後部分
-                story.extend(self._build_payment_request_page_continuation(data, split_indices[i-1], split_indices[i], is_last=True))
-            else:
-                # 中間頁面：表格中間部分
-                story.extend(self._build_payment_request_page_continuation(data, split_indices[i-1], split_indices[i], is_last=False))
-        
-        return story
+    def _get_table_capacities(self, plan: RenderPlan) -> Tuple[float, float]:
+        """取得第一頁與延續頁可容納請款明細表格的高度（pt）
+
+        第一頁表格之前的內容高度與資料無關（基本資訊表格為固定列高），
+        因此每個表單範本以實際的 flowable 量測一次後快取。
+        """
+        capacities = self._table_capacities.get(plan.name)
+        if capacities is None:
+            header_height = self._measure_flowables(self._build_payment_request_header({}, plan))
+            capacities = (FRAME_HEIGHT - header_height, FRAME_HEIGHT - CONTINUATION_TOP_SPACE)
+            self._table_capacities[plan.name] = capacities
+        return capacities
+    
+    def _measure_flowables(self, flowables: list) -> float:
+        """依 platypus Frame 的堆疊規則量測一串 flowable 佔用的高度
+
+        與 Frame.add 相同：頁首第一個元件的 spaceBefore 不計，
+        相鄰元件的 spaceBefore 與前一個元件的 spaceAfter 重疊。
+        """
+        used = 0.0
+        previous_space_after = 0.0
+        for flowable in flowables:
+            space_before = max(flowable.getSpaceBefore() - previous_space_after, 0) if used else 0
+            _, height = flowable.wrap(FRAME_WIDTH, A4[1])
+            previous_space_after = flowable.getSpaceAfter()
+            used += space_before + height + previous_space_after
+        return used
     
-    def _calculate_split_indices(self, data: Dict[str, Any], required_pages: int) -> list:
-        """計算所有分頁點"""
-        details = data.get("payment_details", [])
-        if len(details) == 0:
+    def _calculate_split_indices(self, row_heights: List[float], plan: RenderPlan) -> list:
+        """計算所有分頁點
+
+        Returns:
+            list: 每一頁請款明細的結束索引，最後一個元素為資料列總數
+        """
+        if len(row_heights) == 0:
             return [0]
         
-        # 可用頁面高度（扣除頁面邊距和簽名區域）
-        available_height = A4[1] - 4*cm - 6*cm
-        
-        # 第一頁已用高度：標題 + 基本資訊 + 請款明細標題 + 說明文字
-        first_page_used_height = 28*cm + 2.4*cm + 1.8*cm + 2*cm + 2*cm  # 預估已用高度
-        
-        # 中間頁面可用高度（只有表格）
-        middle_page_available_height = available_height - 4*cm  # 扣除上方4cm間距
+        first_page_capacity, continuation_capacity = self._get_table_capacities(plan)
         
         split_indices = []
-        current_index = 0
-        current_height = 0
-        is_first_page = True
+        page_start = 0
+        capacity = first_page_capacity
+        current_height = DETAIL_HEADER_HEIGHT  # 每頁表格都有表頭
         
-        for i, item in enumerate(details):
-            if hasattr(item, 'execution_content'):
-                content = item.execution_content
-            else:
-                content = item["execution_content"] if isinstance(item, dict) else ""
-            
-            # 計算執行內容的行數（每9個字換一行）
-            content_lines = (len(content) + 8) // 9  # 向上取整
-            max_lines = max(1, content_lines)
-            
-            # 每行至少0.8cm，每多一行增加0.6cm
-            row_height = max(0.8*cm, max_lines * 0.6*cm)
-            
-            # 如果是第一行，還要加上標題行高度
-            if current_index == 0:
-                row_height += 1.2*cm
-            
-            current_height += row_height
-            
-            # 檢查是否需要分頁
-            max_height = first_page_used_height if is_first_page else middle_page_available_height
-            if current_height > max_height:
+        for i, row_height in enumerate(row_heights):
+            # 每頁至少放一列，避免單列超過整頁時產生空白頁
+            if i > page_start and current_height + row_height > capacity + LAYOUT_EPSILON:
                 split_indices.append(i)
-                current_index = i
-                current_height = row_height
-                is_first_page = False
+                page_start = i
+                capacity = continuation_capacity
+                current_height = DETAIL_HEADER_HEIGHT
+            current_height += row_height
         
         # 添加最後一個分頁點
-        split_indices.append(len(details))
+        split_indices.append(len(row_heights))
         
         return split_indices
     
-    def _build_paginated_payment_request(self, data: Dict[str, Any]) -> list:
-        """建立分頁的請款單內容"""
-        story = []
-        
-        # 計算分頁點
-        split_index = self._calculate_split_index(data)
-        
-        # 第一頁：標題、基本資訊、表格前半部分
-        story.extend(self._build_payment_request_page_part1(data, split_index))
-        
-        # 第二頁：表格後半部分、總計、簽名區域
-        story.append(PageBreak())
-        story.extend(self._build_payment_request_page_part2(data, split_index))
-        
-        return story
+    def _iter_payment_request_pages(
+        self,
+        data: Dict[str, Any],
+        rows: List[List[str]],
+        row_heights: List[float],
+        split_indices: list,
+        plan: RenderPlan,
+    ) -> Iterator[list]:
+        """逐頁產生請款單內容，請款明細依分頁點分成多頁"""
+        # 第一頁：標題、基本資訊、表格第一部分
+        first_end = split_indices[0]
+        yield self._build_payment_request_page(data, rows[:first_end], row_heights[:first_end], plan)
+        
+        # 後續頁面：表格延續部分（總計和簽名區域在 add_page_elements 中繪製）
+        for start_index, end_index in zip(split_indices, split_indices[1:]):
+            yield [PageBreak(), *self._build_payment_request_page_continuation(
+                rows[start_index:end_index], row_heights[start_index:end_index], plan
+            )]
     
-    def _build_payment_request_page_continuation(self, data: Dict[str, Any], start_index: int, end_index: int, is_last: bool = False) -> list:
-        """建立請款單延續頁面內容（表格部分、總計、簽名區域）"""
-        story = []
-        
+    def _build_payment_request_page_continuation(
+        self, rows: List[List[str]], row_heights: List[float], plan: RenderPlan
+    ) -> list:
+        """建立請款單延續頁面內容（表格部分，總計和簽名區域在 add_page_elements 中繪製）"""
         # 表格距離上方邊緣4cm
-        story.append(Spacer(1, 4*cm))
-        
-        # 表格部分
-        details = data.get("payment_details", [])
-        page_details = details[start_index:end_index]
-        
-        if page_details:
-            detail_headers = ["專案", "費用類型", "執行時間", "執行內容", "金額", "備註憑證"]
-            detail_data = [detail_headers]
-            
-            for item in page_details:
-                if hasattr(item, 'project_type'):
-                    project_text = self._get_simplified_display(item.project_type)
-                    expense_text = self._get_simplified_display(item.expense_type)
-                    row = [
-                        project_text,
-                        expense_text,
-                        item.execution_time or "",
-                        self._wrap_text(item.execution_content, 9),
-                        f"NT$ {format_currency(float(item.amount))}",
-                        ""
-                    ]
-                else:
-                    project_text = self._get_simplified_display(item["project_type"])
-                    expense_text = self._get_simplified_display(item["expense_type"])
-                    row = [
-                        project_text,
-                        expense_text,
-                        item["execution_time"] if isinstance(item, dict) else "",
-                        self._wrap_text(item["execution_content"], 9),
-                        f"NT$ {format_currency(float(item['amount']))}",
-                        ""
-                    ]
-                detail_data.append(row)
-            
-            # 計算行高
-            row_heights = []
-            for i, row in enumerate(detail_data):
-                if i == 0:
-                    row_heights.append(1.2*cm)
-                else:
-                    max_lines = 1
-                    for cell_text in row:
-                        if cell_text:
-                            lines = cell_text.count('\n') + 1
-                            max_lines = max(max_lines, lines)
-                    row_height = max(0.8*cm, max_lines * 0.6*cm)
-                    row_heights.append(row_height)
-            
-            detail_table = Table(detail_data, colWidths=[3*cm, 3*cm, 2.5*cm, 4*cm, 2.5*cm, 2.5*cm], rowHeights=row_heights)
-            detail_table.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, -1), self.chinese_font),
-                ('FONTSIZE', (0, 0), (-1, -1), 11),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('BOX', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-            story.append(detail_table)
-        
-        # 每頁都添加總計和簽名區域（通過canvas繪製）
-        # 注意：總計和簽名區域會在add_page_elements中自動繪製
-        
-        return story
-    
+        return [Spacer(1, CONTINUATION_TOP_SPACE), self._build_detail_table(rows, row_heights, plan)]
 
+
+@contextmanager
+def _phase(name: str):
+    """計時渲染階段，並在取樣的請求中記錄為 span"""
+    with PDF_PHASE_SECONDS.time(phase=name), start_span(f"pdf.{name}"):
+        yield
+
+
+# 同時渲染數量限制，於第一次使用時在事件迴圈中建立
+_render_semaphore: Optional[asyncio.Semaphore] = None
+
+
+@lru_cache()
+def get_pdf_service() -> PDFService:
+    """取得共用的 PDF 服務實例（字體只在第一次使用時註冊一次）"""
+    return PDFService()
+
+
+async def generate_pdf_async(payment_data: Dict[str, Any], profile: Optional[str] = None) -> io.BytesIO:
+    """在執行緒池中生成 PDF，避免阻塞事件迴圈，並限制同時進行的渲染數量"""
+    return await _render_in_threadpool(get_pdf_service().generate_payment_request_pdf, payment_data, profile)
+
+
+async def generate_pdf_file_async(
+    payment_data: Dict[str, Any], profile: Optional[str] = None
+) -> tempfile.SpooledTemporaryFile:
+    """同 generate_pdf_async，但輸出至暫存檔（大型 PDF 轉存到磁碟），呼叫端負責關閉"""
+    return await _render_in_threadpool(get_pdf_service().generate_payment_request_file, payment_data, profile)
+
+
+async def _render_in_threadpool(render, payment_data: Dict[str, Any], profile: Optional[str]):
+    global _render_semaphore
+    if _render_semaphore is None:
+        _render_semaphore = asyncio.Semaphore(get_settings().pdf_render_concurrency)
     
-    def _calculate_split_index(self, data: Dict[str, Any]) -> int:
-        """計算表格分頁點"""
-        details = data.get("payment_details", [])
-        if len(details) == 0:
-            return 0
-        
-        # 可用頁面高度（扣除頁面邊距和簽名區域）
-        available_height = A4[1] - 4*cm - 6*cm
-        
-        # 第一頁已用高度：標題 + 基本資訊 + 請款明細標題 + 說明文字
-        used_height = 28*cm + 2.4*cm + 1.8*cm + 2*cm + 2*cm  # 預估已用高度
-        
-        # 計算每行的實際高度
-        current_height = 0
-        for i, item in enumerate(details):
-            if hasattr(item, 'execution_content'):
-                content = item.execution_content
-            else:
-                content = item.get("execution_content", "")
-            
-            # 計算執行內容的行數（每9個字換一行）
-            content_lines = (len(content) + 8) // 9  # 向上取整
-            max_lines = max(1, content_lines)
-            
-            # 每行至少0.8cm，每多一行增加0.6cm
-            row_height = max(0.8*cm, max_lines * 0.6*cm)
-            
-            # 如果是第一行，還要加上標題行高度
-            if i == 0:
-                row_height += 1.2*cm
-            
-            current_height += row_height
-            
-            # 如果超過可用高度，返回分頁點
-            if current_height > (available_height - used_height):
-                return i
-        
-        # 如果所有行都能放在第一頁，返回最後一行的索引
-        return len(details)
-    
-    def _build_payment_request_page_part1(self, data: Dict[str, Any], split_index: int) -> list:
-        """建立請款單第一頁內容（標題、基本資訊、表格前半部分）"""
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # 標題
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=28,
-            alignment=TA_CENTER,
-            spaceAfter=15,
-            fontName=self.chinese_font,
-            textColor=colors.black
-        )
-        story.append(Paragraph("請款單", title_style))
-        story.append(Spacer(1, 10))
-        
-        # 基本資訊表格 - 移除建立時間欄位
-        basic_info_data = [
-            ["申請日期", data.get("application_date", "") or "（未填寫）", "請款單位", self._get_requesting_unit_display(data)],
-            ["受款人", data.get("payee", ""), "付款方式", self._get_payment_method_display(data)],
-            ["請款金額", f"NT$ {format_currency(float(data.get('total_amount', 0)))}", "", ""]
-        ]
-        
-        basic_info_table = Table(basic_info_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm], rowHeights=[0.8*cm]*3)
-        basic_info_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), self.chinese_font),
-            ('FONTSIZE', (0, 0), (-1, -1), 12),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTSIZE', (0, 0), (0, -1), 13),
-            ('FONTSIZE', (2, 0), (2, -1), 13),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        story.append(basic_info_table)
-        story.append(Spacer(1, 8))
-        
-        # 請款明細標題
-        heading2_style = ParagraphStyle(
-            'Heading2Chinese',
-            parent=styles['Heading2'],
-            fontName=self.chinese_font,
-            fontSize=18,
-            textColor=colors.black,
-            alignment=TA_LEFT,
-            spaceAfter=8,
-            spaceBefore=5
-        )
-        story.append(Paragraph("請款明細", heading2_style))
-        story.append(Spacer(1, 5))
-        
-        # 說明文字
-        note_style = ParagraphStyle(
-            'NoteStyle',
-            parent=styles['Normal'],
-            fontName=self.chinese_font,
-            fontSize=11,
-            textColor=colors.black,
-            alignment=TA_LEFT,
-            spaceAfter=5,
-            spaceBefore=2
-        )
-        
-        project_note = "專案：A.會議(理監事會議、審查會議、幹事會議等) B.活動(含年會、各項座談會、年度志工激勵活動、各區學生輔導活動等) C.志工培訓(含志工會議) D.學校訪談 E.專案補助 F.其他"
-        story.append(Paragraph(project_note, note_style))
-        
-        expense_note = "費用類型：1.交通費 2.場地租借 3.餐費 4.文宣 5.電話費 6.補助 7.志工津貼 8.設備器材(含軟硬體) 9.雜支"
-        story.append(Paragraph(expense_note, note_style))
-        
-        story.append(Spacer(1, 8))
-        
-        # 表格前半部分（根據分頁點）
-        details = data.get("payment_details", [])
-        first_page_details = details[:split_index]
-        
-        detail_headers = ["專案", "費用類型", "執行時間", "執行內容", "金額", "備註憑證"]
-        detail_data = [detail_headers]
-        
-        for item in first_page_details:
-            if hasattr(item, 'project_type'):
-                project_text = self._get_simplified_display(item.project_type)
-                expense_text = self._get_simplified_display(item.expense_type)
-                row = [
-                    project_text,
-                    expense_text,
-                    item.execution_time or "",
-                    self._wrap_text(item.execution_content, 9),
-                    f"NT$ {format_currency(float(item.amount))}",
-                    ""
-                ]
-            else:
-                project_text = self._get_simplified_display(item["project_type"])
-                expense_text = self._get_simplified_display(item["expense_type"])
-                row = [
-                    project_text,
-                    expense_text,
-                    item.get("execution_time", ""),
-                    self._wrap_text(item["execution_content"], 9),
-                    f"NT$ {format_currency(float(item['amount']))}",
-                    ""
-                ]
-            detail_data.append(row)
-        
-        # 計算行高
-        row_heights = []
-        for i, row in enumerate(detail_data):
-            if i == 0:
-                row_heights.append(1.2*cm)
-            else:
-                max_lines = 1
-                for cell_text in row:
-                    if cell_text:
-                        lines = cell_text.count('\n') + 1
-                        max_lines = max(max_lines, lines)
-                row_height = max(0.8*cm, max_lines * 0.6*cm)
-                row_heights.append(row_height)
-        
-        detail_table = Table(detail_data, colWidths=[3*cm, 3*cm, 2.5*cm, 4*cm, 2.5*cm, 2.5*cm], rowHeights=row_heights)
-        detail_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), self.chinese_font),
-            ('FONTSIZE', (0, 0), (-1, -1), 11),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        story.append(detail_table)
-        
-        return story
-    
- 
\ No newline at end of file
+    PDF_RENDERS_QUEUED.inc()
+    try:
+        with start_span("pdf.queue"):
+            await _render_semaphore.acquire()
+    finally:
+        PDF_RENDERS_QUEUED.dec()
+    try:
+        return await run_in_threadpool(render, payment_data, profile=profile)
+    finally:
+        _render_semaphore.release()
+
+
+def warm_up() -> None:
+    """預先載入 ReportLab、註冊字體並渲染一份範例請款單，讓第一個下載請求不必負擔冷啟動成本"""
+    sample_data = {
+        "id": "warm-up",
+        "application_date": "113.01.01",
+        "payee": "暖機",
+        "payment_method": PaymentMethod.CASH,
+        "payment_method_other": None,
+        "requesting_unit": RequestingUnit.GUIDANCE,
+        "requesting_unit_other": None,
+        "total_amount": Decimal("0"),
+        "payment_details": [
+            {
+                "project_type": ProjectType.MEETING,
+                "expense_type": ExpenseType.TRANSPORTATION,
+                "execution_time": "",
+                "execution_content": "暖機",
+                "amount": Decimal("0"),
+            }
+        ],
+        "bank_book_image": None,
+    }
+    get_pdf_service().generate_payment_request_pdf(sample_data)
@@ -0,0 +1,225 @@
+"""建立請款單後的預先渲染.
+
+使用者建立請款單後幾乎都會立刻下載 PDF。建立成功時在背景以低優先順序先渲染
+一份預設輸出設定檔的 PDF，放入以位元組數限制大小的渲染結果儲存區；下載時
+已完成的直接回傳，仍在渲染中的則等待同一份結果，不會重複渲染。
+
+預先渲染只是猜測，要盡量少與實際的請求搶資源：
+
+- 使用獨立的單一背景執行緒，不佔用下載渲染的名額；同一時間只有一個預先渲染，
+  已有渲染在進行時新的請求直接略過，不排隊（排在後面的渲染要等很久才會輪到，
+  下載反而要等待它）
+- 下載渲染的名額已滿，或行程最近的 CPU 使用率超過 PDF_PRERENDER_CPU_BUDGET
+  時直接略過，等使用者下載時再渲染
+- 下載時預先渲染尚未開始執行則取消，直接在下載請求中渲染
+
+背景執行緒與請求處理共用 GIL，渲染期間仍會拖慢同一行程的其他請求，因此 CPU
+使用率以單一核心為基準計算。
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from ..core.config import get_settings
+from ..core.metrics import PDF_PRERENDERS
+from ..core.tracing import start_span
+
+# (請款單編號, 版本, 輸出設定檔)
+RenderKey = Tuple[str, int, str]
+
+
+class CpuBudget:
+    """以行程 CPU 時間估計最近的 CPU 使用率（佔單一核心的比例）
+
+    Python 程式碼受 GIL 限制，行程很少能用滿一個以上的核心；若除以核心數，
+    多核心主機上的使用率幾乎不會超過預算。
+    """
+
+    def __init__(self, window: float = 1.0, min_interval: float = 0.05):
+        self.window = window
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_wall = time.monotonic()
+        self._last_cpu = time.process_time()
+        self._usage = 0.0
+
+    def usage(self) -> float:
+        """自上次重設起算的 CPU 使用率；間隔不足 min_interval 時沿用上次的值，超過 window 時重設起點
+
+        每次都重新計算，不沿用整個 window 前的舊值：閒置一段時間後突然湧入的
+        請求在數十毫秒內就會反映出來。
+        """
+        with self._lock:
+            wall, cpu = time.monotonic(), time.process_time()
+            elapsed = wall - self._last_wall
+            if elapsed >= self.min_interval:
+                self._usage = (cpu - self._last_cpu) / elapsed
+            if elapsed >= self.window:
+                self._last_wall, self._last_cpu = wall, cpu
+            return self._usage
+
+    def allows(self, budget: float) -> bool:
+        return self.usage() < budget
+
+
+class RenderedPDFStore:
+    """預先渲染的 PDF，依總位元組數以 LRU 淘汰；只在事件迴圈中使用"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[RenderKey, bytes]" = OrderedDict()
+        self._size = 0
+        self._pending: Dict[RenderKey, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: RenderKey) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: RenderKey, data: bytes) -> bool:
+        """存入渲染結果；單一檔案超過容量的四分之一時不保留"""
+        if len(data) > self.max_bytes // 4:
+            return False
+        self.discard(key)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+        return True
+
+    def discard(self, key: RenderKey) -> None:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self._size -= len(data)
+
+    def discard_request(self, request_id: str) -> None:
+        """請款單更新後，舊版本的渲染結果不會再被使用"""
+        for key in [key for key in self._entries if key[0] == request_id]:
+            self.discard(key)
+
+    def pending(self, key: RenderKey) -> Optional[asyncio.Future]:
+        return self._pending.get(key)
+
+    def begin(self, key: RenderKey) -> asyncio.Future:
+        """登記進行中的渲染，完成時以 finish 發布結果"""
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        return future
+
+    def finish(self, key: RenderKey, data: Optional[bytes]) -> None:
+        future = self._pending.pop(key, None)
+        if data is not None:
+            self.put(key, data)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    async def wait(self, key: RenderKey) -> Optional[bytes]:
+        """取得已完成的結果，或等待進行中的預先渲染；兩者皆無時回傳 None"""
+        data = self.get(key)
+        if data is not None:
+            return data
+        future = self._pending.get(key)
+        if future is None:
+            return None
+        # 下載請求中斷時不取消共用的 future
+        return await asyncio.shield(future)
+
+
+class Prerenderer:
+    """排程低優先順序的背景渲染"""
+
+    def __init__(self, store: RenderedPDFStore):
+        self.store = store
+        self.cpu_budget = CpuBudget()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 目前唯一的預先渲染（排程或執行中）
+        self._job: Optional[concurrent.futures.Future] = None
+        self._job_key: Optional[RenderKey] = None
+
+    def schedule(self, payment_data: Dict[str, Any], profile: str) -> bool:
+        """在背景渲染一份 PDF，回傳是否已排程"""
+        settings = get_settings()
+        if not settings.pdf_prerender:
+            return False
+        key: RenderKey = (payment_data["id"], payment_data.get("version", 1), profile)
+        if self.store.get(key) is not None or self.store.pending(key) is not None:
+            return False
+        busy = self._job is not None and not self._job.done()
+        if busy or not self._has_capacity(settings.pdf_prerender_cpu_budget):
+            PDF_PRERENDERS.inc(result="skipped")
+            return False
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-prerender")
+        self.store.begin(key)
+        # 在建立請求的 context 中執行，背景渲染的 span 記錄在同一個 trace 之下
+        context = contextvars.copy_context()
+        self._job = self._executor.submit(context.run, self._render, payment_data, profile)
+        self._job_key = key
+        job = asyncio.wrap_future(self._job)
+        job.add_done_callback(lambda done: self._finish(key, done))
+        PDF_PRERENDERS.inc(result="scheduled")
+        return True
+
+    async def wait(self, key: RenderKey) -> Optional[bytes]:
+        """取得預先渲染的結果；尚未開始執行的預先渲染直接取消，回傳 None 由呼叫端自行渲染"""
+        if self._job_key == key and self._job is not None and self._job.cancel():
+            return None
+        return await self.store.wait(key)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._job = self._job_key = None
+
+    def _has_capacity(self, budget: float) -> bool:
+        # 不在這裡載入 pdf_service（ReportLab）：尚未載入時也還沒有任何下載在渲染
+        pdf_service = sys.modules.get(f"{__package__}.pdf_service")
+        semaphore = getattr(pdf_service, "_render_semaphore", None)
+        if semaphore is not None and semaphore.locked():
+            return False
+        return self.cpu_budget.allows(budget)
+
+    def _render(self, payment_data: Dict[str, Any], profile: str) -> Optional[bytes]:
+        # 排隊期間若已有下載在渲染或 CPU 忙碌，放棄這次猜測
+        if not self._has_capacity(get_settings().pdf_prerender_cpu_budget):
+            return None
+        from .pdf_service import get_pdf_service
+
+        with start_span("pdf.prerender", profile=profile):
+            return get_pdf_service().generate_payment_request_pdf(payment_data, profile=profile).getvalue()
+
+    def _finish(self, key: RenderKey, job: asyncio.Future) -> None:
+        data = None
+        if job.cancelled():
+            result = "cancelled"
+        elif job.exception() is not None:
+            result = "failed"
+            logger.warning("預先渲染失敗", request_id=key[0], error=str(job.exception()))
+        else:
+            data = job.result()
+            result = "skipped" if data is None else "completed"
+        PDF_PRERENDERS.inc(result=result)
+        self.store.finish(key, data)
+
+
+rendered_pdfs = RenderedPDFStore(get_settings().pdf_prerender_cache_bytes)
+prerenderer = Prerenderer(rendered_pdfs)
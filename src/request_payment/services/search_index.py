@@ -0,0 +1,256 @@
+"""請款單全文檢索.
+
+以反向索引搜尋受款人、執行內容、備註憑證與「其他」說明欄位。中文不經斷詞，
+直接切成相鄰兩字的 bigram（「交通費」→「交通」「通費」），英數字以整個字
+為單位，因此不需要詞典也能比對繁體中文。查詢字串以相同方式切分，結果必須
+包含所有查詢 token，依 token 的稀有程度（idf）與所在欄位的權重排序。
+
+每個 token 的 posting list 是依內部文件編號排序的 array（文件編號 + 權重），
+建立請款單時直接附加在尾端；更新時依舊版本的 token 刪除其 posting，再以新
+編號加入。
+
+查詢只在持有鎖時複製相關 token 的 posting array（memcpy，遠比計分便宜），
+取交集與計分都在鎖外進行，因此大範圍的查詢不會讓建立、更新請款單等待整個
+計分過程。
+"""
+
+import heapq
+import math
+import operator
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import repeat
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# 中日韓文字（含相容字與注音、假名）連續出現的區段切成 bigram，其餘以英數字詞為單位
+_CJK_RANGES = "぀-ヿ㄀-ㄯ㐀-䶿一-鿿豈-﫿"
+_TOKEN_RUN = re.compile(f"[{_CJK_RANGES}]+|[0-9a-z]+")
+_CJK_RUN = re.compile(f"[{_CJK_RANGES}]")
+
+# 欄位權重：受款人最能識別一張請款單
+FIELD_WEIGHTS = {
+    "payee": 4,
+    "payment_method_other": 2,
+    "requesting_unit_other": 2,
+    "execution_content": 1,
+    "receipt_note": 1,
+}
+_MAX_WEIGHT = 0xFF
+# 權重對分數的貢獻（log 飽和，同一個詞重複出現不會無限加分）
+_WEIGHT_SCORES = [math.log1p(weight) for weight in range(_MAX_WEIGHT + 1)]
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """切分為檢索 token：中文 bigram（單獨一個字時保留單字）與小寫英數字詞"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_RUN.finditer(text):
+        run = match.group()
+        if _CJK_RUN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+def document_tokens(record: Dict[str, Any]) -> Dict[str, int]:
+    """請款單的 token → 權重（各欄位出現次數乘上欄位權重）"""
+    weights: Dict[str, int] = defaultdict(int)
+
+    def add(field: str, text: Optional[str]) -> None:
+        for token in tokenize(text):
+            weights[token] += FIELD_WEIGHTS[field]
+
+    add("payee", record.get("payee"))
+    add("payment_method_other", record.get("payment_method_other"))
+    add("requesting_unit_other", record.get("requesting_unit_other"))
+    for item in record.get("payment_details") or []:
+        add("execution_content", _field(item, "execution_content"))
+        add("receipt_note", _field(item, "receipt_note"))
+    return {token: min(weight, _MAX_WEIGHT) for token, weight in weights.items()}
+
+
+class _Postings:
+    """單一 token 的 posting list：依文件編號排序"""
+
+    __slots__ = ("docs", "weights")
+
+    def __init__(self):
+        self.docs = array("I")
+        self.weights = array("B")
+
+
+# 查詢時複製的 posting list：(文件編號, 權重)
+_Snapshot = Tuple[array, array]
+
+
+class SearchIndex:
+    """請款單的反向索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, _Postings] = {}
+        # 單一中文字 → 包含此字的 bigram，讓一個字的查詢也能比對
+        self._char_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self._doc_keys: List[Optional[str]] = []
+        self._doc_numbers: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    def add(self, key: str, record: Dict[str, Any]) -> None:
+        """加入一張請款單"""
+        tokens = document_tokens(record)
+        with self._lock:
+            self._add(key, tokens)
+
+    def replace(self, key: str, old: Dict[str, Any], new: Dict[str, Any]) -> None:
+        """請款單更新後，以新版本取代舊版本（old 為先前加入的同一份資料）"""
+        old_tokens, new_tokens = document_tokens(old), document_tokens(new)
+        with self._lock:
+            self._remove(key, old_tokens)
+            self._add(key, new_tokens)
+
+    def remove(self, key: str, record: Dict[str, Any]) -> None:
+        """移除一張請款單（record 為先前加入的同一份資料）"""
+        tokens = document_tokens(record)
+        with self._lock:
+            self._remove(key, tokens)
+
+    def rebuild(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """清空後重新建立索引，回傳加入的請款單張數"""
+        with self._lock:
+            self._postings = {}
+            self._char_tokens = defaultdict(set)
+            self._doc_keys = []
+            self._doc_numbers = {}
+        count = 0
+        for key, record in records:
+            self.add(key, record)
+            count += 1
+        return count
+
+    def _add(self, key: str, tokens: Dict[str, int]) -> None:
+        if key in self._doc_numbers:
+            raise ValueError(f"請款單已在索引中: {key}")
+        number = len(self._doc_keys)
+        self._doc_keys.append(key)
+        self._doc_numbers[key] = number
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = _Postings()
+                if len(token) == 2 and _CJK_RUN.match(token):
+                    self._char_tokens[token[0]].add(token)
+                    self._char_tokens[token[1]].add(token)
+            # 新文件的編號最大，附加在尾端即維持排序
+            postings.docs.append(number)
+            postings.weights.append(weight)
+
+    def _remove(self, key: str, tokens: Dict[str, int]) -> None:
+        number = self._doc_numbers.pop(key, None)
+        if number is None:
+            return
+        self._doc_keys[number] = None
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            position = bisect_left(postings.docs, number)
+            if position < len(postings.docs) and postings.docs[position] == number:
+                del postings.docs[position]
+                del postings.weights[position]
+            if not postings.docs:
+                del self._postings[token]
+                if len(token) == 2:
+                    for char in token:
+                        self._char_tokens[char].discard(token)
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[int, List[Tuple[str, float]]]:
+        """搜尋包含所有查詢 token 的請款單
+
+        Returns:
+            Tuple[int, List[Tuple[str, float]]]: 符合的總數與該頁的 (請款單編號, 分數)，
+            分數相同時較新的請款單在前
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, []
+
+        with self._lock:
+            total_docs = max(len(self._doc_numbers), 1)
+            # 每個查詢 token 對應一組 posting list（單一中文字對應所有包含它的 bigram）
+            groups = [self._snapshot(token) for token in tokens]
+        if any(not group for group in groups):
+            return 0, []
+
+        def group_size(group: List[_Snapshot]) -> int:
+            return sum(len(docs) for docs, _ in group)
+
+        groups.sort(key=group_size)
+        candidates = self._union_docs(groups[0])
+        for group in groups[1:]:
+            if len(group) == 1:
+                candidates.intersection_update(group[0][0])
+            else:
+                candidates &= self._union_docs(group)
+            if not candidates:
+                return 0, []
+
+        # 以 C 實作的 map / zip 計算分數，避免對每個候選逐一執行 Python 程式碼
+        numbers = list(candidates)
+        scores: Optional[List[float]] = None
+        for group in groups:
+            idf = math.log(1 + total_docs / group_size(group))
+            weighted = map(operator.mul, self._group_scores(group, numbers), repeat(idf))
+            scores = list(weighted) if scores is None else list(map(operator.add, scores, weighted))
+
+        # 只需排序到要回傳的那一頁；分數相同時編號大（較新）的在前
+        ranked = heapq.nlargest(offset + limit, zip(scores, numbers))
+        with self._lock:
+            keys = [self._doc_keys[number] for _, number in ranked[offset:]]
+        # 計分期間被更新或刪除的請款單已不在快照之後的索引中，略過
+        page = [(key, round(score, 4)) for key, (score, _) in zip(keys, ranked[offset:]) if key is not None]
+        return len(numbers), page
+
+    def _snapshot(self, token: str) -> List[_Snapshot]:
+        """複製 token 的 posting array，之後的附加與刪除不影響這次查詢（須持有鎖）"""
+        postings = self._postings.get(token)
+        group = [postings] if postings is not None else []
+        if len(token) == 1 and _CJK_RUN.match(token):
+            group.extend(self._postings[bigram] for bigram in self._char_tokens.get(token, ()))
+        return [(postings.docs[:], postings.weights[:]) for postings in group]
+
+    @staticmethod
+    def _union_docs(group: List[_Snapshot]) -> Set[int]:
+        union: Set[int] = set()
+        for docs, _ in group:
+            union.update(docs)
+        return union
+
+    @staticmethod
+    def _group_scores(group: List[_Snapshot], numbers: List[int]) -> List[float]:
+        """候選文件在一組 posting list 中的權重分數（候選一定出現在其中）"""
+        if len(group) == 1 and len(group[0][0]) > 8 * len(numbers):
+            # 候選遠少於 posting 數量時以二分搜尋取得權重
+            docs, weights = group[0]
+            return [_WEIGHT_SCORES[weights[bisect_left(docs, number)]] for number in numbers]
+        # 單一中文字查詢對應多個 bigram，同一文件出現在多個 bigram 時取最後一個的權重
+        lookup: Dict[int, float] = {}
+        for docs, weights in group:
+            lookup.update(zip(docs, map(_WEIGHT_SCORES.__getitem__, weights)))
+        return list(map(lookup.__getitem__, numbers))
+
+
+# 全域索引，與請款單儲存一同存在於行程記憶體中
+search_index = SearchIndex()
@@ -0,0 +1,194 @@
+"""請款支出統計.
+
+財務需要依請款單位、專案類型、費用類型與月份統計的支出金額。統計值在建立
+與更新請款單時逐筆累加（Decimal 精確運算），查詢只需走訪統計表，與請款單
+數量無關：
+
+- 明細表：(請款單位, 專案類型, 費用類型, 月份) → 金額、明細筆數
+- 單據表：(請款單位, 月份) → 請款單張數（每張請款單只屬於一個單位與月份）
+
+統計表的大小只取決於枚舉值數量與月份數。資料有疑慮時可用 rebuild 從
+請款單儲存重新計算。
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 可分組與篩選的維度，順序即明細表鍵值的順序
+DIMENSIONS = ("requesting_unit", "project_type", "expense_type", "month")
+# 每張請款單只有一個值的維度，只依這些維度篩選時可以計算請款單張數
+FORM_DIMENSIONS = ("requesting_unit", "month")
+
+_ROC_DATE = re.compile(r"^(\d{1,3})\.(\d{1,2})\.(\d{1,2})$")
+
+_Cell = Tuple[str, str, str, str]
+
+
+@dataclass
+class _Bucket:
+    amount: Decimal
+    item_count: int
+
+
+def _value(value: Any) -> str:
+    return str(value.value) if hasattr(value, "value") else str(value or "")
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name)
+
+
+def record_month(record: Dict[str, Any]) -> str:
+    """請款單的統計月份（西元 YYYY-MM）
+
+    以申請日期（民國年）為準；未填寫或日期不合理時使用建立時間。
+    """
+    match = _ROC_DATE.match(record.get("application_date") or "")
+    if match:
+        year, month = int(match.group(1)) + 1911, int(match.group(2))
+        if 1 <= month <= 12:
+            return f"{year:04d}-{month:02d}"
+    created_at = record.get("created_at") or datetime.now()
+    return created_at.strftime("%Y-%m")
+
+
+def _contributions(record: Dict[str, Any]) -> Tuple[Tuple[str, str], List[Tuple[_Cell, Decimal]]]:
+    """請款單對統計表的貢獻：(單位, 月份) 與每筆明細的 (明細表鍵值, 金額)"""
+    unit = _value(record.get("requesting_unit"))
+    month = record_month(record)
+    cells = [
+        (
+            (unit, _value(_field(item, "project_type")), _value(_field(item, "expense_type")), month),
+            Decimal(_field(item, "amount")),
+        )
+        for item in record.get("payment_details") or []
+    ]
+    return (unit, month), cells
+
+
+class SpendingAggregates:
+    """逐筆維護的支出統計表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells: Dict[_Cell, _Bucket] = {}
+        self._forms: Dict[Tuple[str, str], int] = {}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """加入一張請款單"""
+        contributions = _contributions(record)
+        with self._lock:
+            self._apply(self._cells, self._forms, contributions, 1)
+
+    def remove(self, record: Dict[str, Any]) -> None:
+        """移除一張請款單（先前以 add 加入的同一份資料）"""
+        contributions = _contributions(record)
+        with self._lock:
+            self._apply(self._cells, self._forms, contributions, -1)
+
+    def replace(self, old: Dict[str, Any], new: Dict[str, Any]) -> None:
+        """請款單更新後，以新版本取代舊版本的貢獻"""
+        old_contributions, new_contributions = _contributions(old), _contributions(new)
+        with self._lock:
+            self._apply(self._cells, self._forms, old_contributions, -1)
+            self._apply(self._cells, self._forms, new_contributions, 1)
+
+    def rebuild(self, records: Iterable[Dict[str, Any]]) -> int:
+        """從請款單重新計算整個統計表，回傳處理的請款單張數"""
+        cells: Dict[_Cell, _Bucket] = {}
+        forms: Dict[Tuple[str, str], int] = {}
+        count = 0
+        for record in records:
+            self._apply(cells, forms, _contributions(record), 1)
+            count += 1
+        with self._lock:
+            self._cells, self._forms = cells, forms
+        return count
+
+    def query(
+        self,
+        group_by: Sequence[str] = (),
+        filters: Optional[Dict[str, str]] = None,
+        month_from: Optional[str] = None,
+        month_to: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """依指定維度分組統計
+
+        Args:
+            group_by: 分組維度（DIMENSIONS 的子集合），空值只回傳總計
+            filters: 維度 → 值的篩選條件
+            month_from: 起始月份（YYYY-MM，含）
+            month_to: 結束月份（YYYY-MM，含）
+
+        Returns:
+            Dict[str, Any]: 總金額、明細筆數、請款單張數（依專案或費用類型篩選時
+            無法計算，為 None）與各分組
+        """
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        unknown = [name for name in [*group_by, *filters] if name not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"不支援的統計維度: {', '.join(unknown)}")
+        positions = [DIMENSIONS.index(name) for name in group_by]
+        conditions = [(DIMENSIONS.index(name), value) for name, value in filters.items()]
+
+        def selected(key: tuple, dimensions: Sequence[str]) -> bool:
+            values = dict(zip(dimensions, key))
+            if any(values.get(DIMENSIONS[index], value) != value for index, value in conditions):
+                return False
+            month = values["month"]
+            return (month_from is None or month >= month_from) and (month_to is None or month <= month_to)
+
+        groups: Dict[Tuple[str, ...], _Bucket] = {}
+        total = _Bucket(Decimal("0"), 0)
+        with self._lock:
+            for cell, bucket in self._cells.items():
+                if not selected(cell, DIMENSIONS):
+                    continue
+                group = groups.setdefault(tuple(cell[index] for index in positions), _Bucket(Decimal("0"), 0))
+                group.amount += bucket.amount
+                group.item_count += bucket.item_count
+                total.amount += bucket.amount
+                total.item_count += bucket.item_count
+
+            form_count = None
+            if all(name in FORM_DIMENSIONS for name in filters):
+                form_count = sum(count for key, count in self._forms.items() if selected(key, FORM_DIMENSIONS))
+
+        return {
+            "group_by": list(group_by),
+            "filters": filters,
+            "total_amount": total.amount,
+            "item_count": total.item_count,
+            "form_count": form_count,
+            "groups": [
+                {"key": dict(zip(group_by, key)), "total_amount": bucket.amount, "item_count": bucket.item_count}
+                for key, bucket in sorted(groups.items())
+            ],
+        }
+
+    @staticmethod
+    def _apply(
+        cells: Dict[_Cell, _Bucket],
+        forms: Dict[Tuple[str, str], int],
+        contributions: Tuple[Tuple[str, str], List[Tuple[_Cell, Decimal]]],
+        sign: int,
+    ) -> None:
+        form_key, items = contributions
+        forms[form_key] = forms.get(form_key, 0) + sign
+        if forms[form_key] <= 0:
+            del forms[form_key]
+        for cell, amount in items:
+            bucket = cells.setdefault(cell, _Bucket(Decimal("0"), 0))
+            bucket.amount += sign * amount
+            bucket.item_count += sign
+            # 移除後沒有明細的格子刪除，統計表不會因更新而無限成長
+            if bucket.item_count <= 0:
+                del cells[cell]
+
+
+# 全域統計表，與請款單儲存一同存在於行程記憶體中
+spending_aggregates = SpendingAggregates()
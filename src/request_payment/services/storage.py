@@ -0,0 +1,465 @@
+"""檔案儲存後端.
+
+FileManager 透過 StorageBackend 讀寫檔案，依 STORAGE_BACKEND 選擇：
+
+- local：寫入本機目錄（預設，單一節點部署）
+- s3：S3 相容的物件儲存（AWS S3、MinIO 等），多個副本共用同一份上傳檔案，
+  API 層可以水平擴展。以 httpx 實作 SigV4 簽章，不需要額外安裝 SDK；
+  連線由共用的 AsyncClient 連線池重用，大檔案以 multipart upload 分段串流
+  上傳，並支援以 Range 讀取部分內容。
+"""
+
+import datetime as dt
+import hashlib
+import hmac
+import os
+import uuid
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+import httpx
+from loguru import logger
+
+from ..core.config import Settings
+from ..core.exceptions import StorageException
+
+# S3 multipart upload 除了最後一段，每段至少 5MB
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+_EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    """儲存物件的中繼資料"""
+    key: str
+    size: int
+    modified_at: dt.datetime
+    created_at: Optional[dt.datetime] = None
+
+
+class StorageBackend(ABC):
+    """檔案儲存後端介面，key 為相對於儲存根目錄的路徑"""
+
+    name: str
+
+    async def ensure_ready(self) -> None:
+        """啟動時準備儲存空間（建立目錄或檢查 bucket）"""
+
+    async def close(self) -> None:
+        """釋放連線等資源"""
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> int:
+        """寫入整個物件，回傳位元組數"""
+        async def single_chunk() -> AsyncIterator[bytes]:
+            yield data
+
+        return await self.put_stream(key, single_chunk(), content_type)
+
+    @abstractmethod
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> int:
+        """以串流寫入物件（不需要先把整個檔案讀進記憶體），回傳位元組數"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """讀取整個物件，不存在時回傳 None"""
+
+    @abstractmethod
+    async def get_range(self, key: str, start: int, end: int) -> Optional[bytes]:
+        """讀取包含頭尾的 [start, end] 範圍，不存在時回傳 None"""
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        """取得物件中繼資料，不存在時回傳 None"""
+
+    @abstractmethod
+    async def list(self, prefix: str = "") -> List[ObjectInfo]:
+        """列出指定前綴的物件"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """刪除物件，不存在時回傳 False"""
+
+    @abstractmethod
+    def location(self, key: str) -> str:
+        """物件的位置描述（本機路徑或 s3:// URI），用於回應與日誌"""
+
+
+class LocalStorage(StorageBackend):
+    """本機目錄儲存"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    async def ensure_ready(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> int:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先寫入暫存檔再改名，讀取端不會看到寫到一半的檔案
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        size = 0
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+            await aiofiles.os.replace(temp_path, path)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+        return size
+
+    async def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        async with aiofiles.open(path, "rb") as f:
+            return await f.read()
+
+    async def get_range(self, key: str, start: int, end: int) -> Optional[bytes]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(start)
+            return await f.read(end - start + 1)
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        return self._info(key, path.stat())
+
+    async def list(self, prefix: str = "") -> List[ObjectInfo]:
+        if not self.root.is_dir():
+            return []
+        objects = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.startswith(prefix) and not entry.name.startswith("."):
+                objects.append(self._info(entry.name, entry.stat()))
+        return objects
+
+    async def delete(self, key: str) -> bool:
+        path = self._path(key)
+        if not path.is_file():
+            return False
+        try:
+            path.unlink()
+            return True
+        except OSError:
+            return False
+
+    def location(self, key: str) -> str:
+        return os.path.join(str(self.root), key)
+
+    def _path(self, key: str) -> Path:
+        relative = Path(key)
+        if relative.is_absolute() or ".." in relative.parts:
+            raise ValueError(f"不合法的檔案路徑: {key}")
+        return self.root / relative
+
+    @staticmethod
+    def _info(key: str, stat: os.stat_result) -> ObjectInfo:
+        return ObjectInfo(
+            key=key,
+            size=stat.st_size,
+            modified_at=dt.datetime.fromtimestamp(stat.st_mtime),
+            created_at=dt.datetime.fromtimestamp(stat.st_ctime),
+        )
+
+
+class S3Storage(StorageBackend):
+    """S3 相容的物件儲存（path-style 位址，適用 AWS S3 與 MinIO）"""
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        access_key_id: str,
+        secret_access_key: str,
+        region: str = "us-east-1",
+        endpoint_url: Optional[str] = None,
+        prefix: str = "",
+        part_size: int = 8 * 1024 * 1024,
+        max_connections: int = 20,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if not bucket:
+            raise ValueError("S3 儲存需要設定 S3_BUCKET")
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = (endpoint_url or f"https://s3.{region}.amazonaws.com").rstrip("/")
+        self.prefix = prefix
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self._access_key_id = access_key_id
+        self._secret_access_key = secret_access_key
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = timeout
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def ensure_ready(self) -> None:
+        """確認 bucket 存在，不存在時建立（方便搭配本機 MinIO 開發）"""
+        response = await self._request("HEAD", "")
+        if response.status_code == 404:
+            logger.info("建立 S3 bucket", bucket=self.bucket)
+            await self._request("PUT", "", expected=(200,))
+        elif response.status_code != 200:
+            raise StorageException("無法存取 S3 bucket", {"bucket": self.bucket, "status": response.status_code})
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> int:
+        """小於一段的物件以單一 PUT 上傳，否則每累積 part_size 就上傳一段"""
+        headers = {"Content-Type": content_type} if content_type else {}
+        buffer = bytearray()
+        upload_id: Optional[str] = None
+        parts: List[Tuple[int, str]] = []
+        size = 0
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        upload_id = await self._create_multipart_upload(key, headers)
+                    part = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, part))
+
+            if upload_id is None:
+                await self._request("PUT", key, content=bytes(buffer), headers=headers, expected=(200,))
+                return size
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            await self._complete_multipart_upload(key, upload_id, parts)
+        except BaseException:
+            if upload_id is not None:
+                await self._abort_multipart_upload(key, upload_id)
+            raise
+        return size
+
+    async def get(self, key: str) -> Optional[bytes]:
+        response = await self._request("GET", key, expected=(200, 404))
+        return None if response.status_code == 404 else response.content
+
+    async def get_range(self, key: str, start: int, end: int) -> Optional[bytes]:
+        response = await self._request("GET", key, headers={"Range": f"bytes={start}-{end}"}, expected=(200, 206, 404, 416))
+        if response.status_code == 404:
+            return None
+        if response.status_code == 416:
+            return b""
+        if response.status_code == 200:
+            # 不支援 Range 的相容服務回傳整個物件
+            return response.content[start:end + 1]
+        return response.content
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        response = await self._request("HEAD", key, expected=(200, 404))
+        if response.status_code == 404:
+            return None
+        return ObjectInfo(
+            key=key,
+            size=int(response.headers.get("Content-Length", 0)),
+            modified_at=_parse_http_date(response.headers.get("Last-Modified")),
+        )
+
+    async def list(self, prefix: str = "") -> List[ObjectInfo]:
+        objects = []
+        params = {"list-type": "2", "prefix": self.prefix + prefix}
+        while True:
+            response = await self._request("GET", "", params=params, expected=(200,))
+            root = _parse_xml(response.content)
+            for item in root.iter("Contents"):
+                key = item.findtext("Key", "")
+                objects.append(ObjectInfo(
+                    key=key[len(self.prefix):],
+                    size=int(item.findtext("Size", "0")),
+                    modified_at=dt.datetime.fromisoformat(
+                        item.findtext("LastModified", "").replace("Z", "+00:00")
+                    ),
+                ))
+            token = root.findtext("NextContinuationToken")
+            if root.findtext("IsTruncated") != "true" or not token:
+                return objects
+            params["continuation-token"] = token
+
+    async def delete(self, key: str) -> bool:
+        # S3 刪除不存在的物件也回傳 204，先確認是否存在以維持與本機儲存相同的語意
+        if await self.stat(key) is None:
+            return False
+        await self._request("DELETE", key, expected=(204, 200))
+        return True
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    async def _create_multipart_upload(self, key: str, headers: Dict[str, str]) -> str:
+        response = await self._request("POST", key, params={"uploads": ""}, headers=headers, expected=(200,))
+        return _parse_xml(response.content).findtext("UploadId")
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> Tuple[int, str]:
+        response = await self._request(
+            "PUT", key, params={"partNumber": str(number), "uploadId": upload_id}, content=data, expected=(200,)
+        )
+        return number, response.headers["ETag"]
+
+    async def _complete_multipart_upload(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        body = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+        )
+        payload = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode()
+        response = await self._request("POST", key, params={"uploadId": upload_id}, content=payload, expected=(200,))
+        # CompleteMultipartUpload 可能以 200 回傳錯誤內容
+        if b"<Error>" in response.content:
+            raise StorageException("S3 multipart upload 失敗", {"key": key, "response": response.text[:200]})
+
+    async def _abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        try:
+            await self._request("DELETE", key, params={"uploadId": upload_id})
+        except Exception as e:
+            logger.warning("取消 S3 multipart upload 失敗", key=key, error=str(e))
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout, transport=self._transport)
+        return self._client
+
+    async def _request(
+        self,
+        method: str,
+        key: str,
+        params: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        content: bytes = b"",
+        expected: Optional[Tuple[int, ...]] = None,
+    ) -> httpx.Response:
+        """送出簽章後的請求；指定 expected 時狀態碼不在其中則拋出 StorageException"""
+        path = f"/{self.bucket}"
+        if key:
+            path += "/" + quote(self.prefix + key, safe="/-_.~")
+        url = httpx.URL(self.endpoint_url + path, params=params)
+        payload_hash = hashlib.sha256(content).hexdigest() if content else _EMPTY_PAYLOAD_HASH
+        signed_headers = sign_v4(
+            method,
+            url,
+            dict(headers or {}),
+            payload_hash,
+            self.region,
+            self._access_key_id,
+            self._secret_access_key,
+        )
+        response = await self._get_client().request(method, url, headers=signed_headers, content=content)
+        if expected is not None and response.status_code not in expected:
+            raise StorageException(
+                "S3 請求失敗",
+                {"method": method, "key": key, "status": response.status_code, "response": response.text[:200]},
+            )
+        return response
+
+
+def sign_v4(
+    method: str,
+    url: httpx.URL,
+    headers: Dict[str, str],
+    payload_hash: str,
+    region: str,
+    access_key_id: str,
+    secret_access_key: str,
+    now: Optional[dt.datetime] = None,
+    service: str = "s3",
+) -> Dict[str, str]:
+    """以 AWS Signature Version 4 簽章，回傳加上 Authorization 等標頭的新 dict
+
+    簽入 host、range 與所有 x-amz-* 標頭。
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+    signed = dict(headers)
+    signed["x-amz-date"] = amz_date
+    signed["x-amz-content-sha256"] = payload_hash
+
+    host = url.host if url.port is None else f"{url.host}:{url.port}"
+    canonical = {"host": host}
+    for name, value in signed.items():
+        lowered = name.lower()
+        if lowered.startswith("x-amz-") or lowered == "range":
+            canonical[lowered] = " ".join(str(value).split())
+    signed_header_names = ";".join(sorted(canonical))
+    canonical_headers = "".join(f"{name}:{canonical[name]}\n" for name in sorted(canonical))
+    canonical_query = "&".join(
+        f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}" for name, value in sorted(url.params.multi_items())
+    )
+    canonical_request = "\n".join([
+        method,
+        url.raw_path.split(b"?", 1)[0].decode("ascii") or "/",
+        canonical_query,
+        canonical_headers,
+        signed_header_names,
+        payload_hash,
+    ])
+
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    key = ("AWS4" + secret_access_key).encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    signed["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key_id}/{scope}, "
+        f"SignedHeaders={signed_header_names}, Signature={signature}"
+    )
+    return signed
+
+
+def _parse_xml(content: bytes) -> ET.Element:
+    """解析 S3 回應並去掉命名空間（部分相容服務的回應不帶命名空間）"""
+    root = ET.fromstring(content)
+    for element in root.iter():
+        element.tag = element.tag.rpartition("}")[2]
+    return root
+
+
+def _parse_http_date(value: Optional[str]) -> dt.datetime:
+    if not value:
+        return dt.datetime.now(dt.timezone.utc)
+    return parsedate_to_datetime(value)
+
+
+def create_storage(settings: Settings) -> StorageBackend:
+    """依設定建立儲存後端"""
+    backend = settings.storage_backend.lower()
+    if backend == "local":
+        return LocalStorage(settings.images_dir)
+    if backend == "s3":
+        return S3Storage(
+            bucket=settings.s3_bucket,
+            access_key_id=settings.s3_access_key_id,
+            secret_access_key=settings.s3_secret_access_key,
+            region=settings.s3_region,
+            endpoint_url=settings.s3_endpoint_url or None,
+            prefix=settings.s3_prefix,
+            part_size=settings.s3_multipart_chunk_size,
+            max_connections=settings.s3_max_connections,
+        )
+    raise ValueError(f"未知的儲存後端: {settings.storage_backend}（可用: local, s3）")
@@ -0,0 +1,103 @@
+"""文字排版服務.
+
+以字體實際的字元寬度（advance width）計算換行，取代以固定字數切行的估算，
+讓表格列高與分頁計算和 ReportLab 實際繪製的結果一致。
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List
+
+from reportlab.pdfbase import pdfmetrics
+
+# 中日韓文字可在任意字元間換行；拉丁文字以單字為單位換行
+_CJK_RANGES = (
+    "\u2e80-\u9fff"          # CJK 部首、符號、假名、統一漢字
+    "\uac00-\ud7af"          # 韓文音節
+    "\uf900-\ufaff"          # CJK 相容漢字
+    "\ufe30-\ufe4f"          # CJK 相容標點
+    "\uff00-\uffef"          # 全形字元
+    "\U00020000-\U0002fa1f"  # CJK 擴充區
+)
+_TOKEN_PATTERN = re.compile(rf"\s+|[{_CJK_RANGES}]|[^\s{_CJK_RANGES}]+")
+
+# 字寬以 1000 單位的字級量測並快取，使用時再依實際字級縮放
+_UNITS_PER_EM = 1000
+
+
+class TextLayout:
+    """以字體字寬量測文字並計算換行的排版器"""
+
+    def __init__(self, font_name: str):
+        self.font_name = font_name
+        self._widths: Dict[str, float] = {}
+
+    def char_width(self, char: str) -> float:
+        """取得單一字元的寬度（1000 單位），結果依字元快取"""
+        width = self._widths.get(char)
+        if width is None:
+            width = self._widths[char] = pdfmetrics.stringWidth(char, self.font_name, _UNITS_PER_EM)
+        return width
+
+    def measure(self, text: str, font_size: float) -> float:
+        """量測文字在指定字級下的寬度（pt）"""
+        return self._units(text) * font_size / _UNITS_PER_EM
+
+    def wrap(self, text: str, max_width: float, font_size: float) -> List[str]:
+        """將文字依可用寬度換行
+
+        Args:
+            text: 要排版的文字，保留原有的換行符號
+            max_width: 可用寬度（pt）
+            font_size: 字級（pt）
+
+        Returns:
+            List[str]: 每一行的文字，空字串至少回傳一行
+        """
+        limit = max_width * _UNITS_PER_EM / font_size
+        lines: List[str] = []
+        for paragraph in (text or "").split("\n"):
+            lines.extend(self._wrap_paragraph(paragraph, limit))
+        return lines
+
+    def _units(self, text: str) -> float:
+        return sum(self.char_width(char) for char in text)
+
+    def _wrap_paragraph(self, paragraph: str, limit: float) -> List[str]:
+        lines: List[str] = []
+        line = ""
+        width = 0.0
+
+        for token in _TOKEN_PATTERN.findall(paragraph):
+            token_width = self._units(token)
+            if token.isspace():
+                # 行首的空白不保留，行尾的空白在換行時去除
+                if line:
+                    line += token
+                    width += token_width
+                continue
+
+            if width + token_width <= limit:
+                line += token
+                width += token_width
+            elif token_width <= limit:
+                lines.append(line.rstrip())
+                line, width = token, token_width
+            else:
+                # 比整行還長的單字只能逐字斷開
+                for char in token:
+                    char_width = self.char_width(char)
+                    if line and width + char_width > limit:
+                        lines.append(line.rstrip())
+                        line, width = "", 0.0
+                    line += char
+                    width += char_width
+
+        lines.append(line.rstrip())
+        return lines
+
+
+@lru_cache()
+def get_text_layout(font_name: str) -> TextLayout:
+    """取得指定字體共用的排版器（字寬快取跨請求共用）"""
+    return TextLayout(font_name)
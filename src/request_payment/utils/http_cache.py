@@ -0,0 +1,95 @@
+"""HTTP 條件式請求與範圍請求工具函數."""
+
+import hashlib
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+# 分段讀取檔案時每次讀取的位元組數
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 標頭指定的範圍超出檔案大小"""
+
+
+def make_etag(content: bytes) -> str:
+    """以內容雜湊產生強 ETag（內容相同才會相同）"""
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+def make_file_etag(file: BinaryIO) -> str:
+    """分段讀取檔案產生與 make_etag 相同的 ETag，讀取後移回開頭"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return '"' + digest.hexdigest()[:32] + '"'
+
+
+def iter_file_range(file: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """分段讀取檔案中包含頭尾的 [start, end] 範圍"""
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = file.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """檢查 If-None-Match 是否包含指定的 ETag
+
+    If-None-Match 使用弱比較，W/ 前綴可忽略；"*" 符合任何 ETag。
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析單一範圍的 Range 標頭
+
+    Args:
+        header: Range 標頭，例如 "bytes=0-1023"、"bytes=1024-"、"bytes=-500"
+        size: 完整內容的位元組數
+
+    Returns:
+        Optional[Tuple[int, int]]: 包含頭尾的 (start, end)；沒有標頭、格式無法解析
+        或要求多個範圍時回傳 None，由呼叫端回傳完整內容
+
+    Raises:
+        RangeNotSatisfiable: 範圍完全落在內容之外
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, separator, last = ranges.strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # 後綴範圍：最後 N 個位元組
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable(header)
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
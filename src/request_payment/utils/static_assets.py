@@ -0,0 +1,138 @@
+"""靜態檔案預先壓縮與快取標頭.
+
+建置時以 ``python -m src.request_payment.utils.static_assets static`` 在每個
+可壓縮的靜態檔案旁產生 .gz（與安裝 brotli 時的 .br）版本，執行時
+PrecompressedStaticFiles 依 Accept-Encoding 直接回傳預先壓縮的檔案，
+不需要每次請求重新壓縮。
+"""
+
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from ..core.compression import brotli, is_compressible_type, negotiate_encoding
+from .http_cache import etag_matches
+
+# 編碼 → 預先壓縮檔案的副檔名，依偏好順序排列
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def precompress_directory(directory: str, minimum_size: int = 256) -> List[str]:
+    """為目錄中可壓縮的檔案產生預先壓縮的版本
+
+    壓縮結果不比原始檔小時不產生；gzip 的 mtime 固定為 0，相同內容每次
+    建置產生相同的檔案與 ETag。
+
+    Returns:
+        List[str]: 產生的檔案路徑
+    """
+    written = []
+    for path in sorted(Path(directory).rglob("*")):
+        if not path.is_file() or path.suffix in PRECOMPRESSED_SUFFIXES.values():
+            continue
+        if not is_compressible_type(mimetypes.guess_type(path.name)[0]):
+            continue
+        data = path.read_bytes()
+        if len(data) < minimum_size:
+            continue
+
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            target = path.with_name(path.name + suffix)
+            if len(compressed) >= len(data):
+                target.unlink(missing_ok=True)
+                continue
+            target.write_bytes(compressed)
+            written.append(str(target))
+    return written
+
+
+@lru_cache(maxsize=256)
+def _content_etag(path: str, mtime_ns: int, size: int) -> str:
+    """以內容雜湊產生強 ETag；檔案改變時 mtime 或大小不同，快取自然失效"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return '"' + digest.hexdigest()[:32] + '"'
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """優先回傳預先壓縮檔案的 StaticFiles，並加上內容 ETag 與 Cache-Control"""
+
+    def __init__(self, *args, cache_control: str = "no-cache", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+
+        variants = {
+            encoding: full_path + suffix
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items()
+            if os.path.isfile(full_path + suffix)
+        }
+        encoding = negotiate_encoding(request_headers.get("accept-encoding"), list(variants))
+        path: Optional[str] = variants.get(encoding)
+        if path is not None:
+            stat_result = os.stat(path)
+        else:
+            path = full_path
+
+        response = FileResponse(
+            path, status_code=status_code, stat_result=stat_result, method=scope["method"], media_type=media_type
+        )
+        response.headers["ETag"] = _content_etag(path, stat_result.st_mtime_ns, stat_result.st_size)
+        response.headers["Cache-Control"] = self.cache_control
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if variants:
+            response.headers.add_vary_header("Accept-Encoding")
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        # If-None-Match 使用弱比較：即時壓縮時中介層把 ETag 改為 W/ 開頭，
+        # 瀏覽器帶回的 W/ ETag 也要能得到 304
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, response_headers["etag"])
+        return super().is_not_modified(response_headers, request_headers)
+
+
+def main() -> int:
+    """主函數"""
+    parser = argparse.ArgumentParser(description="預先壓縮靜態檔案（產生 .gz / .br）")
+    parser.add_argument("directory", nargs="?", default="static", help="靜態檔案目錄")
+    parser.add_argument("--min-size", type=int, default=256, help="小於此位元組數的檔案不壓縮")
+    args = parser.parse_args()
+
+    for path in precompress_directory(args.directory, args.min_size):
+        print(f"{path} ({os.path.getsize(path)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
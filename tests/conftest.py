@@ -0,0 +1,6 @@
+"""pytest 設定：自專案根目錄匯入 src 套件"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,41 @@
+"""明細匯出（CSV / XLSX）測試"""
+
+import io
+import zipfile
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from src.request_payment.services.form_export import EXPORT_COLUMNS, iter_xlsx
+
+_NS = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+def _rows(count):
+    # 最後一欄與實際匯出相同，為文字欄位（備註憑證）
+    return [
+        ["113.01.15", f"受款人{index}", Decimal("100.50") + index, "發票"]
+        for index in range(count)
+    ]
+
+
+def _sheet_rows(rows):
+    data = b"".join(iter_xlsx(rows))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    return sheet.findall("s:sheetData/s:row", _NS)
+
+
+def test_xlsx_row_numbers_are_sequential():
+    rows = _sheet_rows(_rows(1200))
+    assert [row.get("r") for row in rows] == [str(number) for number in range(1, 1202)]
+
+
+def test_xlsx_cells_keep_numbers_and_text():
+    header, first = _sheet_rows(_rows(1))
+    assert [cell.findtext("s:is/s:t", namespaces=_NS) for cell in header] == EXPORT_COLUMNS
+    cells = list(first)
+    assert cells[2].get("t") is None
+    assert cells[2].findtext("s:v", namespaces=_NS) == "100.50"
+    assert cells[3].get("t") == "inlineStr"
+    assert cells[3].findtext("s:is/s:t", namespaces=_NS) == "發票"
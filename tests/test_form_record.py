@@ -0,0 +1,101 @@
+"""請款單紀錄的金額保存測試：Decimal 位數、負數、溢位與非有限數"""
+
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from src.request_payment.services.form_record import DetailRows, FormRecord, _pack_amounts
+
+
+def _item(amount):
+    return {
+        "project_type": "D.學校訪談",
+        "expense_type": "1.交通費",
+        "execution_time": None,
+        "execution_content": "台北座談會",
+        "receipt_note": None,
+        "amount": amount,
+    }
+
+
+def _record(*amounts):
+    form = {
+        "application_date": "113.01.15",
+        "payee": "王小明",
+        "payment_method": "匯款",
+        "payment_method_other": None,
+        "requesting_unit": "行政財務執委會",
+        "requesting_unit_other": None,
+        "payment_details": [_item(amount) for amount in amounts],
+    }
+    return FormRecord("form-1", form, bank_book=None, created_at=datetime(2024, 1, 15))
+
+
+def _assert_same_decimals(actual, expected):
+    # Decimal("100.50") == Decimal("100.5")，以 as_tuple 比對位數與指數
+    assert [value.as_tuple() for value in actual] == [value.as_tuple() for value in expected]
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["100.50", "100.5", "100", "1E+3", "0.00", "-100.50", "-0.01", "9223372036854775807", "1.2E-127"],
+)
+def test_amount_round_trip_keeps_digits(text):
+    rows = DetailRows([_item(Decimal(text))])
+
+    assert rows._exponents is not None  # 以整數係數與指數保存
+    _assert_same_decimals([rows[0].amount], [Decimal(text)])
+    assert str(rows.amount(0)) == text
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "9223372036854775808",  # 係數超過 64 位元
+        "1E+128",  # 指數超出 signed char
+        "1E-129",
+        "NaN",  # 沒有係數位數（ValueError）
+        "Infinity",  # 指數不是整數（TypeError）
+    ],
+)
+def test_unpackable_amounts_fall_back_to_decimals(text):
+    amounts = [Decimal("100.50"), Decimal(text)]
+
+    units, exponents = _pack_amounts(amounts)
+
+    assert exponents is None
+    assert units == tuple(amounts)
+    rows = DetailRows([_item(amount) for amount in amounts])
+    _assert_same_decimals(rows.amounts(), amounts)
+
+
+def test_total_amount_keeps_trailing_zeros():
+    record = _record(Decimal("100.50"), Decimal("20.25"), Decimal("-0.75"))
+
+    assert record.total_amount == Decimal("120.00")
+    assert str(record.total_amount) == "120.00"
+    assert str(record["total_amount"]) == "120.00"
+    assert [str(amount) for amount in record.payment_details.amounts()] == ["100.50", "20.25", "-0.75"]
+
+
+def test_total_amount_of_overflowing_amounts():
+    record = _record(Decimal("1E+200"), Decimal("0.10"))
+
+    assert record.total_amount == Decimal("1E+200") + Decimal("0.10")
+
+
+def test_total_amount_without_rows_is_decimal():
+    total = _record().total_amount
+
+    assert isinstance(total, Decimal)
+    assert total == 0
+
+
+def test_response_keeps_amounts():
+    response = _record(Decimal("100.50"), Decimal("-20.00")).to_response()
+
+    _assert_same_decimals(
+        [detail.amount for detail in response.payment_details], [Decimal("100.50"), Decimal("-20.00")]
+    )
+    assert str(response.total_amount) == "80.50"
@@ -0,0 +1,97 @@
+"""Range 標頭解析與 If-None-Match 比對測試"""
+
+import io
+
+import pytest
+
+from src.request_payment.utils.http_cache import (
+    RangeNotSatisfiable,
+    etag_matches,
+    iter_file_range,
+    make_etag,
+    make_file_etag,
+    parse_range,
+)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=0-0", (0, 0)),
+        ("bytes=10-", (10, 999)),
+        ("bytes=900-5000", (900, 999)),  # 結尾超出內容時截到最後一個位元組
+        ("bytes=999-999", (999, 999)),
+        ("bytes=-1", (999, 999)),
+        ("bytes=-500", (500, 999)),
+        ("bytes=-5000", (0, 999)),  # 後綴長度超過內容時回傳完整內容
+        ("Bytes = 0-9", (0, 9)),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        None,
+        "",
+        "bytes=0-9,20-29",  # 多個範圍不支援，改回傳完整內容
+        "bytes=-5,10-",
+        "items=0-9",
+        "bytes=abc",
+        "bytes=a-9",
+        "bytes=9-0",
+    ],
+)
+def test_parse_range_falls_back_to_full_content(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-2000", "bytes=5000-", "bytes=-0"])
+def test_parse_range_outside_content(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 1000)
+
+
+def test_parse_range_on_empty_content():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=0-0", 0)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=-10", 0)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),  # If-None-Match 使用弱比較
+        ('"xyz", W/"abc"', True),
+        ('"xyz",W/"abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+        ('"ABC"', False),
+        ('abc', False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_file_etag_matches_content_etag():
+    content = bytes(range(256)) * 1000
+    file = io.BytesIO(content)
+
+    assert make_file_etag(file) == make_etag(content)
+    assert file.tell() == 0
+
+
+def test_iter_file_range():
+    content = bytes(range(256)) * 1000
+    file = io.BytesIO(content)
+
+    assert b"".join(iter_file_range(file, 70_000, 200_000)) == content[70_000:200_001]
+    assert b"".join(iter_file_range(file, 255_990, 300_000)) == content[255_990:]
@@ -0,0 +1,158 @@
+"""IdempotentRoute 回放、並行重複請求與 multipart 內容指紋測試"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+
+from src.request_payment.core import idempotency
+from src.request_payment.core.idempotency import (
+    IDEMPOTENCY_KEY_HEADER,
+    REPLAYED_HEADER,
+    IdempotentRoute,
+    _BodyHasher,
+)
+
+
+class _Endpoint:
+    """建立紀錄的假端點：記錄每一次實際執行，可指定先失敗幾次"""
+
+    def __init__(self):
+        self.records = []
+        self.failures = 0
+        self.delay = 0.0
+
+    def app(self) -> FastAPI:
+        router = APIRouter(route_class=IdempotentRoute)
+
+        @router.post("/records", status_code=201)
+        async def create_record(payload: dict):
+            await asyncio.sleep(self.delay)
+            if self.failures:
+                self.failures -= 1
+                raise HTTPException(status_code=503, detail="storage unavailable")
+            self.records.append(payload)
+            return {"id": len(self.records), **payload}
+
+        app = FastAPI()
+        app.include_router(router)
+        return app
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    # 每個測試使用獨立的快取，不受其他測試留下的紀錄影響
+    monkeypatch.setattr(idempotency, "_caches", {})
+    return _Endpoint()
+
+
+def _post(endpoint: _Endpoint, *requests):
+    """以同一個 app 並行送出多個 (json, key) 請求"""
+
+    async def send():
+        transport = httpx.ASGITransport(app=endpoint.app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/records", json=body, headers={IDEMPOTENCY_KEY_HEADER: key} if key else {})
+                for body, key in requests
+            ))
+
+    return asyncio.run(send())
+
+
+def test_key_replays_original_response(endpoint):
+    original = _post(endpoint, ({"payee": "王小明"}, "key-1"))[0]
+    replay = _post(endpoint, ({"payee": "王小明"}, "key-1"))[0]
+
+    assert original.status_code == 201 and REPLAYED_HEADER not in original.headers
+    assert replay.status_code == 201
+    assert replay.headers[REPLAYED_HEADER] == "true"
+    assert replay.headers["content-type"] == "application/json"
+    assert replay.json() == original.json()
+    assert len(endpoint.records) == 1
+
+
+def test_identical_body_without_key_is_replayed(endpoint):
+    first = _post(endpoint, ({"payee": "王小明"}, None))
+    duplicate = _post(endpoint, ({"payee": "王小明"}, None))
+
+    assert duplicate[0].headers[REPLAYED_HEADER] == "true"
+    assert duplicate[0].json() == first[0].json()
+    assert len(endpoint.records) == 1
+
+
+def test_concurrent_duplicates_create_one_record(endpoint):
+    endpoint.delay = 0.05
+
+    responses = _post(endpoint, *[({"payee": "王小明"}, "key-1")] * 5)
+
+    assert len(endpoint.records) == 1
+    assert {response.status_code for response in responses} == {201}
+    assert sum(REPLAYED_HEADER in response.headers for response in responses) == 4
+    assert len({response.content for response in responses}) == 1
+
+
+def test_reused_key_with_different_body_is_rejected(endpoint):
+    _post(endpoint, ({"payee": "王小明"}, "key-1"))
+
+    response = _post(endpoint, ({"payee": "李大華"}, "key-1"))[0]
+
+    assert response.status_code == 422
+    assert len(endpoint.records) == 1
+
+
+def test_retry_after_server_error_runs_again(endpoint):
+    endpoint.failures = 1
+
+    failed = _post(endpoint, ({"payee": "王小明"}, "key-1"))[0]
+    retried = _post(endpoint, ({"payee": "王小明"}, "key-1"))[0]
+
+    assert failed.status_code == 503
+    assert retried.status_code == 201 and REPLAYED_HEADER not in retried.headers
+    assert len(endpoint.records) == 1
+
+
+def test_invalid_key_is_rejected(endpoint):
+    response = _post(endpoint, ({"payee": "王小明"}, "x" * 256))[0]
+
+    assert response.status_code == 400
+    assert endpoint.records == []
+
+
+def _multipart(boundary: str) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="payee"\r\n\r\n'
+        "王小明\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="bank_book"; filename="book.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+        f"{'x' * 300}\r\n"
+        f"--{boundary}--\r\n"
+    ).encode()
+
+
+def _fingerprint(body: bytes, boundary: str, chunk_size: int) -> str:
+    request = SimpleNamespace(headers={"content-type": f"multipart/form-data; boundary={boundary}"})
+    hasher = _BodyHasher(request)
+    for start in range(0, len(body), chunk_size):
+        hasher.update(body[start:start + chunk_size])
+    return hasher.hexdigest()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100_000])
+def test_multipart_fingerprint_ignores_boundary(chunk_size):
+    # boundary 可能跨越兩個區塊，不同的切分方式都應得到相同的指紋
+    firefox = "----geckoformboundary3f2c8a91d0e4"
+    chrome = "----WebKitFormBoundary7MA4YWxkTrZu0gW"
+
+    assert _fingerprint(_multipart(firefox), firefox, chunk_size) == _fingerprint(_multipart(chrome), chrome, 100_000)
+
+
+def test_multipart_fingerprint_distinguishes_content():
+    boundary = "----WebKitFormBoundary7MA4YWxkTrZu0gW"
+    edited = _multipart(boundary).replace("王小明".encode(), "李大華".encode())
+
+    assert _fingerprint(_multipart(boundary), boundary, 64) != _fingerprint(edited, boundary, 64)
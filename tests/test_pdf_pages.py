@@ -0,0 +1,140 @@
+"""逐頁渲染與頁面快取測試（拼接以假的 merge_pages 取代，不需要 qpdf）"""
+
+import io
+import re
+from decimal import Decimal
+
+import pytest
+from PIL import Image
+
+from src.request_payment.services import pdf_service
+from src.request_payment.services.bank_book import BankBookImage
+from src.request_payment.services.page_cache import PageCache
+
+_PAGE_OBJECT = re.compile(rb"/Type /Page\b(?!s)")
+
+
+class _Recorder:
+    """實際渲染的頁碼與每次拼接的頁面"""
+
+    def __init__(self):
+        self.rendered = []
+        self.merged = []
+
+
+@pytest.fixture(scope="module")
+def service():
+    return pdf_service.PDFService()
+
+
+@pytest.fixture
+def renders(service, monkeypatch):
+    """啟用頁面快取並記錄實際渲染的頁碼；拼接結果為各頁位元組串接"""
+    recorder = _Recorder()
+
+    def fake_merge(shell, pages, linearize=False):
+        recorder.merged.append(pages)
+        return b"%PDF-merged" + b"".join(pages)
+
+    monkeypatch.setattr(pdf_service, "merge_pages", fake_merge)
+    monkeypatch.setattr(service, "page_cache", PageCache(64 * 1024 * 1024))
+    render_page = service._render_page
+
+    def spy(data, flowables, page_number, *args):
+        recorder.rendered.append(page_number)
+        return render_page(data, flowables, page_number, *args)
+
+    monkeypatch.setattr(service, "_render_page", spy)
+    return recorder
+
+
+def _bank_book() -> BankBookImage:
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "navy").save(buffer, format="PNG")
+    return BankBookImage(buffer.getvalue(), 400, 300, "PNG")
+
+
+def _form(bank_book, rows=40):
+    details = [
+        {
+            "project_type": "D.學校訪談",
+            "expense_type": "1.交通費",
+            "execution_time": "",
+            "execution_content": f"台北座談會第{index}場",
+            "amount": Decimal("100.50"),
+        }
+        for index in range(rows)
+    ]
+    return {
+        "id": "form-1",
+        "version": 1,
+        "application_date": "113.01.15",
+        "payee": "王小明",
+        "payment_method": "匯款",
+        "requesting_unit": "行政財務執委會",
+        "total_amount": sum(item["amount"] for item in details),
+        "payment_details": details,
+        "bank_book": bank_book,
+    }
+
+
+def test_every_page_is_a_single_page_pdf(service, renders):
+    service.generate_payment_request_pdf(_form(_bank_book()), engine="pages")
+
+    pages = renders.merged[-1]
+    assert renders.rendered == list(range(1, len(pages) + 1))
+    assert len(pages) >= 4  # 至少兩頁請款單、黏貼單與存摺影本頁
+    assert all(len(_PAGE_OBJECT.findall(page)) == 1 for page in pages)
+
+
+def test_text_edit_rerenders_only_its_page(service, renders):
+    bank_book = _bank_book()
+    service.generate_payment_request_pdf(_form(bank_book), engine="pages")
+    before = renders.merged[-1]
+    renders.rendered.clear()
+
+    service.generate_payment_request_pdf(_form(bank_book), engine="pages")
+    assert renders.rendered == []  # 輸入完全相同時全部來自快取
+
+    edited = _form(bank_book)
+    edited["payment_details"][39]["execution_content"] = "高雄理監事會議"
+    service.generate_payment_request_pdf(edited, engine="pages")
+
+    after = renders.merged[-1]
+    changed = [number for number, (old, new) in enumerate(zip(before, after), start=1) if old != new]
+    assert renders.rendered == changed and len(changed) == 1
+    # 單據黏貼單與存摺影本頁原樣重用
+    assert after[-2:] == before[-2:]
+
+
+def test_amount_edit_rerenders_payment_pages_only(service, renders):
+    bank_book = _bank_book()
+    service.generate_payment_request_pdf(_form(bank_book), engine="pages")
+    page_count = len(renders.merged[-1])
+    renders.rendered.clear()
+
+    edited = _form(bank_book)
+    edited["payment_details"][0]["amount"] = Decimal("1")
+    edited["total_amount"] = sum(item["amount"] for item in edited["payment_details"])
+    service.generate_payment_request_pdf(edited, engine="pages")
+
+    # 總計印在每一頁請款單的簽名區域上方
+    assert renders.rendered == list(range(1, page_count - 1))
+
+
+def test_falls_back_to_full_render_without_qpdf(service, renders, monkeypatch):
+    monkeypatch.setattr(pdf_service, "merge_pages", lambda shell, pages, linearize=False: None)
+
+    pdf = service.generate_payment_request_pdf(_form(_bank_book()), engine="pages").getvalue()
+
+    assert pdf.startswith(b"%PDF-")
+    assert len(_PAGE_OBJECT.findall(pdf)) == len(renders.rendered)
+
+
+def test_auto_engine_renders_whole_document_without_page_cache(service, monkeypatch):
+    monkeypatch.setattr(service, "page_cache", None)
+    monkeypatch.setattr(pdf_service, "merge_pages", pytest.fail)
+
+    pdf = service.generate_payment_request_pdf(_form(_bank_book())).getvalue()
+
+    assert pdf.startswith(b"%PDF-")
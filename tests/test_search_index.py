@@ -0,0 +1,135 @@
+"""全文檢索的切分、單字查詢、更新與查詢中刪除測試"""
+
+from src.request_payment.services.search_index import SearchIndex, document_tokens, tokenize
+
+
+def _record(payee, *contents, **fields):
+    return {
+        "payee": payee,
+        "payment_details": [{"execution_content": content, "receipt_note": None} for content in contents],
+        **fields,
+    }
+
+
+def _keys(index, query, **kwargs):
+    return [key for key, _ in index.search(query, **kwargs)[1]]
+
+
+def test_tokenize():
+    assert tokenize("交通費") == ["交通", "通費"]
+    assert tokenize("王") == ["王"]
+    assert tokenize("Taxi 台北101") == ["taxi", "台北", "101"]
+    # 全形英數字正規化為半形、英文轉小寫
+    assert tokenize("ＡＢＣ１２３") == ["abc123"]
+    assert tokenize("會議，餐費") == ["會議", "餐費"]
+    assert tokenize("") == [] and tokenize(None) == []
+
+
+def test_document_tokens_weights_fields():
+    tokens = document_tokens(_record("王小明", "王小明交通費"))
+
+    assert tokens["王小"] == 4 + 1  # 受款人權重 4，執行內容權重 1
+    assert tokens["交通"] == 1
+
+
+def test_multi_token_query_requires_all_tokens():
+    index = SearchIndex()
+    index.add("a", _record("王小明", "台北座談會交通費"))
+    index.add("b", _record("李大華", "台北座談會餐費"))
+
+    assert sorted(_keys(index, "台北座談")) == ["a", "b"]
+    assert _keys(index, "座談 交通") == ["a"]
+    assert _keys(index, "高雄") == []
+    assert index.search("，，")[0] == 0
+
+
+def test_payee_ranks_before_content():
+    index = SearchIndex()
+    index.add("content", _record("李大華", "轉交王小明"))
+    index.add("payee", _record("王小明", "交通費"))
+
+    assert _keys(index, "王小明") == ["payee", "content"]
+
+
+def test_single_cjk_character_query():
+    index = SearchIndex()
+    index.add("bigram", _record("王小明", "交通費"))
+    index.add("single", _record("王", "餐費"))
+    index.add("other", _record("李大華", "住宿"))
+
+    # 單字經由包含它的 bigram（王小）或單獨的字 token（王）比對
+    assert sorted(_keys(index, "王")) == ["bigram", "single"]
+    assert sorted(_keys(index, "費")) == ["bigram", "single"]
+    assert _keys(index, "宿") == ["other"]
+    assert _keys(index, "費 住") == []
+
+
+def test_replace_removes_old_postings():
+    index = SearchIndex()
+    old = _record("王小明", "台北座談會")
+    new = _record("王小明", "高雄理監事會議")
+    index.add("a", old)
+
+    index.replace("a", old, new)
+
+    assert _keys(index, "台北") == [] and _keys(index, "台") == []
+    assert _keys(index, "高雄") == ["a"] and _keys(index, "雄") == ["a"]
+    assert "台北" not in index._postings
+    assert "台北" not in index._char_tokens["台"]
+    assert len(index) == 1
+
+
+def test_remove():
+    index = SearchIndex()
+    record = _record("王小明", "交通費")
+    index.add("a", record)
+    index.add("b", _record("王小明", "餐費"))
+
+    index.remove("a", record)
+
+    assert _keys(index, "王小明") == ["b"]
+    assert len(index) == 1
+    index.remove("a", record)  # 已移除的請款單再次移除不影響索引
+    assert len(index) == 1
+
+
+def test_document_removed_mid_query_is_skipped():
+    index = SearchIndex()
+    records = {key: _record("王小明", f"交通費{key}") for key in ("a", "b", "c")}
+    for key, record in records.items():
+        index.add(key, record)
+    group_scores = index._group_scores
+
+    def remove_while_scoring(group, numbers):
+        # 計分在鎖外進行；此時刪除的請款單仍在快照中，但不應出現在結果裡
+        index.remove("b", records["b"])
+        return group_scores(group, numbers)
+
+    index._group_scores = remove_while_scoring
+    total, page = index.search("王小明")
+
+    assert total == 3
+    assert sorted(key for key, _ in page) == ["a", "c"]
+
+
+def test_pagination_prefers_newer_on_ties():
+    index = SearchIndex()
+    for key in "abcde":
+        index.add(key, _record("王小明", "交通費"))
+
+    total, page = index.search("交通", limit=2)
+
+    assert total == 5
+    assert [key for key, _ in page] == ["e", "d"]
+    assert _keys(index, "交通", offset=2, limit=2) == ["c", "b"]
+
+
+def test_rebuild():
+    index = SearchIndex()
+    index.add("stale", _record("李大華", "住宿"))
+
+    count = index.rebuild([("a", _record("王小明", "交通費"))])
+
+    assert count == 1
+    assert _keys(index, "住宿") == []
+    assert _keys(index, "交通") == ["a"]
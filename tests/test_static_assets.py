@@ -0,0 +1,43 @@
+"""靜態檔案快取標頭與 ETag 重新驗證測試"""
+
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from src.request_payment.core.compression import CompressionMiddleware
+from src.request_payment.utils.static_assets import PrecompressedStaticFiles
+
+
+def _client(directory) -> TestClient:
+    app = Starlette(routes=[Mount("/static", PrecompressedStaticFiles(directory=str(directory)))])
+    app.add_middleware(CompressionMiddleware, minimum_size=16)
+    return TestClient(app)
+
+
+def test_unversioned_files_are_revalidated(tmp_path):
+    (tmp_path / "app.js").write_text("console.log('請款單');\n" * 100, encoding="utf-8")
+    client = _client(tmp_path)
+
+    for encoding in ("identity", "gzip"):
+        response = client.get("/static/app.js", headers={"Accept-Encoding": encoding})
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "no-cache"
+
+        revalidated = client.get(
+            "/static/app.js",
+            headers={"Accept-Encoding": encoding, "If-None-Match": response.headers["ETag"]},
+        )
+        assert revalidated.status_code == 304
+
+
+def test_changed_file_is_not_reported_unmodified(tmp_path):
+    path = tmp_path / "app.js"
+    path.write_text("version = 1;\n" * 100, encoding="utf-8")
+    client = _client(tmp_path)
+    etag = client.get("/static/app.js").headers["ETag"]
+
+    path.write_text("version = 2;\n" * 100, encoding="utf-8")
+    response = client.get("/static/app.js", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert "version = 2" in response.text